@@ -0,0 +1,92 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from wmtexe.extract import extract_tarball, UnsafeArchiveError
+
+
+def _add_symlink(tar, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tar.addfile(info)
+
+
+def _add_file(tar, name, contents):
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    tar.addfile(info, io.BytesIO(contents))
+
+
+@pytest.mark.parametrize('max_workers', [None, 4])
+def test_chained_symlinks_cannot_escape(tmpdir, max_workers):
+    victim = tmpdir.join('victim')
+    victim.write('original')
+    dest = tmpdir.mkdir('dest')
+
+    tarball = str(tmpdir.join('evil.tar'))
+    with tarfile.open(tarball, 'w') as tar:
+        _add_symlink(tar, 'run/deep/s', '..')
+        _add_symlink(tar, 'run/deep/t', 's/../../victim')
+        _add_file(tar, 'run/deep/t', b'pwned')
+
+    with pytest.raises(UnsafeArchiveError):
+        extract_tarball(tarball, dest=str(dest), max_workers=max_workers)
+
+    assert victim.read() == 'original'
+
+
+def test_parent_symlink_is_rejected(tmpdir):
+    outside = tmpdir.mkdir('outside')
+    dest = tmpdir.mkdir('dest')
+
+    tarball = str(tmpdir.join('evil.tar'))
+    with tarfile.open(tarball, 'w') as tar:
+        _add_symlink(tar, 'run/link', '.')
+        _add_file(tar, 'run/link/file', b'data')
+
+    os.symlink(str(outside), str(dest.join('run')))
+    with pytest.raises(UnsafeArchiveError):
+        extract_tarball(tarball, dest=str(dest))
+
+    assert not outside.join('file').check()
+
+
+def test_extract_plain_archive(tmpdir):
+    dest = tmpdir.mkdir('dest')
+
+    tarball = str(tmpdir.join('run.tar'))
+    with tarfile.open(tarball, 'w') as tar:
+        _add_file(tar, 'run/a.txt', b'a')
+        _add_symlink(tar, 'run/b.txt', 'a.txt')
+
+    assert extract_tarball(tarball, dest=str(dest)) == 2
+    assert dest.join('run', 'b.txt').read() == 'a'
+
+
+@pytest.mark.parametrize('max_workers', [None, 4])
+def test_modes_are_sanitised(tmpdir, max_workers):
+    dest = tmpdir.mkdir('dest')
+
+    tarball = str(tmpdir.join('run.tar'))
+    with tarfile.open(tarball, 'w') as tar:
+        info = tarfile.TarInfo('run')
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o1777
+        tar.addfile(info)
+        for name, mode in [('run/suid', 0o4777), ('run/ro', 0o444)]:
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            info.mode = mode
+            tar.addfile(info, io.BytesIO(b'x'))
+
+    extract_tarball(tarball, dest=str(dest), max_workers=max_workers)
+
+    def mode(*path):
+        return os.stat(str(dest.join(*path))).st_mode & 0o7777
+
+    assert mode('run') == 0o755
+    assert mode('run', 'suid') == 0o755
+    assert mode('run', 'ro') == 0o644
@@ -4,8 +4,9 @@ from __future__ import print_function
 
 import sys
 import os
+import hashlib
 
-from ..env import WmtEnvironment
+from ..env import WmtEnvironment, PathList
 
 
 _ACTIVATE_SCRIPT = """
@@ -24,28 +25,17 @@ _PATH_NAMES = ['PATH', 'LD_LIBRARY_PATH', 'PYTHONPATH', 'LD_RUN_PATH',
 _VAR_NAMES = ['TAIL', 'CURL', 'BASH']
 
 
-def prepend_path(var, path, out=None):
-    path = os.path.abspath(path)
-
+def prepend_paths(var, paths, out=None):
     env = out or os.environ
-    try:
-        paths = env[var].split(os.pathsep)
-    except KeyError:
-        paths = []
-    else:
-        paths = [os.path.abspath(p) for p in paths]
 
-    try:
-        paths.remove(path)
-    except ValueError:
-        pass
+    path_list = PathList(env.get(var, ''), normalize=os.path.abspath)
+    path_list.prepend(paths)
 
-    env[var] = os.pathsep.join([path] + paths)
+    env[var] = str(path_list)
 
 
-def prepend_paths(var, paths, out=None):
-    for path in paths.split(os.pathsep)[::-1]:
-        prepend_path(var, path)
+def prepend_path(var, path, out=None):
+    prepend_paths(var, [path], out=out)
 
 
 def saved_var_name(name):
@@ -114,6 +104,115 @@ def activate(path, extra_bases=[]):
     print(os.linesep.join(environ_as_bash_commands(env)))
 
 
+def _probed_programs(path):
+    from ..config import load_configuration, _find_executable
+
+    config = load_configuration(path)
+    return [_find_executable(config.get('paths', option)) for option in
+            ('babel_config', 'cca_spec_babel_config', 'python')]
+
+
+def activation_key(path=None, extra_bases=[]):
+    """Hash of what goes into an activation script.
+
+    The key covers the contents of the configuration files and the
+    toolchain programs that are queried for paths, so it changes
+    whenever the script would. It is computed without running any of
+    them.
+    """
+    from ..config import configuration_paths
+
+    key = hashlib.sha1()
+    for fname in configuration_paths(path) + _probed_programs(path):
+        key.update(fname.encode('utf-8'))
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            continue
+        key.update(repr((stat.st_mtime, stat.st_size)).encode('utf-8'))
+        if not os.access(fname, os.X_OK):
+            with open(fname, 'rb') as fp:
+                key.update(fp.read())
+    for base in extra_bases:
+        key.update(os.path.abspath(base).encode('utf-8'))
+
+    return key.hexdigest()
+
+
+def _quote(value):
+    for char in ('\\', '"', '$', '`'):
+        value = value.replace(char, '\\' + char)
+    return '"%s"' % value
+
+
+def compile_activate_script(path=None, extra_bases=[]):
+    """Create a script that activates an environment when sourced.
+
+    The environment is worked out once, here, so sourcing the script
+    runs no programs. Paths are prepended to the variables of the
+    shell that sources it, and the old values are saved so that
+    ``wmt-deactivate`` can restore them.
+    """
+    env = WmtEnvironment.from_config(path)
+
+    paths = dict((name, PathList(env[name], normalize=os.path.abspath))
+                 for name in _PATH_NAMES)
+    for base in extra_bases:
+        paths['PATH'].prepend([os.path.join(base, 'bin')])
+        paths['LD_LIBRARY_PATH'].prepend([os.path.join(base, 'lib')])
+        paths['PYTHONPATH'].prepend(
+            [os.path.join(base, 'lib', 'python2.7', 'site-packages')])
+
+    lines = ['# wmt-activate key: %s' % activation_key(path, extra_bases),
+             '']
+    for name in _PATH_NAMES + _VAR_NAMES:
+        lines.append('if [ -n "${%s+x}" ]; then export %s="$%s"; fi' % (
+            name, saved_var_name(name), name))
+    for name in _PATH_NAMES:
+        lines.append('export %s=%s"${%s:+%s$%s}"' % (
+            name, _quote(str(paths[name])), name, os.pathsep, name))
+    for name in _VAR_NAMES:
+        lines.append('export %s=%s' % (name, _quote(env[name])))
+
+    return _ACTIVATE_SCRIPT.format(ENVIRONMENT=os.linesep.join(lines)) + '\n'
+
+
+def _script_key(dest):
+    try:
+        with open(dest, 'r') as fp:
+            for line in fp:
+                if line.startswith('# wmt-activate key: '):
+                    return line.split(':', 1)[1].strip()
+    except IOError:
+        pass
+    return None
+
+
+def write_activate_script(dest, path=None, extra_bases=[], force=False):
+    """Write an activation script, unless an up-to-date one exists.
+
+    Returns True if the script was written.
+    """
+    if not force and _script_key(dest) == activation_key(path, extra_bases):
+        return False
+
+    import tempfile
+
+    contents = compile_activate_script(path, extra_bases=extra_bases)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or '.',
+                               prefix='.' + os.path.basename(dest))
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(contents)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, dest)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+    return True
+
+
 def deactivate():
     env = restore_vars(_PATH_NAMES + _VAR_NAMES)
 
@@ -141,6 +240,16 @@ def activate_main():
                         default=None, help='WMT config file')
     parser.add_argument('--prepend-base', action='append', default=[],
                         help='Extra bases to include in environment')
+    parser.add_argument('--compile', metavar='SCRIPT', default=None,
+                        help='Write a script to source, if it is out of date')
+    parser.add_argument('--force', action='store_true',
+                        help='Write the script even if it is up to date')
     args = parser.parse_args()
 
-    activate(args.file, extra_bases=args.prepend_base)
+    if args.compile:
+        write_activate_script(args.compile, path=args.file,
+                              extra_bases=args.prepend_base,
+                              force=args.force)
+        print(os.path.abspath(args.compile))
+    else:
+        activate(args.file, extra_bases=args.prepend_base)
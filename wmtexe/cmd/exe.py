@@ -1,4 +1,8 @@
-"""Execute a WMT simulation."""
+"""Execute a WMT simulation.
+
+``wmt-exe <id>`` (or ``wmt-exe run <id>``) executes a run, and
+``wmt-exe gc`` removes stale runs from the execution directory.
+"""
 
 from __future__ import print_function
 
@@ -9,26 +13,50 @@ import subprocess
 from ..env import WmtEnvironment
 
 
-def main():
+_COMMANDS = ('run', 'gc')
+
+
+def main(argv=None):
     import argparse
-    import traceback
+
+    from . import gc
+
+    argv = sys.argv[1:] if argv is None else list(argv)
 
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('id', help='run ID')
-    parser.add_argument('--server-url',
-                        default='https://csdms.colorado.edu/wmt/api-dev',
-                        help='URL of WMT server')
-    parser.add_argument('--exec-dir', default=os.path.expanduser('~/.wmt'),
-                        help='path to execution directory')
-    parser.add_argument('--config', default=None,
-                        help='WMT site configuration file')
-    parser.add_argument('--show-env', action='store_true',
-                        help='print execution environment and exit')
-    parser.add_argument('--daemon', action='store_true', default=False,
-                        help='run in daemon mode')
-    parser.add_argument('--with-wmt-slave', default='wmt-slave',
-                        help='path to wmt-slave executable')
-    args = parser.parse_args()
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    run_parser = commands.add_parser(
+        'run', help='execute a simulation (the default command)',
+        description='Execute a WMT simulation.')
+    run_parser.add_argument('id', help='run ID')
+    run_parser.add_argument('--server-url',
+                            default='https://csdms.colorado.edu/wmt/api-dev',
+                            help='URL of WMT server')
+    run_parser.add_argument('--exec-dir',
+                            default=os.path.expanduser('~/.wmt'),
+                            help='path to execution directory')
+    run_parser.add_argument('--config', default=None,
+                            help='WMT site configuration file')
+    run_parser.add_argument('--show-env', action='store_true',
+                            help='print execution environment and exit')
+    run_parser.add_argument('--daemon', action='store_true', default=False,
+                            help='run in daemon mode')
+    run_parser.add_argument('--with-wmt-slave', default='wmt-slave',
+                            help='path to wmt-slave executable')
+
+    gc_parser = commands.add_parser(
+        'gc', help='remove stale runs from the execution directory',
+        description=gc.__doc__)
+    gc.add_arguments(gc_parser)
+
+    # ``wmt-exe <id>`` is short for ``wmt-exe run <id>``.
+    if not argv or argv[0] not in _COMMANDS + ('-h', '--help'):
+        argv = ['run'] + argv
+    args = parser.parse_args(argv)
+
+    if args.command == 'gc':
+        return gc.run(args)
 
     # env = WmtEnvironment.from_config(args.config)
 
@@ -0,0 +1,63 @@
+"""Remove stale runs from a WMT execution directory."""
+
+from __future__ import print_function
+
+import os
+
+from ..config import load_configuration
+from ..janitor import collect_garbage
+
+
+def _format_bytes(n_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n_bytes < 1024:
+            return '%.1f %s' % (n_bytes, unit)
+        n_bytes /= 1024.
+    return '%.1f TB' % n_bytes
+
+
+def add_arguments(parser):
+    """Add the options of ``wmt-exe gc`` to a parser."""
+    parser.add_argument('--exec-dir', default=None,
+                        help='path to execution directory')
+    parser.add_argument('--config', default=None,
+                        help='WMT site configuration file')
+    parser.add_argument('--max-size', default=None,
+                        help='maximum size of execution directory (e.g. 20G)')
+    parser.add_argument('--max-age', default=None,
+                        help='maximum age of a run (e.g. 7d)')
+    parser.add_argument('--keep', action='append', default=[],
+                        help='ID of a run to keep')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='show what would be removed')
+
+
+def run(args):
+    """Remove stale runs, as given by parsed ``wmt-exe gc`` options."""
+    config = load_configuration(args.config)
+    if args.exec_dir is None:
+        args.exec_dir = config.get('paths', 'exec_dir')
+    if args.max_size is None:
+        args.max_size = config.get('gc', 'max_size')
+    if args.max_age is None:
+        args.max_age = config.get('gc', 'max_age')
+
+    removed = collect_garbage(os.path.expanduser(args.exec_dir),
+                              max_size=args.max_size, max_age=args.max_age,
+                              keep=args.keep, dry_run=args.dry_run)
+
+    for run_id, size, reason in removed:
+        print('{id}: {size} ({reason})'.format(
+            id=run_id, size=_format_bytes(size), reason=reason))
+    print('{verb} {size}'.format(
+        verb='would reclaim' if args.dry_run else 'reclaimed',
+        size=_format_bytes(sum(size for _, size, _ in removed))))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='wmt-exe gc', description=__doc__)
+    add_arguments(parser)
+
+    return run(parser.parse_args(argv))
@@ -1,24 +1,29 @@
 """Get a WMT simulation.
 
 Connect to a WMT server and download a staged simulation using a universal
-unique identifier.
+unique identifier. With ``--bulk``, download and unpack many simulations
+at once (this needs Python 3).
 """
 
 from __future__ import print_function
 
 import os
 import sys
+import time
 import argparse
 import tarfile
 
-from ..task import download_run_tarball, DownloadError
+from ..task import (create_run_tarball, download_run_tarball,
+                    delete_run_tarball, DownloadError)
+from ..extract import extract_tarball
 from ..env import WmtEnvironment
 
 
 def download_or_exit(url, id, dest):
     try:
-        tarball = download_run_tarball(url, id,
-                                       dest_dir=dest)
+        info = create_run_tarball(url, id)
+        tarball = download_run_tarball(info, dest_dir=dest)
+        delete_run_tarball(url, id)
     except DownloadError as error:
         print('==> Error: %s' % error)
         sys.exit(1)
@@ -26,38 +31,13 @@ def download_or_exit(url, id, dest):
     return os.path.normpath(tarball)
 
 
-def unpack_or_exit(name, dest):
+def unpack_or_exit(name, dest, max_workers=None):
     try:
-        with tarfile.open(name, 'r') as tar:
-            def is_within_directory(directory, target):
-                
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-            
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-                
-                return prefix == abs_directory
-            
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-            
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-            
-                tar.extractall(path, members, numeric_owner=numeric_owner) 
-                
-            
-            safe_extract(tar, path=dest)
+        extract_tarball(name, dest=dest, dir_mode=0o777 - get_umask(),
+                        max_workers=max_workers)
     except tarfile.TarError as error:
         print('==> Error: %s' % error)
         sys.exit(1)
-    try:
-        base = name[:- len('.tar.gz')]
-        for r, _, _ in os.walk(base):
-            os.chmod(r, 0o777 - get_umask())
-    except OSError:
-        raise
 
 
 def get_umask():
@@ -66,16 +46,87 @@ def get_umask():
     return current_umask
 
 
+def _format_rate(n_bytes, seconds):
+    return '%.1f MB/s' % (n_bytes / 1e6 / max(seconds, 1e-6))
+
+
+def print_fetch_summary(results, elapsed):
+    """Print the status and throughput of fetched simulations.
+
+    Parameters
+    ----------
+    results : list of dict
+        Results from `wmtexe.engine.fetch_runs`.
+    elapsed : float
+        Total wall-clock seconds.
+
+    """
+    for result in results:
+        if result['status'] == 'ok':
+            print('{id}  ok     {size:10.1f} MB  {elapsed:6.1f} s  '
+                  '{rate}'.format(id=result['id'],
+                                  size=result['size'] / 1e6,
+                                  elapsed=result['elapsed'],
+                                  rate=_format_rate(result['size'],
+                                                    result['elapsed'])))
+        else:
+            print('{id}  error  {error}'.format(**result))
+
+    n_ok = sum(1 for result in results if result['status'] == 'ok')
+    n_bytes = sum(result['size'] for result in results)
+    print('==> {ok} of {total} runs fetched, {size:.1f} MB in {elapsed:.1f} s '
+          '({rate})'.format(ok=n_ok, total=len(results), size=n_bytes / 1e6,
+                            elapsed=elapsed,
+                            rate=_format_rate(n_bytes, elapsed)))
+
+
+def fetch_many(args):
+    from ..engine import fetch_runs
+
+    ids = [id for id in args.ids if id != '-']
+    if not ids or '-' in args.ids:
+        ids.extend(line.strip() for line in sys.stdin if line.strip())
+
+    def progress(result):
+        if args.verbose:
+            print('==> {id}: {status}'.format(**result))
+            sys.stdout.flush()
+
+    if args.verbose:
+        print('==> fetching %d runs from %s' % (len(ids), args.url))
+
+    start = time.time()
+    results = fetch_runs(args.url, ids, dest=args.dest or '.',
+                         max_downloads=args.jobs,
+                         unpack=args.unpack == 'yes', clean=args.clean,
+                         unpack_workers=args.unpack_workers,
+                         dir_mode=0o777 - get_umask(), callback=progress)
+    print_fetch_summary(results, time.time() - start)
+
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+
 def main():
     import argparse
     import traceback
 
     parser = argparse.ArgumentParser(
-        description="Download and unpack a WMT simulation")
-    parser.add_argument('id', help='Run ID')
-    parser.add_argument('dest', nargs='?', default='.',
+        description="Download and unpack a WMT simulation",
+        usage='%(prog)s [options] id [dest]\n'
+              '       %(prog)s --bulk [options] [id ...]')
+    parser.add_argument('ids', nargs='*', metavar='id',
+                        help='Run ID and, optionally, destination directory; '
+                        'with --bulk, any number of run IDs (read from '
+                        'stdin if none or -)')
+
+    parser.add_argument('--bulk', action='store_true',
+                        help='Download and unpack many simulations at once')
+    parser.add_argument('--dest', default=None,
                         help='Destination directory')
-
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='Maximum number of simultaneous downloads '
+                        '(with --bulk)')
     parser.add_argument('--url',
                         default='https://csdms.colorado.edu/wmt/api-dev',
                         help='URL of WMT server')
@@ -90,9 +141,21 @@ def main():
     parser.add_argument('--unpack', choices=('yes', 'no'),
                         default='yes',
                         help='Unpack the simulation tarball')
+    parser.add_argument('--unpack-workers', type=int, default=None,
+                        help='Number of threads to unpack files with')
 
     args = parser.parse_args()
 
+    if args.bulk:
+        return fetch_many(args)
+
+    if len(args.ids) not in (1, 2):
+        parser.error('expected a run ID and an optional destination')
+    args.id = args.ids[0]
+    if len(args.ids) == 2:
+        args.dest = args.ids[1]
+    args.dest = args.dest or '.'
+
     env = WmtEnvironment.from_config(args.config)
 
     if args.show_env:
@@ -109,7 +172,7 @@ def main():
         if args.verbose:
             print('==> unpacking %s' % tarball)
 
-        unpack_or_exit(tarball, args.dest)
+        unpack_or_exit(tarball, args.dest, max_workers=args.unpack_workers)
 
         if args.clean:
             print('==> removing %s' % tarball)
@@ -13,9 +13,8 @@ from cmt.component.model import Model
 def run(path):
     os.chdir(path)
 
-    import yaml
-    with open('model.yaml', 'r') as opened:
-        model = yaml.load(opened.read())
+    from ..yamlio import load_file
+    model = load_file('model.yaml')
 
     status_file = os.path.abspath(os.path.join(
         model['driver'], '_time.txt'))
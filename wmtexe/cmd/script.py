@@ -5,38 +5,38 @@ from __future__ import print_function
 import sys
 import os
 
-from ..launcher import BashLauncher, QsubLauncher, SbatchLauncher
+from ..launcher import TemplateRegistry, write_launch_scripts
 from ..config import load_configuration
 
 
-_LAUNCHERS = {
-    'bash': BashLauncher,
-    'qsub': QsubLauncher,
-    'sbatch': SbatchLauncher,
-}
-
-
 def main():
     import argparse
 
     parser = argparse.ArgumentParser(description=__doc__)
 
-    parser.add_argument('uuid', type=str,
+    parser.add_argument('uuid', type=str, nargs='+',
                         help='Unique identifier for simulation')
     parser.add_argument('--extra-args', default='',
                         help='Extra arguments for wmt-slave command')
     parser.add_argument('--server-url', default='',
                         help='WMT API server URL')
-    parser.add_argument('--launcher', choices=list(_LAUNCHERS.keys()),
-                        default='bash', help='Launch method')
+    parser.add_argument('--launcher', default='bash',
+                        help='Launch method (bash, qsub, sbatch or the '
+                        'name of a site template)')
     parser.add_argument('--config', default='',
                         help='WMT site configuration file')
     parser.add_argument('--run', action='store_true',
                         help='Launch simulation')
+    parser.add_argument('--write', action='store_true',
+                        help='Write launch scripts without launching')
 
     args = parser.parse_args()
 
     config = load_configuration(args.config)
+    templates = TemplateRegistry.from_config(config)
+    if args.launcher not in templates:
+        parser.error('{name}: unknown launcher (choose from {names})'.format(
+            name=args.launcher, names=', '.join(templates.names())))
     launch_dir = config.get('paths', 'launch_dir')
     exec_dir = config.get('paths', 'exec_dir')
 
@@ -45,13 +45,18 @@ def main():
     if args.extra_args:
         extra_args.append(args.extra_args)
 
-    launcher = _LAUNCHERS[args.launcher](args.uuid,
-                                         server_url=args.server_url,
-                                         launch_dir=launch_dir,
-                                         extra_args=extra_args)
-
-    if args.run:
-        launcher.run()
+    template = templates[args.launcher]
+    opts = dict(server_url=args.server_url, launch_dir=launch_dir,
+                extra_args=extra_args)
+
+    if args.run or args.write:
+        launchers = write_launch_scripts(args.uuid, template, **opts)
+        for launcher in launchers:
+            if args.run:
+                launcher.run()
+            else:
+                print(launcher.script_path)
     else:
-        print(launcher.script().strip())
+        for uuid in args.uuid:
+            print(template.launcher(uuid, **opts).script().strip())
 
@@ -4,10 +4,17 @@ from __future__ import print_function
 
 import os
 import sys
+import time
+import signal
 import argparse
 
 from ..slave import Slave
-from ..env import WmtEnvironment
+from ..env import WmtEnvironment, PathList
+from ..config import load_configuration
+from ..journal import replay_journals
+from ..rules import OutputRules
+from ..janitor import Janitor
+from ..preflight import preflight, PreflightError
 
 
 class EnsureHttps(argparse.Action):
@@ -36,26 +43,101 @@ def main():
                         help='WMT site configuration file')
     parser.add_argument('--show-env', action='store_true',
                         help='print execution environment and exit')
+    parser.add_argument('--report-mode', choices=('full', 'delta'),
+                        default=None,
+                        help='send full stdout tails or only new lines')
+    parser.add_argument('--report-debounce', type=float, default=None,
+                        help='seconds to wait after a change before reporting')
+    parser.add_argument('--report-min-interval', type=float, default=None,
+                        help='minimum seconds between status reports')
+    parser.add_argument('--report-max-interval', type=float, default=None,
+                        help='maximum seconds between status reports')
+    parser.add_argument('--incremental-upload', action='store_true',
+                        default=None,
+                        help='upload finished output files during the run')
+    parser.add_argument('--delta-upload', action='store_true', default=None,
+                        help='leave unchanged input files out of the output')
+    parser.add_argument('--scratch-dir', default=None,
+                        help='node-local scratch space to run in '
+                        '(e.g. $TMPDIR)')
+    parser.add_argument('--no-preflight', dest='preflight',
+                        action='store_false', default=None,
+                        help='skip the host preflight checks')
     args = parser.parse_args()
 
+    config = load_configuration(args.config)
+    for option in ('mode', 'debounce', 'min_interval', 'max_interval'):
+        if getattr(args, 'report_' + option) is None:
+            setattr(args, 'report_' + option, config.get('reporter', option))
+    report_opts = {
+        'mode': args.report_mode,
+        'debounce': float(args.report_debounce),
+        'min_interval': float(args.report_min_interval),
+        'max_interval': float(args.report_max_interval),
+    }
+
     # env = WmtEnvironment.from_config(args.config)
     env = os.environ
-    env['PATH'] = os.pathsep.join(
-        [os.path.join(sys.prefix, 'bin'), env['PATH']])
+    path = PathList(env.get('PATH', ''))
+    path.prepend([os.path.join(sys.prefix, 'bin')])
+    env['PATH'] = str(path)
     #     ['/home/csdms/wmt/topoflow.1/conda/bin', env['PATH']])
 
     if args.show_env:
         print(str(env))
         return
 
+    if args.incremental_upload is None:
+        args.incremental_upload = config.getboolean('upload', 'incremental')
+    if args.incremental_upload:
+        upload_opts = {
+            'settle': config.getfloat('upload', 'settle'),
+            'interval': config.getfloat('upload', 'interval'),
+            'chunk_size': int(config.getfloat('upload', 'chunk_size')),
+        }
+    else:
+        upload_opts = None
+
+    if args.delta_upload is None:
+        args.delta_upload = config.getboolean('upload', 'delta')
+    if args.scratch_dir is None:
+        args.scratch_dir = config.get('paths', 'scratch_dir')
+    if args.preflight is None:
+        args.preflight = config.getboolean('preflight', 'enabled')
+
+    # Let a job killed by the scheduler unwind so that scratch space is
+    # cleaned up.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    journal = config.getboolean('reporter', 'journal')
+    flush_timeout = config.getfloat('reporter', 'flush_timeout')
+    replayed = replay_journals(args.exec_dir)
+
+    janitor = Janitor(args.exec_dir, max_size=config.get('gc', 'max_size'),
+                      max_age=config.get('gc', 'max_age'), keep=[args.id])
+    janitor.start()
+
     # slave = Slave(args.server_url, env=env.env)
     slave = Slave(args.server_url, env=env)
 
     try:
-        _ = slave.start_task(args.id, dir=args.exec_dir, env=env)
+        if args.preflight:
+            preflight(config, args.exec_dir, env=env,
+                      scratch_dir=args.scratch_dir)
+        _ = slave.start_task(args.id, dir=args.exec_dir, env=env,
+                             report_opts=report_opts, journal=journal,
+                             upload_opts=upload_opts,
+                             delta_upload=args.delta_upload,
+                             output_rules=OutputRules.from_config(config),
+                             scratch_dir=args.scratch_dir,
+                             unpack_workers=int(config.get('unpack',
+                                                           'workers')))
     #except TaskError as error:
     #    slave.report_error(args.id, str(error))
     #    print error
+    except PreflightError as error:
+        slave.report_error(args.id, str(error))
+        print(error)
     except Exception as error:
         slave.report_error(args.id, traceback.format_exc())
         print(traceback.format_exc())
@@ -63,3 +145,9 @@ def main():
         slave.report_success(
             args.id, 'simulation is complete and available for pickup')
         print('success')
+
+    if not slave.finish(args.id, timeout=flush_timeout):
+        print('unable to deliver all reports; they will be resent later')
+    deadline = time.time() + flush_timeout
+    for flusher in replayed:
+        flusher.close(timeout=max(deadline - time.time(), 0.))
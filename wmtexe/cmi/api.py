@@ -3,10 +3,11 @@ from __future__ import print_function
 
 import os
 import types
-import yaml
+import subprocess
 
-from .utils import cd, check_output, system
+from .utils import cd, check_output, system, pkg_config
 from .git import git_repo_name, git_clone_or_update, git_repo_sha
+from ..yamlio import load_file
 
 
 _REQUIRED_KEYS = set(['language', 'build', 'includes', 'cflags', 'libs',
@@ -44,16 +45,18 @@ def generate_compile_opts(flags, opt):
         return flags
 
     try:
-        return check_output(['pkg-config', opt,
-                             flags['pkgconfig']]).strip()
+        package = flags['pkgconfig']
     except KeyError:
         raise TypeError('bad type for flags')
 
+    opts = pkg_config(package, opt)
+    if opts is None:
+        raise RuntimeError('pkg-config %s %s failed' % (opt, package))
+    return opts
+
 
 def load(dir='.'):
-    with cd(dir):
-        with open(os.path.join('.bmi', 'api.yaml'), 'r') as fp:
-            api = yaml.load(fp)
+    api = load_file(os.path.join(dir, '.bmi', 'api.yaml'))
 
     is_valid_api_or_raise(api)
 
@@ -66,9 +69,7 @@ def load(dir='.'):
 
 
 def load_build_script(dir='.'):
-    with cd(dir):
-        with open(os.path.join('.bmi', 'api.yaml'), 'r') as fp:
-            api = yaml.load(fp)
+    api = load_file(os.path.join(dir, '.bmi', 'api.yaml'))
 
     is_valid_api_or_raise(api)
 
@@ -88,6 +89,26 @@ def execute_build(build):
     system(['brew', 'install', brew['formula']] + opts)
 
 
+def is_build_installed(build):
+    return installed_build_version(build) is not None
+
+
+def installed_build_version(build):
+    """Versions of a build's formula that brew has installed, or None."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(
+                ['brew', 'list', '--versions', build['brew']['formula']],
+                stdout=subprocess.PIPE, stderr=devnull,
+                universal_newlines=True)
+            versions = proc.communicate()[0].strip()
+    except OSError:
+        return None
+    if proc.returncode != 0 or not versions:
+        return None
+    return versions
+
+
 def execute_api_build(dir='.'):
     build = load_build_script(dir=dir)
     execute_build(build)
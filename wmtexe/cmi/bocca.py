@@ -5,7 +5,6 @@ import os
 import subprocess
 import types
 import re
-import fileinput
 import shutil
 import glob
 from string import Template
@@ -13,7 +12,8 @@ from string import Template
 import yaml
 from distutils.dir_util import mkpath
 
-from .utils import cd, mktemp, which, system, check_output
+from .utils import cd, mktemp, which, system, check_output, pkg_config
+from .subst import Substitutions, substitute_in_files
 
 
 class Error(Exception):
@@ -50,17 +50,17 @@ def create_project(name, bocca=None, language=None, ifexists='pass'):
     system([bocca, 'create', 'project', name] + options)
 
 
-def create_interface(name, bocca=None, sidl=None):
+def create_interface(name, bocca=None, sidl=None, cwd=None):
     bocca = bocca or which('bocca')
     options = []
     if sidl is not None:
         options += ['--import-sidl=%s@%s' % (name, sidl)]
 
-    system([bocca, 'create', 'interface', name] + options)
+    system([bocca, 'create', 'interface', name] + options, cwd=cwd)
 
 
 def create_class(name, bocca=None, implements=None, language=None, sidl=None,
-                 impl=None, includes='', libs=''):
+                 impl=None, includes='', libs='', cwd=None):
     bocca = bocca or which('bocca')
     options = []
     if sidl is not None:
@@ -72,12 +72,12 @@ def create_class(name, bocca=None, implements=None, language=None, sidl=None,
     if implements is not None:
         options += ['--implements=%s' % implements]
 
-    system([bocca, 'create', 'class', name] + options)
+    system([bocca, 'create', 'class', name] + options, cwd=cwd)
 
     if impl:
         for fname in ['make.vars.user', 'make.rules.user']:
             shutil.copy(os.path.join(impl, fname),
-                        os.path.join('components', name))
+                        os.path.join(cwd or '.', 'components', name))
 
     #make_vars_user = 'components/%s/make.vars.user' % name
 
@@ -97,7 +97,8 @@ def class_language(name, bocca=None):
 
     import re
 
-    lines = check_output([bocca, 'display', 'class', name]).split(os.linesep)
+    lines = check_output([bocca, 'display', 'class', name],
+                         universal_newlines=True).split(os.linesep)
     m = re.search('\((?P<lang>\w+)\)', lines[0])
     return m.group('lang')
 
@@ -107,7 +108,8 @@ def class_files(name, bocca=None, pattern=None):
 
     bocca = bocca or which('bocca')
 
-    files = check_output([bocca, 'display', 'class', '-f', name]).split()
+    files = check_output([bocca, 'display', 'class', '-f', name],
+                         universal_newlines=True).split()
     if pattern:
         return [f for f in files if fnmatch(f, pattern)]
     else:
@@ -116,96 +118,58 @@ def class_files(name, bocca=None, pattern=None):
 
 def replace_class_name(src, dest, include=None, prefix=None, cflags=None,
                        libs=None):
-    import re
-
     cflags = cflags or ''
     libs = libs or ''
 
-    subs = ((re.sub('\.', '_', src), re.sub('\.', '_', dest)),
-            (src, dest),
-            ('BMI_HEAT', prefix),
-            ('bmi_heat.h', include),
-            ('Heat', dest.split('.')[-1]),
-           )
-
-    for path in class_files(dest):
-        f = fileinput.input(path, inplace=True)
-        for line in f:
-            for sub in subs:
-                line = re.sub(sub[0], sub[1], line)
-            if line.startswith('INCLUDES ='):
-                line = ' '.join([line.rstrip(), cflags])
-            elif line.startswith('LIBS ='):
-                line = ' '.join([line.rstrip(), libs])
-
-            print(line.rstrip())
-        f.close()
-
-
-def substitute_in_file(file_like, pattern, repl):
-    if isinstance(file_like, str):
-        with open(file_like, 'r') as fp:
-            contents = fp.read()
-    else:
-        contents = file_like.read()
-
-    return re.sub(pattern, repl, contents)
-
-    if inplace:
-        with open(path, 'w') as fp:
-            fp.write(contents)
+    subs = Substitutions((
+        (src.replace('.', '_'), dest.replace('.', '_')),
+        (src, dest),
+        ('BMI_HEAT', prefix),
+        ('bmi_heat.h', include),
+        ('Heat', dest.split('.')[-1]),
+    ))
 
+    def add_flags(line):
+        if line.startswith('INCLUDES ='):
+            line = ' '.join([line.rstrip(), cflags])
+        elif line.startswith('LIBS ='):
+            line = ' '.join([line.rstrip(), libs])
+        return line.rstrip() + '\n'
 
-def substitute_patterns(subs, string):
-    for pattern, repl in subs:
-        string = re.sub(pattern, repl, string)
-    return string
+    substitute_in_files(subs, class_files(dest), filter=add_flags)
 
 
-def substitute_patterns_in_file(subs, file_like):
-    if isinstance(file_like, str):
-        with open(file_like, 'r') as fp:
-            contents = fp.read()
+def _replace_class_names(paths, subs, src, dest, inplace=True,
+                         destdir='.'):
+    paths = list(paths)
+    if inplace:
+        dests = None
     else:
-        contents = file_like.read()
-    return substitute_patterns(subs, contents)
+        rename = Substitutions([(src.replace('.', '_'),
+                                 dest.replace('.', '_'))])
+        dests = [os.path.join(destdir, rename.sub(os.path.basename(path)))
+                 for path in paths]
 
+    substitute_in_files(subs, paths, dests=dests)
 
-def replace_c_class_names(paths, src, dest, inplace=True):
-    src_with_underscores = re.sub('\.', '_', src)
-    dest_with_underscores = re.sub('\.', '_', dest)
-    subs = (
-        (src_with_underscores, dest_with_underscores),
-        (src, dest),
-    )
 
-    for path in paths:
-        contents = substitute_patterns_in_file(subs, path)
-        if not inplace:
-            path = re.sub(src_with_underscores, dest_with_underscores,
-                          os.path.basename(path))
-        with open(path, 'w') as fp:
-            fp.write(contents)
-
-
-def replace_cxx_class_names(paths, src, dest, inplace=True):
-    src_with_underscores = re.sub('\.', '_', src)
-    dest_with_underscores = re.sub('\.', '_', dest)
-    src_with_colons = re.sub('\.', '::', src)
-    dest_with_colons = re.sub('\.', '::', dest)
-    subs = (
-        (src_with_underscores, dest_with_underscores),
-        (src_with_colons, dest_with_colons),
+def replace_c_class_names(paths, src, dest, inplace=True, destdir='.'):
+    subs = Substitutions((
+        (src.replace('.', '_'), dest.replace('.', '_')),
         (src, dest),
-    )
+    ))
+    _replace_class_names(paths, subs, src, dest, inplace=inplace,
+                         destdir=destdir)
 
-    for path in paths:
-        contents = substitute_patterns_in_file(subs, path)
-        if not inplace:
-            path = re.sub(src_with_underscores, dest_with_underscores,
-                          os.path.basename(path))
-        with open(path, 'w') as fp:
-            fp.write(contents)
+
+def replace_cxx_class_names(paths, src, dest, inplace=True, destdir='.'):
+    subs = Substitutions((
+        (src.replace('.', '_'), dest.replace('.', '_')),
+        (src.replace('.', '::'), dest.replace('.', '::')),
+        (src, dest),
+    ))
+    _replace_class_names(paths, subs, src, dest, inplace=inplace,
+                         destdir=destdir)
 
 
 def replace_bmi_names(paths, mapping):
@@ -232,8 +196,9 @@ def dup_c_impl(path, new, destdir='.'):
     impl_files = (glob.glob(os.path.join(path, '*.[ch]')) +
                   glob.glob(os.path.join(path, 'make.*.user')))
 
-    with cd(os.path.join(destdir, new)) as _:
-        replace_c_class_names(impl_files, old, new, inplace=False)
+    mkpath(os.path.join(destdir, new))
+    replace_c_class_names(impl_files, old, new, inplace=False,
+                          destdir=os.path.join(destdir, new))
 
     return os.path.join(destdir, new)
 
@@ -268,8 +233,9 @@ def dup_cxx_impl(path, new, destdir='.'):
                   glob.glob(os.path.join(path, '*.hxx')) +
                   glob.glob(os.path.join(path, 'make.*.user')))
 
-    with cd(os.path.join(destdir, new)) as _:
-        replace_cxx_class_names(impl_files, old, new, inplace=False)
+    mkpath(os.path.join(destdir, new))
+    replace_cxx_class_names(impl_files, old, new, inplace=False,
+                            destdir=os.path.join(destdir, new))
 
     return os.path.join(destdir, new)
 
@@ -290,13 +256,13 @@ def dup_impl_files(path, new, destdir='.', language=None):
 def guess_language_from_files(path):
     from glob import glob
 
-    with cd(path) as _:
-        if len(glob('*.[ch]')) > 0:
-            return 'c'
-        elif len(glob('*.cxx') + glob('*.hxx')) > 0:
-            return 'cxx'
-        else:
-            return None
+    if len(glob(os.path.join(path, '*.[ch]'))) > 0:
+        return 'c'
+    elif len(glob(os.path.join(path, '*.cxx')) +
+             glob(os.path.join(path, '*.hxx'))) > 0:
+        return 'cxx'
+    else:
+        return None
 
 
 _GRID_TYPE_FUNCTIONS = {
@@ -326,9 +292,8 @@ def get_grid_type_defines(grid_types):
     return os.linesep.join(defines)
 
 
-def create_bmi_class(name, bocca=None, language='c', bmi_mapping=None,
-                     pkg_config_package=None, impl=None):
-    bocca = bocca or which('bocca')
+def prepare_bmi_class(name, destdir, language='c', bmi_mapping=None,
+                      pkg_config_package=None, impl=None):
     bmi_mapping = bmi_mapping or {}
 
     if pkg_config_package:
@@ -348,15 +313,27 @@ def create_bmi_class(name, bocca=None, language='c', bmi_mapping=None,
     for key in list(bmi_mapping.keys()):
         bmi_mapping['bmi_' + key] = bmi_mapping[key]
 
+    #impl_dir = dup_c_impl(impl, name, destdir=destdir)
+    if impl is not None:
+        impl_dir = dup_impl_files(impl, name, destdir=destdir,
+                                 language=language)
+        replace_bmi_names(glob.glob(os.path.join(impl_dir, '*')),
+                          bmi_mapping)
+    else:
+        impl_dir = None
+
+    return impl_dir
+
+
+def create_bmi_class(name, bocca=None, language='c', bmi_mapping=None,
+                     pkg_config_package=None, impl=None):
+    bocca = bocca or which('bocca')
+
     with mktemp(prefix='csdms', suffix='.d') as destdir:
-        #impl_dir = dup_c_impl(impl, name, destdir=destdir)
-        if impl is not None:
-            impl_dir = dup_impl_files(impl, name, destdir=destdir,
-                                     language=language)
-            replace_bmi_names(glob.glob(os.path.join(impl_dir, '*')),
-                              bmi_mapping)
-        else:
-            impl_dir = None
+        impl_dir = prepare_bmi_class(name, destdir, language=language,
+                                     bmi_mapping=bmi_mapping,
+                                     pkg_config_package=pkg_config_package,
+                                     impl=impl)
 
         create_class(name, bocca=bocca, implements='csdms.core.Bmi',
                      language=language, impl=impl_dir)
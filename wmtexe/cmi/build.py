@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+"""Create and build a bocca project, doing independent steps in parallel."""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+from distutils.dir_util import mkpath
+
+from .utils import cd, mktemp, which, system, status, pkg_config
+from .bocca import (create_project, create_interface, create_class,
+                    prepare_bmi_class, is_bocca_project, _PATH_TO_IMPL)
+
+
+BMI_INTERFACE = 'csdms.core.Bmi'
+FINGERPRINTS_FILE = os.path.join('.cmi', 'fingerprints.json')
+
+
+def class_name(clazz):
+    return 'csdms.%s' % clazz['name']
+
+
+def _absolute_paths(entry, base, keys=('impl', 'sidl')):
+    """Copy of an entry with its relative file paths joined to *base*."""
+    entry = dict(entry)
+    for key in keys:
+        if entry.get(key):
+            entry[key] = os.path.abspath(os.path.join(base, entry[key]))
+    return entry
+
+
+def project_graph(proj):
+    """Map each interface and class of a project to what it depends on."""
+    interfaces = [interface['name'] for interface in
+                  proj.get('interfaces', [])]
+
+    graph = OrderedDict()
+    for name in interfaces:
+        graph[name] = []
+    for clazz in proj.get('bmi', []):
+        implements = clazz.get('implements', BMI_INTERFACE)
+        graph[class_name(clazz)] = [implements] if implements in graph else []
+
+    return graph
+
+
+def topological_order(graph):
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError('dependency cycle at %s' % name)
+        visiting.add(name)
+        for dep in graph.get(name, []):
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in graph:
+        visit(name)
+    return order
+
+
+def _hash_json(obj):
+    return json.dumps(obj, sort_keys=True, default=str).encode('utf-8')
+
+
+def _hash_path(sha, path):
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fpath = os.path.join(root, fname)
+                sha.update(os.path.relpath(fpath, path).encode('utf-8'))
+                _hash_path(sha, fpath)
+    elif os.path.isfile(path):
+        with open(path, 'rb') as fp:
+            sha.update(fp.read())
+
+
+def _resolve_flags(flags, opt):
+    if isinstance(flags, dict) and 'pkgconfig' in flags:
+        return pkg_config(flags['pkgconfig'], opt)
+    return flags
+
+
+def project_fingerprint(proj):
+    return hashlib.sha1(_hash_json([proj['name'],
+                                    proj['language']])).hexdigest()
+
+
+def interface_fingerprint(interface):
+    sha = hashlib.sha1(_hash_json(interface))
+    if interface.get('sidl'):
+        _hash_path(sha, interface['sidl'])
+    return sha.hexdigest()
+
+
+def class_fingerprint(clazz):
+    """Hash of a class entry, its impl template and its compiler flags."""
+    sha = hashlib.sha1(_hash_json(clazz))
+    _hash_path(sha, clazz.get('impl') or _PATH_TO_IMPL[clazz['language']])
+    sha.update(_hash_json([_resolve_flags(clazz.get('cflags'), '--cflags'),
+                           _resolve_flags(clazz.get('libs'), '--libs')]))
+    return sha.hexdigest()
+
+
+def load_fingerprints(proj_dir):
+    try:
+        with open(os.path.join(proj_dir, FINGERPRINTS_FILE), 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_fingerprints(proj_dir, fingerprints):
+    path = os.path.join(proj_dir, FINGERPRINTS_FILE)
+    mkpath(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(fingerprints, fp, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def stale_components(graph, fingerprints, old):
+    """Components whose fingerprint, or that of a dependency, changed."""
+    stale = set()
+    for name in topological_order(graph):
+        if (old.get(name, {}).get('fingerprint') != fingerprints[name] or
+                any(dep in stale for dep in graph[name])):
+            stale.add(name)
+    return stale
+
+
+class Timings(object):
+    def __init__(self):
+        self._times = OrderedDict()
+
+    def add(self, name, step, seconds):
+        self._times.setdefault(name, OrderedDict())[step] = seconds
+
+    def report(self, file=None):
+        file = file or sys.stderr
+        width = max([len(name) for name in self._times] + [0])
+        for name, steps in self._times.items():
+            print('{name:{width}}  {steps}  total {total:.1f} s'.format(
+                name=name, width=width,
+                steps='  '.join('%s %.1f s' % step for step in steps.items()),
+                total=sum(steps.values())), file=file)
+
+
+def _prepare(clazz, destdir):
+    start = time.time()
+    clazz = dict(clazz)
+    name = class_name(clazz)
+    clazz.pop('name')
+    clazz.pop('implements', None)
+    clazz.setdefault('impl', _PATH_TO_IMPL[clazz['language']])
+    impl_dir = prepare_bmi_class(name, destdir, bmi_mapping=clazz,
+                                 impl=clazz['impl'],
+                                 language=clazz['language'])
+    return impl_dir, time.time() - start
+
+
+def build_project(proj, clobber=False, jobs=1, make=False, bocca=None,
+                  incremental=False):
+    """Create a bocca project and, optionally, build it.
+
+    Class implementations are prepared on a pool of *jobs* threads while
+    the interfaces they depend on are created. bocca itself is run one
+    step at a time, in dependency order, because it keeps its state in
+    the project. The build runs ``make -j<jobs>``.
+
+    With *incremental*, an existing project is updated in place: only
+    interfaces and classes whose fingerprint changed (or that depend on
+    one that did) are removed and created again. An existing project
+    that has no fingerprints is only replaced if *clobber* is set.
+
+    Relative ``impl`` and ``sidl`` paths are taken relative to the
+    project directory. A class implements ``csdms.core.Bmi`` unless it
+    names another interface with ``implements``.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    bocca = bocca or which('bocca')
+    timings = Timings()
+    proj_dir = os.path.abspath(proj['name'])
+
+    graph = project_graph(proj)
+    interfaces = dict((interface['name'],
+                       _absolute_paths(interface, proj_dir))
+                      for interface in proj.get('interfaces', []))
+    classes = dict((class_name(clazz), _absolute_paths(clazz, proj_dir))
+                   for clazz in proj.get('bmi', []))
+
+    fingerprints = dict()
+    for name, interface in interfaces.items():
+        fingerprints[name] = interface_fingerprint(interface)
+    for name, clazz in classes.items():
+        fingerprints[name] = class_fingerprint(clazz)
+
+    saved = {}
+    if incremental and is_bocca_project(proj_dir):
+        saved = load_fingerprints(proj_dir)
+    old = saved.get('components', {})
+
+    if saved.get('project') == project_fingerprint(proj):
+        status('Updating project %s' % proj['name'])
+    else:
+        old = {}
+        start = time.time()
+        ifexists = 'clobber' if clobber else 'raise'
+        create_project(proj['name'], bocca=bocca, language=proj['language'],
+                       ifexists=ifexists)
+        timings.add(proj['name'], 'create', time.time() - start)
+
+    stale = stale_components(graph, fingerprints, old)
+    removed = dict((name, old[name]['depends']) for name in old
+                   if name not in graph or name in stale)
+
+    done = dict(project=project_fingerprint(proj),
+                components=dict((name, old[name]) for name in old
+                                if name not in removed))
+
+    for name in reversed([name for name in topological_order(removed)
+                          if name in removed]):
+        start = time.time()
+        system([bocca, 'remove', old[name]['kind'], name], cwd=proj_dir)
+        timings.add(name, 'remove', time.time() - start)
+    save_fingerprints(proj_dir, done)
+
+    with mktemp(prefix='csdms', suffix='.d') as destdir:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            prepared = dict(
+                (name, pool.submit(_prepare, clazz, destdir))
+                for name, clazz in classes.items() if name in stale)
+
+            # The workers share our working directory, so bocca is run
+            # in the project with cwd rather than by changing into it.
+            for name in topological_order(graph):
+                if name not in stale:
+                    status('%s is unchanged' % name)
+                    continue
+
+                start = time.time()
+                if name in interfaces:
+                    opts = dict(interfaces[name])
+                    opts.pop('name')
+                    create_interface(name, bocca=bocca, cwd=proj_dir, **opts)
+                else:
+                    impl_dir, seconds = prepared[name].result()
+                    timings.add(name, 'prepare', seconds)
+                    start = time.time()
+                    create_class(name, bocca=bocca,
+                                 implements=classes[name].get(
+                                     'implements', BMI_INTERFACE),
+                                 language=classes[name]['language'],
+                                 impl=impl_dir, cwd=proj_dir)
+                timings.add(name, 'create', time.time() - start)
+
+                done['components'][name] = dict(
+                    kind='interface' if name in interfaces else 'class',
+                    fingerprint=fingerprints[name],
+                    depends=graph[name])
+                save_fingerprints(proj_dir, done)
+
+    if make:
+        with cd(proj_dir) as _:
+            if not os.path.isfile('config.status'):
+                start = time.time()
+                system(['./configure'])
+                timings.add(proj['name'], 'configure', time.time() - start)
+            start = time.time()
+            system(['make', '-j%d' % max(jobs, 1)])
+            timings.add(proj['name'], 'make', time.time() - start)
+
+    status('Timings')
+    timings.report()
+
+    return timings
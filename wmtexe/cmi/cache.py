@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+"""Cache of component builds, keyed on what goes into them."""
+import os
+import json
+import hashlib
+
+
+_COMPILER_ENV = ('CC', 'CXX', 'FC', 'CFLAGS', 'CXXFLAGS', 'FFLAGS',
+                 'CPPFLAGS', 'LDFLAGS', 'PKG_CONFIG_PATH')
+
+
+def compiler_flags(env=None):
+    env = os.environ if env is None else env
+    return dict((name, env.get(name, '')) for name in _COMPILER_ENV)
+
+
+def build_key(sha, dir='.', flags=None):
+    """Hash of a repo's SHA, its .bmi/api.yaml and the compiler flags."""
+    flags = compiler_flags() if flags is None else flags
+
+    key = hashlib.sha256()
+    key.update(sha.encode('utf-8'))
+    with open(os.path.join(dir, '.bmi', 'api.yaml'), 'rb') as fp:
+        key.update(fp.read())
+    key.update(json.dumps(flags, sort_keys=True).encode('utf-8'))
+
+    return key.hexdigest()
+
+
+class BuildCache(object):
+    """Metadata of builds, and which of them is installed.
+
+    A build is installed outside of the cache (by brew), one at a time
+    for each formula. An entry is only good while the build it was made
+    for is the one installed, so the cache also records, for each
+    formula, the key and installed version of the last build.
+    """
+    def __init__(self, dir=os.path.join('cache', 'builds')):
+        self._dir = os.path.abspath(dir)
+
+    def path_to(self, key):
+        return os.path.join(self._dir, key + '.json')
+
+    def _installed_path(self, formula):
+        return os.path.join(self._dir, 'installed', formula + '.json')
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, path, obj):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(obj, fp, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+
+    def restore(self, key, formula, installed):
+        """The metadata of a build, if it is the one that is installed.
+
+        *installed* is the version of *formula* installed now, or None.
+        """
+        if installed is None:
+            return None
+        last = self._read(self._installed_path(formula))
+        if last != dict(key=key, installed=installed):
+            return None
+        return self._read(self.path_to(key))
+
+    def save(self, key, formula, bmi, installed):
+        self._write(self.path_to(key), bmi)
+        self._write(self._installed_path(formula),
+                    dict(key=key, installed=installed))
@@ -2,23 +2,27 @@
 from __future__ import print_function
 
 import os
+import sys
 import subprocess
 import re
 import types
 
-import yaml
 from distutils.dir_util import mkpath
 
-from .utils import cd, check_output, system, read_first_of
-from .git import git_repo_name, git_clone_or_update, git_repo_sha
+from .utils import (cd, check_output, system, read_first_of, status,
+                    output_stream, capture_output, use_pkg_config_cache)
+from .git import (git_repo_name, git_clone_or_update, git_branch_sha,
+                  git_head_sha)
+from .cache import BuildCache, build_key
 from .project import empty_bmi_project, add_bmi_component
+from .api import generate_compile_opts
 from . import api
+from .. import yamlio
 
 
 def load_bmi_info(dir):
     with cd(dir):
-        with open(os.path.join('.bmi', 'info.yaml'), 'r') as fp:
-            info = yaml.load(fp)
+        info = yamlio.load_file(os.path.join('.bmi', 'info.yaml'))
 
         if 'summary' not in info:
             info['summary'] = read_first_of(['README.md', 'README',
@@ -31,26 +35,17 @@ def load_bmi_info(dir):
 
 
 def load_bmi_api(dir='.'):
-    with cd(dir):
-        with open(os.path.join('.bmi', 'api.yaml'), 'r') as fp:
-            api = yaml.load(fp)
+    api = yamlio.load_file(os.path.join(dir, '.bmi', 'api.yaml'))
     api.pop('build')
 
-    if isinstance(api['cflags'], dict) and 'pkgconfig' in api['cflags']:
-        api['cflags'] = check_output(['pkg-config', '--cflags',
-                                      api['cflags']['pkgconfig']]).strip()
-
-    if isinstance(api['libs'], dict) and 'pkgconfig' in api['libs']:
-        api['libs'] = check_output(['pkg-config', '--libs',
-                                    api['libs']['pkgconfig']]).strip()
+    api['cflags'] = generate_compile_opts(api['cflags'], '--cflags')
+    api['libs'] = generate_compile_opts(api['libs'], '--libs')
 
     return api
 
 
 def load_build_script(dir='.'):
-    with cd(dir):
-        with open(os.path.join('.bmi', 'api.yaml'), 'r') as fp:
-            api = yaml.load(fp)
+    api = yamlio.load_file(os.path.join(dir, '.bmi', 'api.yaml'))
     return api['build']
 
 
@@ -65,9 +60,9 @@ def build_api(build):
         raise RuntimeError('only building with homebrew is supported')
 
 
-def cache_dir_from_repo(repo, branch='master'):
-    return os.path.join('cache', git_repo_name(repo) +
-                                 '-%s' % git_repo_sha(repo, branch=branch))
+def cache_dir_from_repo(repo, branch='master', sha=None):
+    sha = sha or git_branch_sha(repo, branch=branch)
+    return os.path.join('cache', git_repo_name(repo) + '-%s' % sha[:10])
 
 
 def component_name_from_repo(repo, name=None):
@@ -84,32 +79,105 @@ def parse_repo_line(line):
 
     return repo.strip(), branch.strip()
 
+
+def fetch_repo(line):
+    repo, branch = parse_repo_line(line)
+
+    # Check out the commit the cache directory is named after, even if
+    # the branch has moved on since its refs were cached.
+    sha = git_branch_sha(repo, branch=branch)
+    cache_dir = cache_dir_from_repo(repo, branch=branch, sha=sha)
+    git_clone_or_update(repo, dir=cache_dir, branch=branch, sha=sha)
+
+    return repo, cache_dir
+
+
+def _fetch_repo_captured(line):
+    with capture_output() as output:
+        try:
+            return fetch_repo(line), output
+        except Exception:
+            import traceback
+            status('Error fetching %s' % line)
+            output_stream().write(traceback.format_exc())
+            return None, output
+
+
+def fetch_repos(lines, jobs=4):
+    """Fetch repos on a thread pool, printing their output in order."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    fetched = []
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        for future in [pool.submit(_fetch_repo_captured, line)
+                       for line in lines]:
+            result, output = future.result()
+            sys.stderr.write(output.getvalue())
+            sys.stderr.flush()
+            output.close()
+            fetched.append(result)
+
+    if None in fetched:
+        raise RuntimeError('unable to fetch all repositories')
+
+    return fetched
+
+
+def fetch_build(builds, use_cache=True):
+    key = build_key(git_head_sha())
+    build = api.load_build_script()
+
+    formula = build['brew']['formula']
+
+    bmi = None
+    if use_cache:
+        bmi = builds.restore(key, formula, api.installed_build_version(build))
+    if bmi is not None:
+        status('Using cached build %s' % key[:10])
+        return bmi
+
+    bmi = api.load()
+    api.execute_build(build)
+    builds.save(key, formula, bmi, api.installed_build_version(build))
+
+    return bmi
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
 
     parser.add_argument('repo', type=str, nargs='+',
                         help='GitHub repository for BMI implementation')
+    parser.add_argument('--build-cache', default=os.path.join('cache',
+                                                              'builds'),
+                        help='Directory of cached component builds')
+    parser.add_argument('--no-build-cache', action='store_true',
+                        help='Always build components')
+    parser.add_argument('--pkg-config-cache',
+                        default=os.path.join('cache', 'pkg-config.json'),
+                        help='File of cached pkg-config results')
+    parser.add_argument('--no-pkg-config-cache', action='store_true',
+                        help='Always run pkg-config')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Number of repositories to fetch at once')
 
     args = parser.parse_args()
 
-    proj = empty_bmi_project()
-    for repo in args.repo:
-        repo, branch = parse_repo_line(repo)
-
-        cache_dir = cache_dir_from_repo(repo, branch=branch)
-
-        git_clone_or_update(repo, dir=cache_dir, branch=branch)
+    builds = BuildCache(args.build_cache)
+    if not args.no_pkg_config_cache:
+        use_pkg_config_cache(os.path.abspath(args.pkg_config_cache))
 
+    proj = empty_bmi_project()
+    for repo, cache_dir in fetch_repos(args.repo, jobs=args.jobs):
         with cd(cache_dir) as _:
-            bmi = api.load()
-            api.execute_api_build()
+            bmi = fetch_build(builds, use_cache=not args.no_build_cache)
 
         bmi['name'] = component_name_from_repo(repo, bmi.get('name', None))
 
         add_bmi_component(proj, bmi)
 
-    print(yaml.dump(proj, default_flow_style=False))
+    print(yamlio.dump(proj, default_flow_style=False))
 
 
 if __name__ == '__main__':
@@ -1,7 +1,25 @@
 #! /usr/bin/env python
 import os
+import json
+import time
+import hashlib
+import threading
+import subprocess
 
-from .utils import which, check_output, system, cd, status
+from distutils.dir_util import mkpath
+
+from .utils import which, check_output, system, status, output_stream
+
+
+REF_CACHE_DIR = os.path.join('cache', 'refs')
+REF_CACHE_TTL = 300.
+MIRROR_DIR = os.path.join('cache', 'mirrors')
+
+_refs = {}
+_refs_lock = threading.Lock()
+_url_locks = {}
+_mirror_locks = {}
+_dir_locks = {}
 
 
 def git_repo_name(url):
@@ -9,44 +27,193 @@ def git_repo_name(url):
     return base
 
 
+def _url_hash(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+
+
+def git_mirror_dir(url):
+    return os.path.join(MIRROR_DIR, '{name}-{hash}.git'.format(
+        name=git_repo_name(url), hash=_url_hash(url)))
+
+
+def parse_refs(output):
+    refs = dict()
+    for line in output.splitlines():
+        if line.strip():
+            (sha, name) = line.split()
+            refs[name] = sha
+    return refs
+
+
+def _git_refs_output(args):
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                            stderr=output_stream(), universal_newlines=True)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+        return None
+    return parse_refs(output)
+
+
+def git_ls_remote(url, git=None):
+    git = git or which('git')
+    return _git_refs_output([git, 'ls-remote', url])
+
+
+def git_mirror_refs(url, git=None):
+    git = git or which('git')
+
+    mirror = git_mirror_dir(url)
+    if not os.path.isdir(mirror):
+        return None
+    return _git_refs_output([git, '--git-dir', mirror, 'show-ref'])
+
+
+def _ref_cache_path(url):
+    return os.path.join(REF_CACHE_DIR, _url_hash(url) + '.json')
+
+
+def _load_cached_refs(url):
+    try:
+        with open(_ref_cache_path(url), 'r') as fp:
+            cached = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if cached.get('url') != url:
+        return None
+    return cached
+
+
+def _save_cached_refs(url, cached):
+    mkpath(REF_CACHE_DIR)
+    path = _ref_cache_path(url)
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(cached, fp)
+    os.rename(path + '.tmp', path)
+
+
+def git_refs(url, git=None, ttl=None):
+    """Map of refs to SHAs for a remote, cached for *ttl* seconds.
+
+    If the remote can't be reached, the refs of a local mirror, or
+    failing that an expired cache entry, are used instead.
+    """
+    ttl = REF_CACHE_TTL if ttl is None else ttl
+
+    with _refs_lock:
+        lock = _url_locks.setdefault(url, threading.Lock())
+
+    with lock:
+        cached = _refs.get(url) or _load_cached_refs(url)
+        if cached and time.time() - cached['time'] < ttl:
+            _refs[url] = cached
+            return cached['refs']
+
+        refs = git_ls_remote(url, git=git)
+        if refs is not None:
+            _refs[url] = dict(url=url, time=time.time(), refs=refs)
+            _save_cached_refs(url, _refs[url])
+            return refs
+
+        refs = git_mirror_refs(url, git=git)
+        if refs is not None:
+            status('Unable to reach %s, using local mirror' % url)
+            return refs
+
+        if cached:
+            status('Unable to reach %s, using cached refs' % url)
+            return cached['refs']
+
+    raise RuntimeError('%s: unable to list refs' % url)
+
+
+def git_branch_sha(url, git=None, branch='master'):
+    shas = git_refs(url, git=git)
+
+    return shas['refs/heads/{branch}'.format(branch=branch)]
+
+
 def git_repo_sha(url, git=None, branch='master'):
+    return git_branch_sha(url, git=git, branch=branch)[:10]
+
+
+def git_head_sha(dir='.', git=None):
+    git = git or which('git')
+
+    return check_output([git, 'rev-parse', 'HEAD'], cwd=dir,
+                        universal_newlines=True).strip()
+
+
+def _mirror_lock(url):
+    with _refs_lock:
+        return _mirror_locks.setdefault(url, threading.Lock())
+
+
+def git_update_mirror(url, git=None):
+    """Create or update the local bare mirror of a repo.
+
+    The mirror holds every object of the repo once, and the clones in
+    the cache share it, so updates fetch only new objects. If the remote
+    can't be reached, an existing mirror is used as is.
+    """
+    git = git or which('git')
+    mirror = os.path.abspath(git_mirror_dir(url))
+
+    with _mirror_lock(url):
+        if not os.path.isdir(mirror):
+            mkpath(os.path.dirname(mirror))
+            system([git, 'clone', '-q', '--mirror', url, mirror])
+            # Cached clones borrow objects from the mirror, so it must
+            # never drop them.
+            system([git, '--git-dir', mirror, 'config', 'gc.auto', '0'])
+        else:
+            try:
+                system([git, '--git-dir', mirror, 'fetch', '-q', 'origin'])
+            except subprocess.CalledProcessError:
+                status('Unable to reach %s, using local mirror' % url)
+
+    return mirror
+
+
+def git_clone(url, git=None, dir='.', branch='master', sha=None):
+    """Clone a repo from its local mirror.
+
+    If *sha* is given, that commit is checked out rather than the tip of
+    *branch*, which may have moved since *sha* was looked up.
+    """
     git = git or which('git')
 
-    lines = check_output([git, 'ls-remote', url]).strip().split(os.linesep)
-    shas = dict()
-    for line in lines:
-        (sha, name) = line.split()
-        shas[name] = sha
+    mirror = git_update_mirror(url, git=git)
 
-    return shas['refs/heads/{branch}'.format(branch=branch)][:10]
+    mkpath(os.path.dirname(os.path.abspath(dir)))
+    system([git, 'clone', '-q', '--shared', '--branch', branch, mirror,
+            dir])
+    if sha is not None:
+        system([git, 'checkout', '-q', sha], cwd=dir)
 
 
-def git_clone(url, git=None, dir='.', branch='master'):
+def git_pull(url, dir='.', branch='master', git=None, sha=None):
+    """Update a clone from its local mirror.
+
+    If *sha* is given, that commit is checked out rather than the tip of
+    *branch*.
+    """
     git = git or which('git')
 
-    with cd(dir):
-        system([git, 'init', '-q'])
-        system([git, 'config', 'remote.origin.url', url])
-        system([git, 'config', 'remote.origin.fetch',
-                '+refs/heads/*:refs/remotes/origin/*'])
-        system([git, 'fetch', 'origin',
-                '{branch}:refs/remotes/origin/{branch}'.format(branch=branch),
-                '-n', '--depth=1'])
-        system([git, 'reset', '--hard',
-                'origin/{branch}'.format(branch=branch)])
-
-
-def git_pull(url, dir='.', branch='master'):
-    with cd(dir):
-        system(['git', 'checkout', '-q', branch])
-        system(['git', 'pull', 'origin', '-q',
-                'refs/heads/{branch}:refs/remotes/origin/{branch}'.format(branch=branch)])
-
-
-def git_clone_or_update(url, dir='.', branch='master'):
-    if os.path.isdir(os.path.join(dir, '.git')):
-        status('Updating %s' % url)
-        git_pull(url, dir=dir, branch=branch)
-    else:
-        status('Cloning %s' % url)
-        git_clone(url, dir=dir, branch=branch)
+    mirror = git_update_mirror(url, git=git)
+
+    system([git, 'fetch', '-q', mirror,
+            'refs/heads/{branch}'.format(branch=branch)], cwd=dir)
+    system([git, 'checkout', '-q', sha or 'FETCH_HEAD'], cwd=dir)
+
+
+def git_clone_or_update(url, dir='.', branch='master', sha=None):
+    with _refs_lock:
+        lock = _dir_locks.setdefault(os.path.abspath(dir), threading.Lock())
+
+    with lock:
+        if os.path.isdir(os.path.join(dir, '.git')):
+            status('Updating %s' % url)
+            git_pull(url, dir=dir, branch=branch, sha=sha)
+        else:
+            status('Cloning %s' % url)
+            git_clone(url, dir=dir, branch=branch, sha=sha)
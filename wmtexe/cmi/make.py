@@ -1,9 +1,10 @@
 from __future__ import print_function
 
 import argparse
-import yaml
 
-from .bocca import make_project, ProjectExistsError
+from .bocca import ProjectExistsError
+from .build import build_project
+from .. import yamlio
 
 
 def main():
@@ -12,11 +13,19 @@ def main():
                         help='Project description file')
     parser.add_argument('--clobber', action='store_true',
                         help='Clobber an existing project')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of classes to prepare and build at once')
+    parser.add_argument('--build', action='store_true',
+                        help='Configure and make the project')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Recreate only classes that have changed')
 
     args = parser.parse_args()
 
     try:
-        make_project(yaml.load(args.file), clobber=args.clobber)
+        build_project(yamlio.load(args.file), clobber=args.clobber,
+                      jobs=args.jobs, make=args.build,
+                      incremental=args.incremental)
     except ProjectExistsError as error:
         print('The specified project (%s) already exists. Exiting.' % error)
 
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+"""Rename strings in many files in a single pass over each file."""
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+
+
+class Substitutions(object):
+    """A set of literal string replacements applied in one pass.
+
+    All of the strings to replace are compiled into a single regular
+    expression, longest first, so each piece of text is replaced at most
+    once. Replacements of None are ignored, and if a string appears more
+    than once the first replacement wins.
+    """
+
+    def __init__(self, subs):
+        self._table = OrderedDict()
+        for old, new in subs:
+            if old and new is not None and old not in self._table:
+                self._table[old] = new
+        self._pattern = None
+
+    def __len__(self):
+        return len(self._table)
+
+    @property
+    def pattern(self):
+        if self._pattern is None:
+            keys = sorted(self._table, key=len, reverse=True)
+            self._pattern = re.compile('|'.join(re.escape(k) for k in keys))
+        return self._pattern
+
+    def _replace(self, match):
+        return self._table[match.group(0)]
+
+    def sub(self, string):
+        if not self._table:
+            return string
+        return self.pattern.sub(self._replace, string)
+
+    def sub_file(self, path, dest=None, filter=None):
+        """Rewrite a file line by line, optionally into a new file.
+
+        *filter*, if given, is called with each substituted line and
+        returns the line to write.
+        """
+        dest = dest or path
+        dest_dir = os.path.dirname(os.path.abspath(dest))
+
+        fd, tmp = tempfile.mkstemp(dir=dest_dir, prefix='.subst')
+        try:
+            with open(path, 'r') as src, os.fdopen(fd, 'w') as out:
+                for line in src:
+                    line = self.sub(line)
+                    if filter is not None:
+                        line = filter(line)
+                    out.write(line)
+            shutil.copymode(path, tmp)
+            os.rename(tmp, dest)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+        return dest
+
+
+def substitute_in_files(subs, paths, dests=None, filter=None,
+                        max_workers=None):
+    """Apply substitutions to many files on a thread pool.
+
+    Returns the paths of the rewritten files, in the order of *paths*.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not isinstance(subs, Substitutions):
+        subs = Substitutions(subs)
+
+    paths = list(paths)
+    dests = list(dests) if dests is not None else [None] * len(paths)
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+
+    if len(paths) <= 1:
+        return [subs.sub_file(path, dest=dest, filter=filter)
+                for path, dest in zip(paths, dests)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(
+            lambda args: subs.sub_file(args[0], dest=args[1], filter=filter),
+            zip(paths, dests)))
@@ -3,10 +3,12 @@ from __future__ import print_function
 
 import os
 import sys
+import json
 import subprocess
 import types
 import tempfile
 import shutil
+import threading
 
 import yaml
 from distutils.dir_util import mkpath
@@ -56,18 +58,49 @@ class mktemp(object):
         shutil.rmtree(self._tmp_dir)
 
 
+_output = threading.local()
+
+
+def output_stream():
+    return getattr(_output, 'stream', None) or sys.stderr
+
+
+class capture_output(object):
+    """Capture status messages and command output of the current thread."""
+
+    def __enter__(self):
+        self._fp = tempfile.TemporaryFile(mode='w+')
+        _output.stream = self._fp
+        return self
+
+    def __exit__(self, type, value, traceback):
+        _output.stream = None
+
+    def getvalue(self):
+        self._fp.flush()
+        self._fp.seek(0)
+        return self._fp.read()
+
+    def close(self):
+        self._fp.close()
+
+
 def status(message):
-    print(' '.join(['==>', message]), file=sys.stderr)
+    stream = output_stream()
+    print(' '.join(['==>', message]), file=stream)
+    stream.flush()
 
 
 def check_output(*args, **kwds):
     kwds.setdefault('stdout', subprocess.PIPE)
+    kwds.setdefault('stderr', output_stream())
     return subprocess.Popen(*args, **kwds).communicate()[0]
 
 
 def system(*args, **kwds):
     verbose = kwds.pop('verbose', True)
-    kwds.setdefault('stdout', sys.stderr)
+    kwds.setdefault('stdout', output_stream())
+    kwds.setdefault('stderr', output_stream())
 
     status(' '.join(args[0]))
 
@@ -83,29 +116,131 @@ def system(*args, **kwds):
         raise
 
 
-def which(prog, env=None):
-    prog = os.environ.get(env or prog.upper(), prog)
+_lookups = {}
+_lookups_lock = threading.Lock()
+_pkg_config_cache = dict(path=None, entries=None)
+
+
+def _memoized(key, func):
+    with _lookups_lock:
+        if key in _lookups:
+            return _lookups[key]
+    value = func()
+    with _lookups_lock:
+        return _lookups.setdefault(key, value)
+
+
+def clear_lookups():
+    with _lookups_lock:
+        _lookups.clear()
+        _pkg_config_cache['entries'] = None
+
 
+def _which(prog):
     try:
         prog = check_output(['which', prog],
-                            stderr=open('/dev/null', 'w')).strip()
+                            stderr=open('/dev/null', 'w'),
+                            universal_newlines=True).strip()
     except subprocess.CalledProcessError:
         return None
     else:
         return prog
 
 
+def which(prog, env=None):
+    prog = os.environ.get(env or prog.upper(), prog)
+
+    return _memoized(('which', prog, os.environ.get('PATH', '')),
+                     lambda: _which(prog))
+
+
+def use_pkg_config_cache(path):
+    """Keep pkg-config results in *path* between runs (None to disable).
+
+    Entries are keyed on the pkg-config search path and are used only
+    while the package's .pc file has the same modification time.
+    """
+    with _lookups_lock:
+        _pkg_config_cache['path'] = path
+        _pkg_config_cache['entries'] = None
+
+
+def _pkg_config_search_path():
+    paths = os.environ.get('PKG_CONFIG_PATH', '').split(os.pathsep)
+    if 'PKG_CONFIG_LIBDIR' in os.environ:
+        paths += os.environ['PKG_CONFIG_LIBDIR'].split(os.pathsep)
+    else:
+        paths += _memoized(('pc_path', which('pkg-config')), lambda: (
+            check_output([which('pkg-config'), '--variable', 'pc_path',
+                          'pkg-config'], stderr=open('/dev/null', 'w'),
+                         universal_newlines=True).strip().split(os.pathsep)))
+    return [path for path in paths if path]
+
+
+def _find_pc_file(name):
+    for path in _pkg_config_search_path():
+        pc_file = os.path.join(path, name + '.pc')
+        if os.path.isfile(pc_file):
+            return pc_file
+    return None
+
+
+def _load_pkg_config_cache():
+    if _pkg_config_cache['entries'] is None:
+        try:
+            with open(_pkg_config_cache['path'], 'r') as fp:
+                _pkg_config_cache['entries'] = json.load(fp)
+        except (IOError, ValueError):
+            _pkg_config_cache['entries'] = {}
+    return _pkg_config_cache['entries']
+
+
+def _save_pkg_config_cache(key, entry):
+    path = _pkg_config_cache['path']
+    with _lookups_lock:
+        entries = _load_pkg_config_cache()
+        entries[key] = entry
+        mkpath(os.path.dirname(os.path.abspath(path)))
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(entries, fp, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+
+def _pkg_config(name, opts):
+    key = ' '.join([os.environ.get('PKG_CONFIG_PATH', '')] + opts + [name])
+
+    pc_file = mtime = None
+    if _pkg_config_cache['path']:
+        pc_file = _find_pc_file(name)
+    if pc_file:
+        mtime = os.path.getmtime(pc_file)
+        with _lookups_lock:
+            entry = _load_pkg_config_cache().get(key)
+        if entry and entry['pc'] == pc_file and entry['mtime'] == mtime:
+            return entry['flags']
+
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([which('pkg-config')] + opts + [name],
+                                stdout=subprocess.PIPE, stderr=devnull,
+                                universal_newlines=True)
+        flags = proc.communicate()[0].strip()
+    if proc.returncode != 0:
+        return None
+
+    if pc_file:
+        _save_pkg_config_cache(key, dict(pc=pc_file, mtime=mtime,
+                                         flags=flags))
+
+    return flags
+
+
 def pkg_config(name, opts):
     if isinstance(opts, str):
         opts = [opts]
 
-    try:
-        flags = check_output([which('pkg-config')] + opts + [name],
-                             stderr=open('/dev/null', 'w')).strip()
-    except subprocess.CalledProcessError:
-        return None
-    else:
-        return flags
+    return _memoized(('pkg-config', os.environ.get('PKG_CONFIG_PATH', ''),
+                      tuple(opts), name),
+                     lambda: _pkg_config(name, list(opts)))
 
 
 def read_first_of(files):
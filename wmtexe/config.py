@@ -25,13 +25,48 @@ _DEFAULTS = [
         ('components_prefix', '/usr/local'),
         ('exec_dir', '~/.wmt'),
         ('launch_dir', '~/.wmt'),
+        ('scratch_dir', ''),
+        ('prune_missing', 'no'),
     ]),
     ('launcher', [
         ('name', 'bash-launcher'),
+        ('template_dir', ''),
     ]),
     ('bash-launcher', [
         ('bash', 'bash'),
     ]),
+    ('reporter', [
+        ('mode', 'full'),
+        ('debounce', '0.5'),
+        ('min_interval', '2'),
+        ('max_interval', '30'),
+        ('journal', 'yes'),
+        ('flush_timeout', '300'),
+    ]),
+    ('upload', [
+        ('incremental', 'no'),
+        ('delta', 'no'),
+        ('settle', '60'),
+        ('interval', '10'),
+        ('chunk_size', '8388608'),
+    ]),
+    ('output', [
+        ('include', ''),
+        ('exclude', ''),
+    ]),
+    ('unpack', [
+        ('workers', '0'),
+    ]),
+    ('gc', [
+        ('max_size', ''),
+        ('max_age', '7d'),
+    ]),
+    ('preflight', [
+        ('enabled', 'yes'),
+        ('max_age', '86400'),
+        ('modules', ''),
+        ('components', 'no'),
+    ]),
 ]
 
 
@@ -47,13 +82,45 @@ class SiteConfiguration(object):
                 config.set(section, option, value)
         self._config = config
 
-    def section(self, section):
+    def sections(self):
+        """Get the names of all the sections in the configuration.
+
+        Returns
+        -------
+        list of str
+            Section names.
+
+        """
+        return self._config.sections()
+
+    def has_option(self, section, option):
+        """Check if the configuration has a value.
+
+        Parameters
+        ----------
+        section : str
+            Name of section in configuration.
+        option : str
+            Name of configuration option.
+
+        Returns
+        -------
+        bool
+            True if the option is set.
+
+        """
+        return self._config.has_option(section, option)
+
+    def section(self, section, raw=False):
         """Get the all the values of a section in the configuration.
 
         Parameters
         ----------
         section : str
             Name of section in configuration.
+        raw : bool, optional
+            If True, return the values without interpolating ``%``
+            references (default is False).
 
         Returns
         -------
@@ -61,7 +128,7 @@ class SiteConfiguration(object):
             Configuration values of section.
 
         """
-        return self._config.items(section)
+        return self._config.items(section, raw=raw)
 
     def get(self, section, option):
         """Get a configuration value.
@@ -76,6 +143,32 @@ class SiteConfiguration(object):
         """
         return self._config.get(section, option)
 
+    def getfloat(self, section, option):
+        """Get a configuration value as a float.
+
+        Parameters
+        ----------
+        section : str
+            Name of section in configuration.
+        option : str
+            Name of configuration option.
+
+        """
+        return self._config.getfloat(section, option)
+
+    def getboolean(self, section, option):
+        """Get a configuration value as a bool.
+
+        Parameters
+        ----------
+        section : str
+            Name of section in configuration.
+        option : str
+            Name of configuration option.
+
+        """
+        return self._config.getboolean(section, option)
+
     def set(self, section, option, value):
         """Set a configuration value.
 
@@ -144,6 +237,28 @@ INSTALL_ETC = os.path.join(sys.exec_prefix, 'etc')
 USER_CONFIG_PATH = os.path.expanduser('~/.wmt')
 
 
+def configuration_paths(filenames=None):
+    """Get the files that a wmt-exe configuration is read from.
+
+    Parameters
+    ----------
+    filenames : dict, optional
+        Configuration files.
+
+    Returns
+    -------
+    list of str
+        Paths to configuration files, which may not exist.
+
+    """
+    if isinstance(filenames, str):
+        return [filenames]
+    return filenames or ['wmt.cfg',
+                         os.path.join(USER_CONFIG_PATH, 'wmt.cfg'),
+                         os.path.join(INSTALL_ETC, 'wmt.cfg'),
+                        ]
+
+
 def load_configuration(filenames=None):
     """Load a wmt-exe configuration.
 
@@ -158,8 +273,4 @@ def load_configuration(filenames=None):
         The configuration.
 
     """
-    paths = filenames or ['wmt.cfg',
-                          os.path.join(USER_CONFIG_PATH, 'wmt.cfg'),
-                          os.path.join(INSTALL_ETC, 'wmt.cfg'),
-                         ]
-    return SiteConfiguration.from_path(paths)
+    return SiteConfiguration.from_path(configuration_paths(filenames))
@@ -0,0 +1,592 @@
+"""An asyncio engine for the network I/O of wmt-exe tasks.
+
+A single `IoEngine` runs one event loop on a background thread and can
+drive the status reports, downloads and uploads of many tasks at once.
+Models still run in subprocesses; only their I/O goes through the
+engine. The engine's blocking methods (`IoEngine.report`,
+`IoEngine.download`, `IoEngine.upload`) let synchronous code, such as
+`RunTask`, use it without change.
+
+If `aiohttp` is installed it is used for HTTP; otherwise requests are
+made with `requests` on a bounded thread pool.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+logger = logging.getLogger(__name__)
+"""Logger : Instance of Logging class."""
+
+
+Response = collections.namedtuple('Response', ['status_code', 'text'])
+"""Response : The status code and body of a server response."""
+
+
+def _url(base, *parts):
+    return '/'.join([base.rstrip('/')] + [part.strip('/') for part in parts])
+
+
+class IoEngine(object):
+    """Event loop for wmt-exe network I/O.
+
+    Parameters
+    ----------
+    max_connections : int, optional
+        Maximum number of simultaneous HTTP connections (default is 64).
+    max_workers : int, optional
+        Size of the thread pool used for blocking calls. Without
+        aiohttp, every request holds a thread of this pool, so the
+        default is *max_connections*; with aiohttp it is 8.
+
+    """
+    def __init__(self, max_connections=64, max_workers=None):
+        if max_workers is None:
+            max_workers = max_connections if aiohttp is None else 8
+        self._max_connections = max_connections
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='wmt-io-engine')
+        self._thread.daemon = True
+        self._session = None
+        self._limit = None
+        self._thread.start()
+
+    @property
+    def loop(self):
+        """The engine's event loop."""
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine's loop.
+
+        Parameters
+        ----------
+        coro : coroutine
+            The coroutine to run.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future for the coroutine's result.
+
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the engine's loop and wait for its result.
+
+        Parameters
+        ----------
+        coro : coroutine
+            The coroutine to run.
+        timeout : float, optional
+            Seconds to wait for the result (default is to wait forever).
+
+        Returns
+        -------
+        object
+            The result of the coroutine.
+
+        """
+        return self.submit(coro).result(timeout)
+
+    def close(self):
+        """Stop the engine's loop and release its resources."""
+        if self._session is not None:
+            if aiohttp is not None:
+                self.run(self._session.close())
+            else:
+                self._session.close()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+
+    def _get_session(self):
+        if self._session is None:
+            if aiohttp is not None:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=self._max_connections))
+            else:
+                import requests
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_maxsize=self._max_connections)
+                self._session = requests.Session()
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            self._limit = asyncio.Semaphore(self._max_connections)
+        return self._session
+
+    async def post(self, url, data=None, dest=None, files=None,
+                   chunk_size=8192):
+        """Send a POST request.
+
+        Parameters
+        ----------
+        url : str
+            The URL.
+        data : dict, optional
+            Form fields.
+        dest : str, optional
+            If given, stream the response body into this file.
+        files : dict, optional
+            Files to upload as multipart form data, as a mapping of
+            field name to path.
+        chunk_size : int, optional
+            Size of chunks when streaming a response (default is 8192).
+
+        Returns
+        -------
+        Response
+            The status code and body (empty if streamed to *dest*).
+
+        """
+        session = self._get_session()
+        async with self._limit:
+            if aiohttp is not None:
+                return await self._aiohttp_post(session, url, data, dest,
+                                                files, chunk_size)
+            else:
+                return await self._loop.run_in_executor(
+                    None, _requests_post, session, url, data, dest, files,
+                    chunk_size)
+
+    async def _aiohttp_post(self, session, url, data, dest, files,
+                            chunk_size):
+        opened = []
+        try:
+            if files:
+                form = aiohttp.FormData(data or {})
+                for name, path in files.items():
+                    fp = open(path, 'rb')
+                    opened.append(fp)
+                    form.add_field(name, fp,
+                                   filename=os.path.basename(path))
+                body = form
+            else:
+                body = data
+
+            async with session.post(url, data=body) as resp:
+                if dest is not None and resp.status == 200:
+                    with open(dest, 'wb') as fp:
+                        async for chunk in resp.content.iter_chunked(
+                                chunk_size):
+                            fp.write(chunk)
+                    return Response(resp.status, '')
+                return Response(resp.status, await resp.text())
+        finally:
+            for fp in opened:
+                fp.close()
+
+    async def report_async(self, server, uuid, status, message):
+        """Report task status.
+
+        Parameters
+        ----------
+        server : str
+            URL of API server.
+        uuid : str
+            The unique UUID for the job.
+        status : str
+            Type of report.
+        message : str
+            Message for report.
+
+        Returns
+        -------
+        Response
+            Response from server.
+
+        """
+        logger.info('%s: %s' % (status, message))
+        return await self.post(_url(server, 'run/update'), data={
+            'uuid': uuid,
+            'status': status,
+            'message': message,
+        })
+
+    async def download_async(self, server, uuid, dest_dir='.'):
+        """Download the tarball of simulation inputs for a job.
+
+        Parameters
+        ----------
+        server : str
+            URL of API server.
+        uuid : str
+            The unique UUID for the job.
+        dest_dir : str, optional
+            Path to download directory (default is current directory).
+
+        Returns
+        -------
+        str
+            Full path to downloaded tarball.
+
+        """
+        from .task import DownloadError
+
+        url = _url(server, 'package/create')
+        resp = await self.post(url, data={'uuid': uuid, 'filename': ''})
+        if resp.status_code != 200:
+            raise DownloadError(resp.status_code, url + ':' + uuid + '.tar.gz')
+        info = json.loads(resp.text)
+
+        url = _url(info['url'], info['filename'])
+        dest_name = os.path.join(dest_dir, info['filename'])
+        resp = await self.post(url, dest=dest_name)
+        if resp.status_code != 200:
+            raise DownloadError(resp.status_code, url + ':' + info['filename'])
+
+        await self.post(_url(server, 'package/delete', uuid))
+
+        return dest_name
+
+    async def upload_async(self, server, uuid, path):
+        """Upload a tarball of simulation output.
+
+        Parameters
+        ----------
+        server : str
+            URL of API server.
+        uuid : str
+            The unique UUID for the job.
+        path : str
+            Path to tarball.
+
+        Returns
+        -------
+        Response
+            Response from server.
+
+        """
+        from .task import UploadError
+
+        resp = await self.post(_url(server, 'run/upload', uuid),
+                               files={'file': path})
+        if resp.status_code != 200:
+            raise UploadError(resp.status_code, path)
+        return resp
+
+    def report(self, server, uuid, status, message):
+        """Report task status, blocking until it is sent.
+
+        See `report_async` for parameters.
+        """
+        return self.run(self.report_async(server, uuid, status, message))
+
+    def download(self, server, uuid, dest_dir='.'):
+        """Download a tarball of simulation inputs, blocking until done.
+
+        See `download_async` for parameters.
+        """
+        return self.run(self.download_async(server, uuid, dest_dir=dest_dir))
+
+    def upload(self, server, uuid, path):
+        """Upload a tarball of simulation output, blocking until done.
+
+        See `upload_async` for parameters.
+        """
+        return self.run(self.upload_async(server, uuid, path))
+
+
+def _requests_post(session, url, data, dest, files, chunk_size):
+    opened = {}
+    try:
+        for name, path in (files or {}).items():
+            opened[name] = open(path, 'rb')
+        resp = session.post(url, data=data, files=opened or None,
+                            stream=dest is not None)
+        if dest is not None and resp.status_code == 200:
+            with open(dest, 'wb') as fp:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        fp.write(chunk)
+            return Response(resp.status_code, '')
+        return Response(resp.status_code, resp.text)
+    finally:
+        for fp in opened.values():
+            fp.close()
+
+
+_DEFAULT_ENGINE = None
+_DEFAULT_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine():
+    """Get the process-wide I/O engine, starting it if necessary.
+
+    Returns
+    -------
+    IoEngine
+        The shared engine.
+
+    """
+    global _DEFAULT_ENGINE
+    with _DEFAULT_ENGINE_LOCK:
+        if _DEFAULT_ENGINE is None:
+            _DEFAULT_ENGINE = IoEngine()
+        return _DEFAULT_ENGINE
+
+
+class AsyncReporter(object):
+    """Status reporter that runs as a task on an `IoEngine`.
+
+    It has the same interface as `Reporter` but uses no thread of its
+    own.
+
+    Parameters
+    ----------
+    id : str
+        A unique UUID for a job.
+    server : str
+        URL of API server.
+    filename : str
+        Name of status file.
+    engine : IoEngine, optional
+        The engine to run on (default is the shared engine).
+    mode : {'full', 'delta'}, optional
+        Reporting mode (default is 'full').
+    debounce : float, optional
+        Seconds to wait after a change before reporting (default is 0.5).
+    min_interval : float, optional
+        Minimum number of seconds between reports (default is 2).
+    max_interval : float, optional
+        Maximum number of seconds between reports (default is 30).
+    poll_interval : float, optional
+        Seconds between checks when files can't be watched with inotify
+        (default is 1).
+    flusher : JournalFlusher, optional
+        If given, journal reports through this flusher rather than
+        sending them from the engine.
+
+    """
+    def __init__(self, id, server, filename, engine=None, mode='full',
+                 debounce=.5, min_interval=2., max_interval=30.,
+                 poll_interval=1., flusher=None):
+        self._args = (id, server, filename)
+        self._engine = engine or get_engine()
+        self._flusher = flusher
+        self._mode = mode
+        self._debounce = debounce
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._poll_interval = poll_interval
+        self._stop_event = None
+        self._future = None
+
+    def start(self):
+        """Start reporting on a task."""
+        self._future = self._engine.submit(self._run())
+
+    def stop(self):
+        """Stop reporting on a task."""
+        loop = self._engine.loop
+        loop.call_soon_threadsafe(self._set_stop)
+
+    def _set_stop(self):
+        if self._stop_event is None:
+            self._stop_event = asyncio.Event()
+        self._stop_event.set()
+
+    def stopped(self):
+        """Check whether reporting has stopped.
+
+        Returns
+        -------
+        bool
+            True if reporting has stopped.
+
+        """
+        return self._stop_event is not None and self._stop_event.is_set()
+
+    def join(self, timeout=None):
+        """Wait for reporting to finish.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait (default is to wait forever).
+
+        """
+        if self._future is not None:
+            self._future.result(timeout)
+
+    async def _wait(self, events, timeout):
+        waiters = [asyncio.ensure_future(event.wait()) for event in events]
+        try:
+            await asyncio.wait(waiters, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _poll(self, watcher, changed):
+        while 1:
+            await asyncio.sleep(self._poll_interval)
+            if watcher.wait(timeout=0):
+                changed.set()
+
+    async def _report(self, reporter, message, status='running'):
+        id, server, _ = self._args
+        try:
+            if self._flusher is not None:
+                return await self._engine.loop.run_in_executor(
+                    None, reporter.report, status, message)
+            return await self._engine.report_async(server, id, status,
+                                                   message)
+        except Exception as error:
+            logger.warning('{id}: unable to report status ({err})'.format(
+                id=id, err=error))
+            return None
+
+    async def _run(self):
+        from .reporter import TaskStatus, TaskCompleted, is_delivered
+        from .watch import watch_files
+
+        loop = self._engine.loop
+
+        if self._stop_event is None:
+            self._stop_event = asyncio.Event()
+        changed = asyncio.Event()
+
+        reporter = TaskStatus(*self._args, mode=self._mode,
+                              flusher=self._flusher)
+        watcher = watch_files([reporter.status_file,
+                               reporter.progress_file])
+        fd = watcher.fileno()
+        if fd is not None:
+            loop.add_reader(
+                fd, lambda: watcher.wait(timeout=0) and changed.set())
+            poller = None
+        else:
+            poller = asyncio.ensure_future(self._poll(watcher, changed))
+
+        try:
+            while 1:
+                last_report = loop.time()
+                try:
+                    status = await loop.run_in_executor(
+                        None, reporter.get_status)
+                except TaskCompleted:
+                    break
+                except Exception as error:
+                    await self._report(
+                        reporter, 'Error getting status ({err})'.format(err=error))
+                else:
+                    if is_delivered(await self._report(reporter, status)):
+                        reporter.acknowledge()
+
+                await self._wait([changed, self._stop_event],
+                                 self._max_interval)
+                if changed.is_set():
+                    await self._wait([self._stop_event], max(
+                        self._debounce,
+                        last_report + self._min_interval - loop.time()))
+                    changed.clear()
+
+                if self.stopped():
+                    break
+        finally:
+            if fd is not None:
+                loop.remove_reader(fd)
+            if poller is not None:
+                poller.cancel()
+            watcher.close()
+
+        await self._report(reporter, 'completed', status='success')
+
+
+async def _fetch_run(engine, url, id, slots, dest, dir_mode, unpack, clean,
+                     unpack_workers, callback):
+    import time
+    import functools
+    from .extract import extract_tarball
+
+    result = dict(id=id, status='ok', error=None, size=0, elapsed=0.)
+    async with slots:
+        start = time.time()
+        try:
+            tarball = await engine.download_async(url, id, dest_dir=dest)
+            result['size'] = os.path.getsize(tarball)
+            if unpack:
+                await engine.loop.run_in_executor(None, functools.partial(
+                    extract_tarball, tarball, dest=dest,
+                    dir_mode=dir_mode, max_workers=unpack_workers))
+                if clean:
+                    os.remove(tarball)
+        except Exception as error:
+            result.update(status='error', error=str(error))
+        result['elapsed'] = time.time() - start
+    if callback is not None:
+        callback(result)
+    return result
+
+
+async def _fetch_all(engine, url, ids, max_downloads, **kwds):
+    slots = asyncio.Semaphore(max_downloads)
+    return await asyncio.gather(*[
+        _fetch_run(engine, url, id, slots, **kwds) for id in ids])
+
+
+def fetch_runs(url, ids, dest='.', max_downloads=8, unpack=True,
+               clean=False, unpack_workers=None, dir_mode=None,
+               callback=None):
+    """Download and unpack many simulations concurrently.
+
+    Downloads share a pool of connections. Each simulation is unpacked
+    as soon as its download finishes.
+
+    Parameters
+    ----------
+    url : str
+        URL of WMT server.
+    ids : list of str
+        Run IDs.
+    dest : str, optional
+        Destination directory (default is current directory).
+    max_downloads : int, optional
+        Maximum number of simultaneous downloads (default is 8).
+    unpack : bool, optional
+        If True, unpack each tarball (default is True).
+    clean : bool, optional
+        If True, remove each tarball after unpacking it (default is
+        False).
+    unpack_workers : int, optional
+        Number of threads to unpack the files of each tarball with.
+    dir_mode : int, optional
+        Permissions for directories created while unpacking.
+    callback : callable, optional
+        Called with the result of each run as it finishes.
+
+    Returns
+    -------
+    list of dict
+        For each run, in the order of *ids*, its ``id``, ``status``
+        ('ok' or 'error'), ``error`` message, tarball ``size`` in bytes
+        and ``elapsed`` seconds.
+
+    """
+    engine = IoEngine(max_connections=max_downloads,
+                      max_workers=max_downloads)
+    try:
+        return engine.run(_fetch_all(
+            engine, url, ids, max_downloads, dest=dest, dir_mode=dir_mode,
+            unpack=unpack, clean=clean, unpack_workers=unpack_workers,
+            callback=callback))
+    finally:
+        engine.close()
@@ -11,6 +11,105 @@ from . import formatting
 from .config import load_configuration
 
 
+class PathList(object):
+    """An ordered list of paths without duplicates.
+
+    Paths are normalized as they are added, and a path that is already
+    in the list keeps its position, so building a list of *n* paths
+    takes O(*n*) time.
+
+    Parameters
+    ----------
+    paths : str or iterable of str, optional
+        Initial paths, as a list or as a string of separated paths.
+    sep : str, optional
+        Path separator (default is `os.pathsep`).
+    normalize : function, optional
+        Function that normalizes a path (default is `os.path.normpath`).
+    existing_only : bool, optional
+        If True, leave out paths that don't exist.
+
+    """
+    def __init__(self, paths=None, sep=pathsep, normalize=path.normpath,
+                 existing_only=False):
+        self._sep = sep
+        self._normalize = normalize
+        self._existing_only = existing_only
+        self._paths = OrderedDict()
+        self.append(paths or [])
+
+    def _iter_new(self, paths):
+        if isinstance(paths, str):
+            paths = paths.split(self._sep)
+        for p in paths:
+            if not p:
+                continue
+            p = self._normalize(p)
+            if not self._existing_only or path.exists(p):
+                yield p
+
+    def append(self, paths):
+        """Add paths to the end of the list.
+
+        Parameters
+        ----------
+        paths : str or iterable of str
+            Paths to add.
+
+        """
+        for p in self._iter_new(paths):
+            self._paths.setdefault(p, None)
+
+    def prepend(self, paths):
+        """Add paths to the start of the list, keeping their order.
+
+        A path that is already in the list is moved to the front.
+
+        Parameters
+        ----------
+        paths : str or iterable of str
+            Paths to add.
+
+        """
+        new = OrderedDict.fromkeys(self._iter_new(paths))
+        for p in self._paths:
+            new.setdefault(p, None)
+        self._paths = new
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, p):
+        return self._normalize(p) in self._paths
+
+    def __str__(self):
+        return self._sep.join(self._paths)
+
+
+def join_paths(paths, sep=pathsep, existing_only=False):
+    """Join paths, without duplicates, into a single string.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        Paths to join.
+    sep : str, optional
+        Path separator (default is `os.pathsep`).
+    existing_only : bool, optional
+        If True, leave out paths that don't exist.
+
+    Returns
+    -------
+    str
+        The joined paths.
+
+    """
+    return str(PathList(paths, sep=sep, existing_only=existing_only))
+
+
 class Babel(object):
     """CCA Babel configuration.
 
@@ -68,7 +167,8 @@ class Babel(object):
         """
         try:
             return subprocess.check_output(
-                [self.babel_config, '--query-var=%s' % var]).strip()
+                [self.babel_config, '--query-var=%s' % var],
+                universal_newlines=True).strip()
         except (OSError, subprocess.CalledProcessError):
             return None
 
@@ -88,7 +188,8 @@ class Babel(object):
         """
         try:
             return subprocess.check_output(
-                [self.cca_spec_babel_config, '--var', var]).strip()
+                [self.cca_spec_babel_config, '--var', var],
+                universal_newlines=True).strip()
         except (OSError, subprocess.CalledProcessError):
             print([self.cca_spec_babel_config, '--var', var])
             raise
@@ -163,7 +264,9 @@ class Python(object):
 
         """
         version = subprocess.check_output(
-            [self.executable, '-c', 'import sys; print(sys.version[:3])'])
+            [self.executable, '-c',
+             'import sys; print("%d.%d" % sys.version_info[:2])'],
+            universal_newlines=True)
         return 'python%s' % version.strip()
 
     def query_exec_prefix(self):
@@ -176,7 +279,8 @@ class Python(object):
 
         """
         prefix = subprocess.check_output(
-            [self.executable, '-c', 'import sys; print(sys.exec_prefix)'])
+            [self.executable, '-c', 'import sys; print(sys.exec_prefix)'],
+            universal_newlines=True)
         return path.normpath(prefix.strip())
 
 
@@ -228,36 +332,41 @@ class WmtEnvironment(object):
 
         wmt_prefix = d['wmt_prefix']
         components_prefix = d['components_prefix']
+        existing_only = str(d.get('prune_missing', 'no')).lower() in (
+            'yes', 'true', 'on', '1')
+
+        def join(paths, sep=pathsep):
+            return join_paths(paths, sep=sep, existing_only=existing_only)
 
         env._env.update({
             'CURL': d['curl'],
             'TAIL': d['tail'],
             'BASH': d['bash'],
-            'PYTHONPATH': pathsep.join([
+            'PYTHONPATH': join([
                 python.site_packages(),
                 path.join(python.prefix, 'lib', python.version),
                 python.site_packages(components_prefix),
                 python.site_packages(babel.prefix),
                 path.join(babel.libs, python.version, 'site-packages'),
             ]),
-            'LD_LIBRARY_PATH': pathsep.join([
+            'LD_LIBRARY_PATH': join([
                 path.join(python.prefix, 'lib'),
                 path.join(components_prefix, 'lib'),
                 path.join(wmt_prefix, 'lib'),
                 path.join(babel.prefix, 'lib'),
             ]),
-            'PATH': pathsep.join([
+            'PATH': join([
                 path.join(python.prefix, 'bin'),
                 '/usr/local/bin',
                 '/usr/bin',
                 '/bin',
             ]),
-            'CLASSPATH': pathsep.join([
+            'CLASSPATH': join([
                 path.join(components_prefix, 'lib', 'java'),
             ]),
-            'SIDL_DLL_PATH': ';'.join([
+            'SIDL_DLL_PATH': join([
                 path.join(components_prefix, 'share', 'cca'),
-            ]),
+            ], sep=';'),
         })
         env._env['LD_RUN_PATH'] = env['LD_LIBRARY_PATH']
 
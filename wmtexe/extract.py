@@ -0,0 +1,278 @@
+"""Safely extract simulation tarballs.
+
+Members are validated and extracted in a single pass over the tarball.
+Any member that would land outside of the destination directory (an
+absolute or ``..`` path, a path through a symbolic link, or a link that
+resolves to outside of it) stops the extraction with an
+`UnsafeArchiveError`. Small files can optionally be
+written by a pool of threads while the tarball is still being read.
+"""
+
+import os
+import tarfile
+import threading
+
+
+class UnsafeArchiveError(tarfile.TarError):
+    """Exception raised for a tarball member that escapes its destination.
+
+    Parameters
+    ----------
+    name : str
+        Name of the tarball member.
+    reason : str
+        Why the member is unsafe.
+
+    """
+    def __init__(self, name, reason):
+        super(UnsafeArchiveError, self).__init__(name, reason)
+        self._name = name
+        self._reason = reason
+
+    def __str__(self):
+        return '%s: %s' % (self._name, self._reason)
+
+
+def _is_within(root, path):
+    return path == root or path.startswith(root + os.sep)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _safe_mode(member):
+    """Permissions for a member, sanitised as by tarfile's data filter.
+
+    The setuid, setgid and sticky bits and group and other write
+    permission are dropped. Files are always readable and writable by
+    their owner, and executable only if their owner may execute them.
+    """
+    mode = member.mode & 0o755
+    if member.isreg() or member.islnk():
+        if not mode & 0o100:
+            mode &= ~0o111
+        mode |= 0o600
+    return mode
+
+
+def _write_file(path, data, mode, mtime):
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0)
+    fd = os.open(path, flags, 0o600)
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+        os.fchmod(fd, mode)
+    os.utime(path, (mtime, mtime))
+
+
+class _Validator(object):
+    """Check that tarball members stay within a directory."""
+
+    def __init__(self, dest):
+        self._dest = os.path.realpath(dest)
+        self._dirs = set()
+
+    @property
+    def dest(self):
+        return self._dest
+
+    def _has_symlink_parent(self, path):
+        """Check if a directory, or any above it in dest, is a symlink."""
+        missing = []
+        while path != self._dest and path not in self._dirs:
+            if os.path.islink(path):
+                return True
+            if os.path.isdir(path):
+                missing.append(path)
+            path = os.path.dirname(path)
+        self._dirs.update(missing)
+        return False
+
+    def forget(self, path):
+        """Forget checked directories at or below a replaced path."""
+        prefix = path + os.sep
+        self._dirs = set(p for p in self._dirs
+                         if p != path and not p.startswith(prefix))
+
+    def _resolves_within(self, path):
+        return _is_within(self._dest, os.path.realpath(path))
+
+    def check(self, member):
+        """Get the path a member extracts to, if it is safe.
+
+        Parameters
+        ----------
+        member : TarInfo
+            A tarball member.
+
+        Returns
+        -------
+        str
+            Absolute path of the extracted member.
+
+        """
+        name = member.name
+        if os.path.isabs(name):
+            raise UnsafeArchiveError(name, 'absolute path')
+
+        target = os.path.normpath(os.path.join(self._dest, name))
+        if not _is_within(self._dest, target):
+            raise UnsafeArchiveError(name, 'path is outside of destination')
+
+        if target != self._dest:
+            if self._has_symlink_parent(os.path.dirname(target)):
+                raise UnsafeArchiveError(name, 'parent is a symbolic link')
+
+        # Links are resolved against what has already been extracted, so
+        # a chain of links can't be used to point outside of dest.
+        if member.issym():
+            link = os.path.join(os.path.dirname(target), member.linkname)
+            if (os.path.isabs(member.linkname) or
+                    not _is_within(self._dest, os.path.normpath(link)) or
+                    not self._resolves_within(link)):
+                raise UnsafeArchiveError(name, 'link is outside of '
+                                         'destination')
+        elif member.islnk():
+            link = os.path.join(self._dest, member.linkname)
+            if (os.path.isabs(member.linkname) or
+                    not _is_within(self._dest, os.path.normpath(link)) or
+                    not self._resolves_within(link)):
+                raise UnsafeArchiveError(name, 'link is outside of '
+                                         'destination')
+        elif member.isdev():
+            raise UnsafeArchiveError(name, 'device files are not allowed')
+
+        return target
+
+
+class _Writer(object):
+    """Write files on a pool of threads, limiting the data held in memory."""
+
+    def __init__(self, max_workers, max_pending):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, *args):
+        self._slots.acquire()
+        future = self._pool.submit(_write_file, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def wait(self):
+        """Wait for every submitted write, raising the first error."""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._pool.shutdown()
+
+
+def _replace(path):
+    # A later member replaces an earlier one. Remove a link first so that
+    # it's never written through.
+    if os.path.islink(path):
+        os.unlink(path)
+
+
+def _extract_member(tar, member, dest):
+    # tarfile's data filter repeats the checks against the files on disk.
+    if hasattr(tarfile, 'data_filter'):
+        tar.extract(member, path=dest, filter='data')
+    else:
+        tar.extract(member, path=dest)
+        if member.isreg():
+            os.chmod(os.path.join(dest, member.name), _safe_mode(member))
+
+
+def extract_tarball(tarball, dest='.', dir_mode=None, max_workers=None,
+                    small_file_size=1 << 20):
+    """Validate and extract a tarball in a single pass.
+
+    Parameters
+    ----------
+    tarball : str or TarFile
+        Path to a tarball, or an open tarball.
+    dest : str, optional
+        Directory to extract into (default is current directory).
+    dir_mode : int, optional
+        Permissions for extracted directories (default is the mode
+        stored in the tarball, less any group or other write permission).
+    max_workers : int, optional
+        If greater than one, write files no larger than
+        *small_file_size* on this many threads (default is to write
+        every file on the calling thread).
+    small_file_size : int, optional
+        Largest file, in bytes, written on a worker thread (default is
+        1 MiB).
+
+    Returns
+    -------
+    int
+        Number of members extracted.
+
+    Raises
+    ------
+    UnsafeArchiveError
+        If a member would be written outside of *dest*.
+
+    """
+    if not isinstance(tarball, tarfile.TarFile):
+        with tarfile.open(tarball, 'r') as tar:
+            return extract_tarball(tar, dest=dest, dir_mode=dir_mode,
+                                   max_workers=max_workers,
+                                   small_file_size=small_file_size)
+
+    tar = tarball
+    _makedirs(dest)
+    validator = _Validator(dest)
+    dest = validator.dest
+
+    writer = None
+    if max_workers and max_workers > 1:
+        writer = _Writer(max_workers, max_pending=max_workers * 4)
+
+    dirs = []
+    n_members = 0
+    try:
+        for member in tar:
+            path = validator.check(member)
+            n_members += 1
+
+            if member.isdir():
+                _makedirs(path)
+                dirs.append((path, member))
+                continue
+
+            if writer is not None and not member.isreg():
+                writer.wait()
+            validator.forget(path)
+            _replace(path)
+
+            if (writer is not None and member.isreg() and
+                    member.size <= small_file_size):
+                _makedirs(os.path.dirname(path))
+                data = tar.extractfile(member).read()
+                writer.submit(path, data, _safe_mode(member), member.mtime)
+            else:
+                _extract_member(tar, member, dest)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    for path, member in reversed(dirs):
+        mode = _safe_mode(member) if dir_mode is None else dir_mode
+        os.chmod(path, mode)
+        os.utime(path, (member.mtime, member.mtime))
+
+    return n_members
@@ -0,0 +1,491 @@
+"""Clean up finished and stale runs in a wmt-exe execution directory.
+
+Finished runs are moved into a trash directory, which is a cheap
+rename, and deleted by a detached process so that the job doesn't wait
+on it. `collect_garbage` enforces a size cap and a maximum age on the
+execution directory, removing the least recently modified runs first.
+Only entries named after a run's UUID are ever considered, and a run is
+left alone while a process holds its `RunMarker` or while it is still
+waiting in a batch queue.
+"""
+
+import os
+import re
+import fcntl
+import time
+import uuid
+import shutil
+import logging
+import threading
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+"""Logger : Instance of Logging class."""
+
+
+TRASH_DIR = '.trash'
+"""str : Name of the trash directory within an execution directory."""
+
+RUNNING_SUFFIX = '.running'
+"""str : Extension of the marker file held by a run in progress."""
+
+LAUNCH_SUFFIXES = ('.sh', '.run.sh', '.out')
+"""tuple of str : Extensions of the files written to launch a run."""
+
+_RUN_ID = re.compile(r'^[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?'
+                     r'[0-9a-f]{4}-?[0-9a-f]{12}$', re.IGNORECASE)
+
+_SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+_AGE_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_size(size):
+    """Parse a size such as ``500M`` or ``20G`` into bytes.
+
+    Parameters
+    ----------
+    size : str or int
+        The size. An empty string means no size.
+
+    Returns
+    -------
+    int or None
+        The size in bytes.
+
+    """
+    if size is None or isinstance(size, int):
+        return size
+    if not size.strip():
+        return None
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([kmgt]?)b?\s*$', size.lower())
+    if match is None:
+        raise ValueError('{size}: unable to parse size'.format(size=size))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def parse_age(age):
+    """Parse an age such as ``12h`` or ``7d`` into seconds.
+
+    Parameters
+    ----------
+    age : str or float
+        The age. An empty string means no age.
+
+    Returns
+    -------
+    float or None
+        The age in seconds.
+
+    """
+    if age is None or isinstance(age, (int, float)):
+        return age
+    if not age.strip():
+        return None
+    match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([smhdw]?)\s*$', age.lower())
+    if match is None:
+        raise ValueError('{age}: unable to parse age'.format(age=age))
+    return float(match.group(1)) * _AGE_UNITS[match.group(2)]
+
+
+def disk_usage(path):
+    """Get the size and latest modification time of a file or directory.
+
+    Parameters
+    ----------
+    path : str
+        Path to a file or directory.
+
+    Returns
+    -------
+    tuple of (int, float)
+        Total bytes and the most recent modification time of anything
+        under *path*.
+
+    """
+    stat = os.lstat(path)
+    size, mtime = stat.st_size, stat.st_mtime
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    stat = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                size += stat.st_size
+                mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+def discard(path, exe_dir):
+    """Move a file or directory into the trash.
+
+    Parameters
+    ----------
+    path : str
+        Path to remove.
+    exe_dir : str
+        Execution directory whose trash to use. It should be on the same
+        file system as *path*.
+
+    Returns
+    -------
+    str or None
+        New path of the item in the trash, or None if *path* doesn't
+        exist.
+
+    """
+    trash = os.path.join(exe_dir, TRASH_DIR)
+    try:
+        os.makedirs(trash)
+    except OSError:
+        if not os.path.isdir(trash):
+            raise
+
+    dest = os.path.join(trash, '%s.%s' % (os.path.basename(path),
+                                          uuid.uuid4().hex[:8]))
+    try:
+        os.rename(path, dest)
+    except OSError:
+        if not os.path.lexists(path):
+            return None
+        raise
+    return dest
+
+
+def purge_in_background(exe_dir):
+    """Delete the contents of the trash from a detached process.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory whose trash to empty.
+
+    """
+    trash = os.path.join(exe_dir, TRASH_DIR)
+    items = [os.path.join(trash, name) for name in os.listdir(trash)] \
+        if os.path.isdir(trash) else []
+    if not items:
+        return
+
+    with open(os.devnull, 'w') as devnull:
+        subprocess.Popen(['rm', '-rf', '--'] + items, stdout=devnull,
+                         stderr=devnull, close_fds=True,
+                         start_new_session=True)
+
+
+def remove(path):
+    """Delete a file or directory.
+
+    Parameters
+    ----------
+    path : str
+        Path to delete.
+
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def run_id_of(name):
+    """Get the run that an entry of an execution directory belongs to.
+
+    Parameters
+    ----------
+    name : str
+        File or directory name, such as ``<uuid>``, ``<uuid>.tar.gz``
+        or ``<uuid>.log``.
+
+    Returns
+    -------
+    str
+        The run id.
+
+    """
+    return name.split('.', 1)[0]
+
+
+def is_run_id(run_id):
+    """Check whether a string looks like the id of a run.
+
+    Parameters
+    ----------
+    run_id : str
+        Candidate run id.
+
+    Returns
+    -------
+    bool
+        True if *run_id* is a UUID.
+
+    """
+    return _RUN_ID.match(run_id) is not None
+
+
+class RunMarker(object):
+    """Mark a run as in progress for as long as the marker is held.
+
+    The marker is a file, ``<run_id>.running``, in the execution
+    directory that is locked while the run is in progress and removed
+    when it finishes. `is_active` checks for the lock, so a run is
+    protected from the janitor whether or not it keeps a report journal.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory.
+    run_id : str
+        The unique UUID for the run.
+
+    """
+    def __init__(self, exe_dir, run_id):
+        self._path = os.path.join(exe_dir, run_id + RUNNING_SUFFIX)
+        self._fd = None
+
+    @property
+    def path(self):
+        """Path to the marker file."""
+        return self._path
+
+    def acquire(self):
+        """Create and lock the marker.
+
+        Returns
+        -------
+        bool
+            True if the marker was locked, False if another process
+            holds it.
+
+        """
+        if self._fd is None:
+            fd = os.open(self._path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                return False
+            self._fd = fd
+        return True
+
+    def release(self):
+        """Remove and unlock the marker."""
+        if self._fd is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        # The janitor locks the marker briefly to test it, so try again
+        # before deciding that someone else holds it.
+        for _ in range(10):
+            if self.acquire():
+                break
+            time.sleep(.1)
+        else:
+            logger.warning('{path}: marker is held by another process'.format(
+                path=self._path))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _is_locked(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def find_runs(exe_dir):
+    """Group the entries of an execution directory by run.
+
+    Entries whose names don't start with a run's UUID are not part of
+    any run and are ignored.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory.
+
+    Returns
+    -------
+    dict
+        Lists of paths keyed by run id.
+
+    """
+    runs = {}
+    for name in os.listdir(exe_dir):
+        run_id = run_id_of(name)
+        if not is_run_id(run_id):
+            continue
+        runs.setdefault(run_id, []).append(
+            os.path.join(exe_dir, name))
+    return runs
+
+
+def is_active(paths):
+    """Check whether a run is still in progress.
+
+    A run is active if another process holds its `RunMarker` or the
+    lock on its report journal.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths that belong to the run.
+
+    Returns
+    -------
+    bool
+        True if the run is active.
+
+    """
+    for path in paths:
+        if path.endswith((RUNNING_SUFFIX, '.journal')) and _is_locked(path):
+            return True
+    return False
+
+
+def is_queued(paths):
+    """Check whether a run is waiting to be started by a batch system.
+
+    A run that has been submitted to a queue but not yet started has
+    nothing in the execution directory but its launch scripts and,
+    possibly, the output file of the batch system.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths that belong to the run.
+
+    Returns
+    -------
+    bool
+        True if the run only has launch files.
+
+    """
+    return all(path.endswith(LAUNCH_SUFFIXES) for path in paths)
+
+
+def collect_garbage(exe_dir, max_size=None, max_age=None, keep=(),
+                    dry_run=False):
+    """Remove stale runs from an execution directory.
+
+    Runs older than *max_age* are removed, then the least recently
+    modified runs are removed until the directory is no larger than
+    *max_size*. Runs that are in progress or still queued are never
+    removed. Anything already in the trash is removed too.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory.
+    max_size : int or str, optional
+        Maximum total size, in bytes or as a string like ``20G``.
+    max_age : float or str, optional
+        Maximum age, in seconds or as a string like ``7d``.
+    keep : iterable of str, optional
+        Ids of runs to never remove.
+    dry_run : bool, optional
+        If True, report what would be removed without removing it.
+
+    Returns
+    -------
+    list of tuple
+        Run id, bytes reclaimed and reason for each removed run.
+
+    """
+    exe_dir = os.path.expandvars(os.path.expanduser(exe_dir))
+    max_size, max_age = parse_size(max_size), parse_age(max_age)
+    now = time.time()
+
+    runs = []
+    total = 0
+    for run_id, paths in find_runs(exe_dir).items():
+        size, mtime = 0, 0.
+        for path in paths:
+            try:
+                path_size, path_mtime = disk_usage(path)
+            except OSError:
+                continue
+            size += path_size
+            mtime = max(mtime, path_mtime)
+        total += size
+        if (run_id not in keep and not is_queued(paths) and
+                not is_active(paths)):
+            runs.append((mtime, run_id, size, paths))
+    runs.sort()
+
+    removed = []
+
+    trash = os.path.join(exe_dir, TRASH_DIR)
+    if os.path.isdir(trash):
+        for name in os.listdir(trash):
+            path = os.path.join(trash, name)
+            try:
+                size, _ = disk_usage(path)
+            except OSError:
+                continue
+            removed.append((run_id_of(name), size, 'trash'))
+            if not dry_run:
+                remove(path)
+
+    for mtime, run_id, size, paths in runs:
+        if max_age is not None and now - mtime > max_age:
+            reason = 'age'
+        elif max_size is not None and total > max_size:
+            reason = 'size'
+        else:
+            continue
+
+        total -= size
+        removed.append((run_id, size, reason))
+        if not dry_run:
+            for path in paths:
+                remove(path)
+
+    return removed
+
+
+class Janitor(threading.Thread):
+    """Collect garbage in an execution directory in the background.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory.
+    **kwds
+        Keyword arguments passed to `collect_garbage`.
+
+    """
+    def __init__(self, exe_dir, **kwds):
+        super(Janitor, self).__init__(name='wmt-janitor')
+        self.daemon = True
+        self._exe_dir = exe_dir
+        self._kwds = kwds
+        self.removed = []
+
+    def run(self):
+        """Collect garbage once."""
+        try:
+            self.removed = collect_garbage(self._exe_dir, **self._kwds)
+        except Exception as error:
+            logger.warning('unable to collect garbage (%s)' % error)
+        for run_id, size, reason in self.removed:
+            logger.info('%s: removed %d bytes (%s)' % (run_id, size, reason))
@@ -0,0 +1,383 @@
+"""A crash-safe journal of status reports for a wmt-exe environment.
+
+Reports are appended to a journal file before they are sent, and a
+background `JournalFlusher` delivers them to the server in order,
+retrying with exponential backoff. Each report carries an idempotency
+key so that the server can discard reports it has already received.
+Delivered keys are appended to a second file, so a journal left behind
+by a crashed job can be replayed later.
+"""
+
+import os
+import glob
+import fcntl
+import json
+import time
+import uuid
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger(__name__)
+"""Logger : Instance of Logging class."""
+
+
+def _append_line(path, line):
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (line + '\n').encode('utf-8'))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_records(path, offset=0):
+    from .reporter import read_new_lines
+
+    lines, offset = read_new_lines(path, offset)
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logger.warning('%s: skipping corrupt journal entry' % path)
+    return records, offset
+
+
+class ReportJournal(object):
+    """Append-only journal of outgoing status reports.
+
+    Parameters
+    ----------
+    path : str
+        Path to the journal file. Delivered keys are kept in a file of
+        the same name with an ``.acked`` extension.
+
+    """
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+        self._acked_path = self._path + '.acked'
+        self._lock = threading.Lock()
+        self._lock_fd = None
+
+    @property
+    def path(self):
+        """Path to the journal file."""
+        return self._path
+
+    def append(self, server, id, status, message):
+        """Add a report to the journal.
+
+        Parameters
+        ----------
+        server : str
+            URL of API server.
+        id : str
+            The unique UUID for the job.
+        status : str
+            Type of report.
+        message : str
+            Message for report.
+
+        Returns
+        -------
+        str
+            The report's idempotency key.
+
+        """
+        key = uuid.uuid4().hex
+        record = dict(key=key, server=server, uuid=id, status=status,
+                      message=message, time=time.time())
+        with self._lock:
+            _append_line(self._path, json.dumps(record))
+        return key
+
+    def acknowledge(self, key):
+        """Record that a report was delivered.
+
+        Parameters
+        ----------
+        key : str
+            The report's idempotency key.
+
+        """
+        with self._lock:
+            _append_line(self._acked_path, key)
+
+    def acknowledged(self):
+        """Get the keys of all delivered reports.
+
+        Returns
+        -------
+        set of str
+            Idempotency keys.
+
+        """
+        try:
+            with open(self._acked_path, 'r') as fp:
+                return set(line.strip() for line in fp)
+        except IOError:
+            return set()
+
+    def read(self, offset=0):
+        """Read reports from the journal.
+
+        Parameters
+        ----------
+        offset : int, optional
+            Byte offset from which to read (default is 0).
+
+        Returns
+        -------
+        tuple of (list, int)
+            The reports and the offset just past the last of them.
+
+        """
+        return _read_records(self._path, offset)
+
+    def lock(self):
+        """Take ownership of the journal.
+
+        Only one process at a time delivers the reports of a journal.
+
+        Returns
+        -------
+        bool
+            True if the lock was acquired, False if another process
+            holds it.
+
+        """
+        if self._lock_fd is None:
+            fd = os.open(self._path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(fd)
+                return False
+            self._lock_fd = fd
+        return True
+
+    def unlock(self):
+        """Release ownership of the journal."""
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def remove(self):
+        """Delete the journal files."""
+        for path in (self._path, self._acked_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def send_report(record, timeout=30.):
+    """Send a journaled report to its server.
+
+    Parameters
+    ----------
+    record : dict
+        The report.
+    timeout : float, optional
+        Seconds to wait for the server (default is 30).
+
+    Returns
+    -------
+    bool
+        True if the server accepted the report, or rejected it for good
+        (a 4xx response other than 408 or 429), in which case sending it
+        again won't help.
+
+    """
+    import requests
+
+    url = os.path.join(record['server'], 'run/update')
+    try:
+        resp = requests.post(url, data={
+            'uuid': record['uuid'],
+            'status': record['status'],
+            'message': record['message'],
+            'idempotency_key': record['key'],
+        }, headers={'Idempotency-Key': record['key']}, timeout=timeout)
+    except requests.RequestException as error:
+        logger.warning('unable to send report (%s)' % error)
+        return False
+
+    if resp.status_code == 200:
+        return True
+    elif 400 <= resp.status_code < 500 and resp.status_code not in (408, 429):
+        logger.warning('dropping report %s for %s (server returned %d)' % (
+            record['key'], record['uuid'], resp.status_code))
+        return True
+    else:
+        return False
+
+
+class JournalFlusher(threading.Thread):
+    """Deliver the reports in a journal in the background.
+
+    Parameters
+    ----------
+    journal : ReportJournal
+        The journal to deliver.
+    send : callable, optional
+        Function that sends a report and returns True on success
+        (default is `send_report`).
+    initial_delay : float, optional
+        Seconds to wait before the first retry (default is 1).
+    max_delay : float, optional
+        Maximum seconds between retries (default is 60).
+
+    """
+    def __init__(self, journal, send=None, initial_delay=1., max_delay=60.):
+        super(JournalFlusher, self).__init__(name='wmt-journal-flusher')
+        self.daemon = True
+        self._journal = journal
+        self._send = send or send_report
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+
+        self._offset = 0
+        self._pending = collections.deque()
+        self._acked = journal.acknowledged()
+
+        # The flusher is idle only if nothing woke it since it last read
+        # the journal and it has read all of it, both checked under
+        # _cond so that a report can't slip in between.
+        self._cond = threading.Condition()
+        self._woken = False
+        self._idle = False
+        self._stop_event = threading.Event()
+
+    @property
+    def journal(self):
+        """The journal being delivered."""
+        return self._journal
+
+    def notify(self):
+        """Tell the flusher there are new reports in the journal."""
+        with self._cond:
+            self._idle = False
+            self._woken = True
+            self._cond.notify_all()
+
+    def _caught_up(self):
+        try:
+            size = os.path.getsize(self._journal.path)
+        except OSError:
+            size = 0
+        return not self._pending and self._offset >= size
+
+    def _send_pending(self):
+        records, self._offset = self._journal.read(self._offset)
+        self._pending.extend(
+            record for record in records if record['key'] not in self._acked)
+
+        while self._pending:
+            record = self._pending[0]
+            if not self._send(record):
+                return False
+            self._journal.acknowledge(record['key'])
+            self._acked.add(record['key'])
+            self._pending.popleft()
+        return True
+
+    def run(self):
+        """Send reports until stopped."""
+        delay = self._initial_delay
+        while not self._stop_event.is_set():
+            with self._cond:
+                self._woken = False
+            if self._send_pending():
+                delay = self._initial_delay
+                with self._cond:
+                    if not self._woken and self._caught_up():
+                        self._idle = True
+                        self._cond.notify_all()
+                        while (not self._woken and
+                               not self._stop_event.is_set()):
+                            self._cond.wait()
+            else:
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self._max_delay)
+
+    def flush(self, timeout=None):
+        """Wait for all reports in the journal to be delivered.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait (default is to wait forever).
+
+        Returns
+        -------
+        bool
+            True if every report was delivered.
+
+        """
+        self.notify()
+        with self._cond:
+            return self._cond.wait_for(lambda: self._idle, timeout)
+
+    def stop(self):
+        """Stop sending reports."""
+        with self._cond:
+            self._stop_event.set()
+            self._cond.notify_all()
+
+    def close(self, timeout=None):
+        """Deliver outstanding reports, then stop.
+
+        The journal is deleted if every report was delivered and left in
+        place for a later replay otherwise.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait for delivery (default is to wait forever).
+
+        Returns
+        -------
+        bool
+            True if every report was delivered.
+
+        """
+        delivered = self.flush(timeout)
+        self.stop()
+        if delivered:
+            self._journal.remove()
+        self._journal.unlock()
+        return delivered
+
+
+def replay_journals(exe_dir, **kwds):
+    """Start delivering journals left behind by earlier jobs.
+
+    Journals that are locked by a running job are skipped.
+
+    Parameters
+    ----------
+    exe_dir : str
+        Execution directory to search for journals.
+    **kwds
+        Keyword arguments passed to `JournalFlusher`.
+
+    Returns
+    -------
+    list of JournalFlusher
+        The started flushers.
+
+    """
+    flushers = []
+    pattern = os.path.join(os.path.expanduser(exe_dir), '*.journal')
+    for path in glob.glob(pattern):
+        journal = ReportJournal(path)
+        if not journal.lock():
+            continue
+        flusher = JournalFlusher(journal, **kwds)
+        flusher.start()
+        flusher.notify()
+        flushers.append(flusher)
+    return flushers
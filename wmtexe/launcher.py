@@ -2,7 +2,151 @@
 
 import os
 import sys
+import logging
 import subprocess
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+SCRIPT_FIELDS = ('slave_command', 'wmt_path', 'activate_script', 'sim_id',
+                 'launch_dir', 'server_url')
+"""tuple of str : Fields that a launch script template may use."""
+
+RUN_SCRIPT_FIELDS = ('output_file', 'script_path', 'sim_id', 'launch_dir')
+"""tuple of str : Fields that a run script template may use."""
+
+
+class TemplateError(ValueError):
+    """Exception raised for an invalid launch script template."""
+    pass
+
+
+class LaunchTemplate(object):
+    """A launch script template, parsed and validated once.
+
+    Templates use `str.format` syntax with named fields only.
+
+    Parameters
+    ----------
+    text : str
+        The template.
+    fields : iterable of str, optional
+        Fields that the template may use (default is `SCRIPT_FIELDS`).
+    required : iterable of str, optional
+        Fields that the template must use (default is
+        ``slave_command``).
+
+    Attributes
+    ----------
+    text : str
+        The template.
+    fields : set of str
+        Fields used by the template.
+
+    """
+    def __init__(self, text, fields=SCRIPT_FIELDS,
+                 required=('slave_command', )):
+        from string import Formatter
+
+        self.text = text
+        self.fields = set()
+        self._parts = []
+        try:
+            for literal, field, spec, conversion in Formatter().parse(text):
+                if field is not None:
+                    if spec or conversion or field not in fields:
+                        raise TemplateError(
+                            '{{{field}}}: unknown template field'.format(
+                                field=field))
+                    self.fields.add(field)
+                self._parts.append((literal, field))
+        except ValueError as error:
+            if isinstance(error, TemplateError):
+                raise
+            raise TemplateError(str(error))
+
+        missing = set(required) - self.fields
+        if missing:
+            raise TemplateError('missing template fields: {fields}'.format(
+                fields=', '.join(sorted(missing))))
+
+    def render(self, **values):
+        """Fill in the template.
+
+        Parameters
+        ----------
+        **values
+            Values of the template fields.
+
+        Returns
+        -------
+        str
+            The filled-in template.
+
+        """
+        return ''.join(literal + (values[field] if field else '')
+                       for literal, field in self._parts)
+
+
+_compiled = {}
+
+
+def compile_template(text, run_script=False):
+    """Get a compiled launch script template, compiling it only once.
+
+    Parameters
+    ----------
+    text : str
+        The template.
+    run_script : bool, optional
+        If True, the template is for a run script.
+
+    Returns
+    -------
+    LaunchTemplate
+        The compiled template.
+
+    """
+    key = (text, run_script)
+    if key not in _compiled:
+        if run_script:
+            _compiled[key] = LaunchTemplate(text, fields=RUN_SCRIPT_FIELDS,
+                                            required=('script_path', ))
+        else:
+            _compiled[key] = LaunchTemplate(text)
+    return _compiled[key]
+
+
+def write_script(path, contents, mode=0o755):
+    """Write a script atomically.
+
+    The script is written to a temporary file in the same directory
+    that is then renamed, so a scheduler never sees a partial script.
+
+    Parameters
+    ----------
+    path : str
+        Path to the script.
+    contents : str
+        The script.
+    mode : int, optional
+        File permissions (default is 0o755).
+
+    """
+    import tempfile
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(contents)
+        os.chmod(tmp, mode)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
 
 
 class Launcher(object):
@@ -18,6 +162,8 @@ class Launcher(object):
         The working directory from which the job is started.
     extra_args : list, optional
         Extra arguments to be passed to the wmt-slave command.
+    template : SiteTemplate, optional
+        Templates for the launch scripts (default is the launcher's own).
 
     Attributes
     ----------
@@ -34,31 +180,58 @@ class Launcher(object):
     _script = "{slave_command}"
 
     def __init__(self, sim_id, server_url=None, launch_dir='~/.wmt',
-                 extra_args=[]):
+                 extra_args=[], template=None):
         self.sim_id = sim_id
         self.server_url = server_url
         self.launch_dir = os.path.expandvars(os.path.expanduser(launch_dir))
         self.script_path = os.path.join(self.launch_dir,
                                         '%s.sh' % self.sim_id)
         self._extra_args = extra_args
+        self._template = template
+        self._written = False
+
+    @property
+    def script_template(self):
+        """The compiled launch script template."""
+        if self._template is not None:
+            return self._template.script
+        return compile_template(self._script)
+
+    def make_launch_dir(self):
+        """Create the launch directory, if it doesn't exist."""
+        try:
+            os.makedirs(self.launch_dir)
+        except OSError:
+            if not os.path.isdir(self.launch_dir):
+                raise
+
+    def write_scripts(self, **kwds):
+        """Write the scripts for the job.
+
+        Parameters
+        ----------
+        **kwds
+            Arbitrary keyword arguments.
+
+        """
+        write_script(self.script_path, self.script(**kwds))
+        self._written = True
 
     def before_launch(self, **kwds):
         """Perform actions before launching job.
 
+        Scripts that were already written, by `write_launch_scripts`
+        for example, aren't written again.
+
         Parameters
         ----------
         **kwds
             Arbitrary keyword arguments.
 
         """
-        try:
-            os.makedirs(self.launch_dir)
-        except OSError:
-            if not os.path.isdir(self.launch_dir):
-                raise
-        with open(self.script_path, 'w') as f:
-            f.write(self.script(**kwds))
-        os.chmod(self.script_path, 0o755)
+        if not self._written:
+            self.make_launch_dir()
+            self.write_scripts(**kwds)
 
     def after_launch(self, **kwds):
         """Perform actions after launching job.
@@ -159,6 +332,43 @@ class Launcher(object):
 
         return ' '.join(command)
 
+    def prepend_path(self):
+        """Places the `bin` directory of executor at the front of the path."""
+        from .env import PathList
+
+        path = PathList(os.environ.get('PATH', ''))
+        path.prepend([os.path.join(sys.prefix, 'bin')])
+        return str(path)
+
+    def activate_script(self):
+        """Write the compiled activation script of the executor.
+
+        The script is shared by all jobs in the launch directory, and
+        is only written again when the configuration or toolchains it
+        was compiled from change.
+
+        Returns
+        -------
+        str
+            Path to the script to source.
+
+        """
+        from .cmd.activate import write_activate_script
+
+        path = os.path.join(self.launch_dir, 'wmt-activate.sh')
+        try:
+            write_activate_script(
+                path, extra_bases=[sys.prefix,
+                                   os.path.join(sys.prefix, 'local')])
+        except Exception as error:
+            logger.warning('unable to compile activation script (%s)',
+                           error)
+            # An out-of-date script is better than none. With neither,
+            # the job runs in the environment it was launched with.
+            if not os.path.isfile(path):
+                return os.devnull
+        return path
+
     def script(self, **kwds):
         """Generate the launch script.
 
@@ -173,7 +383,16 @@ class Launcher(object):
             The launch script to be written to a file.
 
         """
-        return self._script.format(slave_command=self.slave_command(**kwds))
+        template = self.script_template
+        values = dict(slave_command=self.slave_command(**kwds),
+                      sim_id=self.sim_id, launch_dir=self.launch_dir,
+                      server_url=self.server_url or '')
+        if 'wmt_path' in template.fields:
+            values['wmt_path'] = self.prepend_path()
+        if 'activate_script' in template.fields:
+            from pipes import quote
+            values['activate_script'] = quote(self.activate_script())
+        return template.render(**values)
 
 
 class QsubLauncher(Launcher):
@@ -186,6 +405,7 @@ class QsubLauncher(Launcher):
 #PBS -k oe
 
 cd $TMPDIR
+source {activate_script}
 
 {slave_command}
 """.lstrip()
@@ -243,6 +463,7 @@ class SbatchLauncher(Launcher):
 #SBATCH --mem=8000MB
 
 export MPLBACKEND=Agg
+source {activate_script}
 {slave_command}
 """.lstrip()
     _run_script = """
@@ -259,8 +480,15 @@ sbatch --output={output_file} {script_path}
             os.path.join(self.launch_dir,
                          '%s.run.sh' % self.sim_id))
 
-    def before_launch(self, **kwds):
-        """Perform actions before launching job.
+    @property
+    def run_script_template(self):
+        """The compiled run script template."""
+        if self._template is not None and self._template.run_script:
+            return self._template.run_script
+        return compile_template(self._run_script, run_script=True)
+
+    def write_scripts(self, **kwds):
+        """Write the launch and run scripts for the job.
 
         Parameters
         ----------
@@ -268,10 +496,9 @@ sbatch --output={output_file} {script_path}
             Arbitrary keyword arguments.
 
         """
-        Launcher.before_launch(self, **kwds)
-        with open(self.run_script_path, 'w') as f:
-            f.write(self.run_script(**kwds))
-        os.chmod(self.run_script_path, 0o755)
+        write_script(self.script_path, self.script(**kwds))
+        write_script(self.run_script_path, self.run_script(**kwds))
+        self._written = True
 
     def run_script(self, **kwds):
         """Generate the run script that submits job to scheduler.
@@ -290,8 +517,9 @@ sbatch --output={output_file} {script_path}
         output_file = os.path.expanduser(
             os.path.join(self.launch_dir,
                          '%s.out' % self.sim_id))
-        return self._run_script.format(output_file=output_file,
-                                       script_path=self.script_path)
+        return self.run_script_template.render(
+            output_file=output_file, script_path=self.script_path,
+            sim_id=self.sim_id, launch_dir=self.launch_dir)
 
     def launch_command(self, **kwds):
         """The command that runs a job.
@@ -330,28 +558,237 @@ class BashLauncher(Launcher):
 #! /bin/bash
 
 export PATH={wmt_path}
+source {activate_script}
 
 {slave_command}
 """.lstrip()
 
-    def prepend_path(self):
-        """Places the `bin` directory of executor at the front of the path."""
-        return os.pathsep.join([os.path.join(sys.prefix, 'bin'),
-                                os.environ['PATH']])
 
-    def script(self, **kwds):
-        """Generate the launch script.
+_LAUNCHERS = OrderedDict([
+    ('bash', BashLauncher),
+    ('qsub', QsubLauncher),
+    ('sbatch', SbatchLauncher),
+])
+
+
+class SiteTemplate(object):
+    """Compiled templates for a kind of launcher.
+
+    Parameters
+    ----------
+    name : str
+        Name of the template.
+    script : str
+        Launch script template.
+    run_script : str, optional
+        Run script template, used by ``sbatch`` launchers.
+    launcher : str, optional
+        Kind of launcher: ``bash``, ``qsub`` or ``sbatch`` (default is
+        ``bash``).
+
+    Attributes
+    ----------
+    name : str
+        Name of the template.
+    script : LaunchTemplate
+        Compiled launch script template.
+    run_script : LaunchTemplate or None
+        Compiled run script template.
+    launcher_class : type
+        Launcher class that uses the templates.
+
+    """
+    def __init__(self, name, script, run_script=None, launcher='bash'):
+        if launcher not in _LAUNCHERS:
+            raise TemplateError('{name}: unknown launcher {launcher}'.format(
+                name=name, launcher=launcher))
+        try:
+            self.script = compile_template(script)
+            self.run_script = run_script and compile_template(
+                run_script, run_script=True)
+        except TemplateError as error:
+            raise TemplateError('{name}: {error}'.format(name=name,
+                                                          error=error))
+        self.name = name
+        self.launcher_class = _LAUNCHERS[launcher]
+
+    def launcher(self, sim_id, **kwds):
+        """Create a launcher that uses these templates.
 
         Parameters
         ----------
-        *kwds
-            Arbitrary keyword arguments.
+        sim_id : str
+            A unique UUID for the job.
+        **kwds
+            Keyword arguments passed to the launcher.
 
         Returns
         -------
-        str
-            The launch script to be written to a file.
+        Launcher
+            The launcher.
 
         """
-        return self._script.format(wmt_path=self.prepend_path(),
-                                   slave_command=self.slave_command(**kwds))
+        return self.launcher_class(sim_id, template=self, **kwds)
+
+
+class TemplateRegistry(object):
+    """Named launch script templates.
+
+    The registry starts with the templates of the built-in launchers
+    (``bash``, ``qsub`` and ``sbatch``). A site can add its own, for a
+    queue or partition say, in a template directory or in ``wmt.cfg``.
+    """
+    def __init__(self):
+        self._templates = OrderedDict()
+        for name, clazz in _LAUNCHERS.items():
+            self.register(name, clazz._script,
+                          run_script=getattr(clazz, '_run_script', None),
+                          launcher=name)
+
+    def register(self, name, script, run_script=None, launcher='bash'):
+        """Compile, validate and add a template.
+
+        Parameters
+        ----------
+        name : str
+            Name of the template.
+        script : str
+            Launch script template.
+        run_script : str, optional
+            Run script template.
+        launcher : str, optional
+            Kind of launcher (default is ``bash``).
+
+        Returns
+        -------
+        SiteTemplate
+            The compiled template.
+
+        """
+        self._templates[name] = SiteTemplate(name, script,
+                                             run_script=run_script,
+                                             launcher=launcher)
+        return self._templates[name]
+
+    def load_dir(self, path):
+        """Add templates from a directory.
+
+        Each ``<name>.sh`` file is a launch script template. If there is
+        also a ``<name>.run.sh`` file, it is the run script of an
+        ``sbatch`` launcher.
+
+        Parameters
+        ----------
+        path : str
+            Template directory.
+
+        """
+        def read(fname):
+            with open(os.path.join(path, fname), 'r') as fp:
+                return fp.read()
+
+        fnames = set(os.listdir(path))
+        for fname in sorted(fnames):
+            if fname.endswith('.sh') and not fname.endswith('.run.sh'):
+                name = fname[:-len('.sh')]
+                run_fname = name + '.run.sh'
+                if run_fname in fnames:
+                    self.register(name, read(fname),
+                                  run_script=read(run_fname),
+                                  launcher='sbatch')
+                else:
+                    self.register(name, read(fname))
+
+    def load_config(self, config):
+        """Add templates from a site configuration.
+
+        Templates are read from the directory given by the
+        ``template_dir`` option of the ``launcher`` section, and then
+        from ``template:<name>`` sections, which have the options
+        ``launcher``, ``script`` (or ``script_file``) and
+        ``run_script`` (or ``run_script_file``). These sections are read
+        without interpolation, so a ``%`` in a script is taken as is.
+        Lines that start with ``#`` are comments in a configuration
+        file, so templates with scheduler directives belong in a file.
+
+        Parameters
+        ----------
+        config : SiteConfiguration
+            Site configuration.
+
+        """
+        template_dir = config.get('launcher', 'template_dir')
+        if template_dir:
+            self.load_dir(os.path.expandvars(
+                os.path.expanduser(template_dir)))
+
+        for section in config.sections():
+            if not section.startswith('template:'):
+                continue
+            opts = dict(config.section(section, raw=True))
+            for key in ('script', 'run_script'):
+                if key + '_file' in opts:
+                    with open(os.path.expanduser(opts[key + '_file']),
+                              'r') as fp:
+                        opts[key] = fp.read()
+            if 'script' not in opts:
+                raise TemplateError('{section}: no script'.format(
+                    section=section))
+            self.register(section[len('template:'):], opts['script'],
+                          run_script=opts.get('run_script'),
+                          launcher=opts.get('launcher', 'bash'))
+
+    @classmethod
+    def from_config(clazz, config):
+        """Create a registry with the templates of a site.
+
+        Parameters
+        ----------
+        config : SiteConfiguration
+            Site configuration.
+
+        Returns
+        -------
+        TemplateRegistry
+            The registry.
+
+        """
+        registry = clazz()
+        registry.load_config(config)
+        return registry
+
+    def names(self):
+        """Names of the templates."""
+        return list(self._templates.keys())
+
+    def __getitem__(self, name):
+        return self._templates[name]
+
+    def __contains__(self, name):
+        return name in self._templates
+
+
+def write_launch_scripts(sim_ids, template, **kwds):
+    """Write the launch scripts for many jobs at once.
+
+    Parameters
+    ----------
+    sim_ids : iterable of str
+        UUIDs of the jobs.
+    template : SiteTemplate
+        Templates to use.
+    **kwds
+        Keyword arguments passed to each launcher.
+
+    Returns
+    -------
+    list of Launcher
+        Launchers for the jobs, whose scripts have been written.
+
+    """
+    launchers = [template.launcher(sim_id, **kwds) for sim_id in sim_ids]
+    if launchers:
+        launchers[0].make_launch_dir()
+    for launcher in launchers:
+        launcher.write_scripts()
+    return launchers
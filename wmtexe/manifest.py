@@ -0,0 +1,148 @@
+"""Manifests of the files in a simulation directory."""
+
+import os
+import json
+import hashlib
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Compute the SHA-256 hash of a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    chunk_size : int, optional
+        Bytes to read at a time (default is 1 MiB).
+
+    Returns
+    -------
+    str
+        The hash as a hex string.
+
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def build_manifest(root):
+    """Build a manifest of the files under a directory.
+
+    Parameters
+    ----------
+    root : str
+        Path to a directory.
+
+    Returns
+    -------
+    dict
+        Size, modification time and SHA-256 hash of each file, keyed by
+        path relative to *root*.
+
+    """
+    manifest = {}
+    for dirpath, dirs, files in os.walk(root):
+        for fname in files:
+            path = os.path.join(dirpath, fname)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            manifest[os.path.relpath(path, root)] = dict(
+                size=stat.st_size, mtime=stat.st_mtime,
+                sha256=file_sha256(path))
+    return manifest
+
+
+def write_manifest(path, manifest):
+    """Write a manifest to a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the manifest file.
+    manifest : dict
+        The manifest.
+
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def load_manifest(path):
+    """Read a manifest from a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the manifest file.
+
+    Returns
+    -------
+    dict
+        The manifest, or an empty dict if the file doesn't exist.
+
+    """
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except IOError:
+        return {}
+
+
+def is_unchanged(root, name, entry):
+    """Check whether a file still matches its manifest entry.
+
+    Files are compared by size and modification time, which extraction
+    sets from the tarball, so unchanged inputs need not be hashed again.
+
+    Parameters
+    ----------
+    root : str
+        Directory the manifest is relative to.
+    name : str
+        Path of the file relative to *root*.
+    entry : dict
+        The file's manifest entry.
+
+    Returns
+    -------
+    bool
+        True if the file has not changed.
+
+    """
+    try:
+        stat = os.stat(os.path.join(root, name))
+    except OSError:
+        return False
+    return stat.st_size == entry['size'] and stat.st_mtime == entry['mtime']
+
+
+def diff_manifest(root, manifest):
+    """Compare a directory with a manifest of its earlier contents.
+
+    Parameters
+    ----------
+    root : str
+        Path to a directory.
+    manifest : dict
+        Manifest of *root* at an earlier time.
+
+    Returns
+    -------
+    tuple of (dict, list)
+        Entries for files that are unchanged, and names of files that
+        have been removed.
+
+    """
+    unchanged, removed = {}, []
+    for name, entry in manifest.items():
+        if not os.path.exists(os.path.join(root, name)):
+            removed.append(name)
+        elif is_unchanged(root, name, entry):
+            unchanged[name] = entry
+    return unchanged, sorted(removed)
@@ -0,0 +1,312 @@
+"""Check that a host can run WMT simulations before a job starts.
+
+`preflight` checks the executables and directories named in the site
+configuration and imports the framework, and any modules the site lists,
+in a fresh interpreter. A site can also have every CSDMS component
+imported; a component that fails to import is logged as a warning
+rather than failing jobs that may never use it. The result is cached in the execution directory,
+keyed on the host, the configuration, the environment and the state of
+the Python path, so the checks run only once per version of a host's
+setup. Only passing results are cached: a host that failed is checked
+again by the next job, which picks up any repair. A job on a broken host
+fails before anything is downloaded.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import logging
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+"""Logger : Instance of Logging class."""
+
+
+PREFLIGHT_DIR = '.preflight'
+"""str : Name of the preflight cache within an execution directory."""
+
+REQUIRED_MODULES = ['cmt.component.model', 'cmt.framework.services']
+"""list of str : Modules that every simulation imports."""
+
+_ENV_VARS = ('PATH', 'PYTHONPATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH',
+             'SIDL_DLL_PATH')
+
+_IMPORT_CHECK = """
+import sys, json, importlib
+failed = {}
+names = sys.argv[2:]
+components = []
+if sys.argv[1] == 'components':
+    try:
+        from cmt.components import __all__ as components
+    except ImportError:
+        pass
+    except Exception as error:
+        failed['cmt.components'] = '%s: %s' % (type(error).__name__, error)
+for name in names + ['cmt.components.' + name for name in components]:
+    try:
+        importlib.import_module(name)
+    except Exception as error:
+        failed[name] = '%s: %s' % (type(error).__name__, error)
+print(json.dumps(failed))
+"""
+
+
+class PreflightError(Exception):
+    """Exception raised when a host fails its preflight checks.
+
+    Parameters
+    ----------
+    problems : list of str
+        Descriptions of the failed checks.
+
+    """
+    def __init__(self, problems):
+        self.problems = list(problems)
+
+    def __str__(self):
+        return 'preflight checks failed:\n' + '\n'.join(
+            '  ' + problem for problem in self.problems)
+
+
+def _path_stamps(paths):
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append((path, os.stat(path).st_mtime))
+        except OSError:
+            stamps.append((path, None))
+    return stamps
+
+
+def preflight_key(config, env=None, modules=None):
+    """Get the key under which a preflight result is cached.
+
+    Parameters
+    ----------
+    config : SiteConfiguration
+        Site configuration.
+    env : dict, optional
+        Environment of the simulation (default is `os.environ`).
+    modules : list of str, optional
+        Additional modules to import.
+
+    Returns
+    -------
+    str
+        The cache key.
+
+    """
+    env = os.environ if env is None else env
+    key = dict(
+        host=socket.gethostname(),
+        python=sys.executable,
+        config=str(config),
+        env=[(name, env.get(name, '')) for name in _ENV_VARS],
+        modules=sorted(modules or []),
+        path=_path_stamps(sys.path),
+    )
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode(
+        'utf-8')).hexdigest()
+
+
+def check_executables(config):
+    """Check that the programs in the site configuration can be run.
+
+    Parameters
+    ----------
+    config : SiteConfiguration
+        Site configuration.
+
+    Returns
+    -------
+    list of str
+        Problems found.
+
+    """
+    from distutils.spawn import find_executable
+
+    problems = []
+    for option in ('curl', 'bash', 'tail'):
+        prog = config.get('paths', option)
+        if not (os.access(prog, os.X_OK) or find_executable(prog)):
+            problems.append('{option}: {prog} is not executable'.format(
+                option=option, prog=prog))
+    return problems
+
+
+def check_dirs(exec_dir, scratch_dir=None):
+    """Check that the execution and scratch directories are writable.
+
+    Parameters
+    ----------
+    exec_dir : str
+        Execution directory.
+    scratch_dir : str, optional
+        Scratch directory.
+
+    Returns
+    -------
+    list of str
+        Problems found.
+
+    """
+    problems = []
+    try:
+        if not os.path.isdir(exec_dir):
+            os.makedirs(exec_dir)
+    except OSError as error:
+        problems.append('exec_dir: {error}'.format(error=error))
+    else:
+        if not os.access(exec_dir, os.W_OK | os.X_OK):
+            problems.append('exec_dir: {dir} is not writable'.format(
+                dir=exec_dir))
+
+    if scratch_dir and not os.access(os.path.expandvars(scratch_dir),
+                                     os.W_OK | os.X_OK):
+        problems.append('scratch_dir: {dir} is not writable'.format(
+            dir=scratch_dir))
+
+    return problems
+
+
+def check_imports(modules=None, env=None, timeout=300., components=False):
+    """Import the framework in a new interpreter.
+
+    Parameters
+    ----------
+    modules : list of str, optional
+        Additional modules to import.
+    env : dict, optional
+        Environment of the simulation.
+    timeout : float, optional
+        Seconds to wait for the imports (default is 300).
+    components : bool, optional
+        Also import every CSDMS component. Components that fail to
+        import are logged as warnings, not returned as problems
+        (default is False).
+
+    Returns
+    -------
+    list of str
+        Problems found.
+
+    """
+    names = REQUIRED_MODULES + list(modules or [])
+    proc = subprocess.Popen([sys.executable, '-c', _IMPORT_CHECK,
+                             'components' if components else 'none'] + names,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env, universal_newlines=True)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return ['imports did not finish within {timeout} s'.format(
+            timeout=timeout)]
+
+    try:
+        failed = json.loads(stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return ['import check exited with status {code}: {err}'.format(
+            code=proc.returncode, err=stderr.strip()[-500:])]
+
+    problems = []
+    for name, error in sorted(failed.items()):
+        problem = '{name}: {error}'.format(name=name, error=error)
+        if name in names:
+            problems.append(problem)
+        else:
+            logger.warning('preflight: {problem}'.format(problem=problem))
+    return problems
+
+
+def _load_result(path):
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def _save_result(path, result):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    with open(tmp, 'w') as fp:
+        json.dump(result, fp, indent=2, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def _discard_result(path):
+    try:
+        os.remove(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
+
+
+def preflight(config, exec_dir, env=None, scratch_dir=None, force=False):
+    """Check that a host can run simulations, using a cached result.
+
+    A result is cached only if every check passed.
+
+    Parameters
+    ----------
+    config : SiteConfiguration
+        Site configuration.
+    exec_dir : str
+        Execution directory, which also holds the cached results.
+    env : dict, optional
+        Environment of the simulation (default is `os.environ`).
+    scratch_dir : str, optional
+        Scratch directory.
+    force : bool, optional
+        Run the checks even if there is a cached result.
+
+    Returns
+    -------
+    dict
+        The result of the checks.
+
+    Raises
+    ------
+    PreflightError
+        If any of the checks failed.
+
+    """
+    modules = config.get('preflight', 'modules').split()
+    components = config.getboolean('preflight', 'components')
+    max_age = float(config.get('preflight', 'max_age'))
+    key = preflight_key(config, env=env, modules=modules)
+    path = os.path.join(exec_dir, PREFLIGHT_DIR, key + '.json')
+
+    result = None if force else _load_result(path)
+    if (result is not None and not result['problems'] and
+            time.time() - result['time'] < max_age):
+        logger.debug('using preflight result {path}'.format(path=path))
+    else:
+        start = time.time()
+        problems = (check_dirs(exec_dir, scratch_dir=scratch_dir) +
+                    check_executables(config) +
+                    check_imports(modules, env=env,
+                                  components=components))
+        result = dict(time=time.time(), host=socket.gethostname(),
+                      problems=problems, elapsed=time.time() - start)
+        try:
+            if problems:
+                _discard_result(path)
+            else:
+                _save_result(path, result)
+        except OSError as error:
+            logger.warning('unable to cache preflight result: {error}'.format(
+                error=error))
+
+    if result['problems']:
+        raise PreflightError(result['problems'])
+
+    return result
@@ -2,18 +2,25 @@
 
 import os
 import sys
+import json
 import threading
+import collections
 import time
 import logging
 import subprocess
 
-import yaml
 import requests
 
+from .watch import watch_files
+from . import yamlio
+
 
 logger = logging.getLogger(__name__)
 """Logger : Instance of Logging class."""
 
+JOURNALED = object()
+"""object : What `WmtTaskReporter.report` returns for a journaled report."""
+
 
 class TaskCompleted(Exception):
     """Exception thrown when a wmt-exe task completes."""
@@ -75,13 +82,31 @@ class open_reporter(object):
         URL of API server.
     fname : str
         Name of status file.
+    engine : IoEngine, optional
+        If given, report from a task on this engine rather than from a
+        thread of our own.
+    flusher : JournalFlusher, optional
+        If given, journal reports through this flusher.
+    **kwds
+        Keyword arguments passed to `Reporter`.
 
     """
-    def __init__(self, id, server, fname):
+    def __init__(self, id, server, fname, engine=None, flusher=None,
+                 **kwds):
         self._args = (id, server, fname)
+        self._engine = engine
+        self._flusher = flusher
+        self._kwds = kwds
 
     def __enter__(self):
-        self._reporter = Reporter(*self._args)
+        if self._engine is not None:
+            from .engine import AsyncReporter
+            self._reporter = AsyncReporter(*self._args, engine=self._engine,
+                                           flusher=self._flusher,
+                                           **self._kwds)
+        else:
+            self._reporter = Reporter(*self._args, flusher=self._flusher,
+                                      **self._kwds)
         self._reporter.start()
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
@@ -89,8 +114,11 @@ class open_reporter(object):
         self._reporter.join()
 
         if exc_type is not None:
-            reporter = TaskStatus(*self._args)
-            reporter.report('error', reporter.status_with_line_nos(n=40))
+            reporter = TaskStatus(*self._args, flusher=self._flusher)
+            try:
+                reporter.report('error', reporter.status_with_line_nos(n=40))
+            except Exception as error:
+                logger.warning('unable to report error (%s)' % error)
 
 
 def add_line_numbers(lines, start=0, fn=None):
@@ -169,7 +197,8 @@ def tail(fname, n=10, with_tail='tail'):
     fname = os.path.abspath(fname)
     try:
         lines = subprocess.check_output(
-            [with_tail, '-n{n}'.format(n=n), fname])
+            [with_tail, '-n{n}'.format(n=n), fname],
+            universal_newlines=True)
     except subprocess.CalledProcessError:
         raise RuntimeError('Unable to get status. Please try again.')
     except Exception:
@@ -178,6 +207,39 @@ def tail(fname, n=10, with_tail='tail'):
         return lines.strip()
 
 
+def read_new_lines(fname, offset=0):
+    """Read the complete lines appended to a file since an offset.
+
+    A trailing partial line is left for the next read.
+
+    Parameters
+    ----------
+    fname : str
+        File name.
+    offset : int, optional
+        Byte offset from which to read (default is 0).
+
+    Returns
+    -------
+    tuple of (list, int)
+        The new lines and the byte offset just past the last of them.
+
+    """
+    try:
+        with open(fname, 'rb') as fp:
+            fp.seek(offset)
+            data = fp.read()
+    except IOError:
+        return [], offset
+
+    end = data.rfind(b'\n')
+    if end < 0:
+        return [], offset
+
+    lines = data[:end].decode('utf-8', 'replace').split('\n')
+    return lines, offset + end + 1
+
+
 def tail_with_line_numbers(fname, n=10, with_tail='tail', with_wc='wc'):
     """Get the last lines in a file, with line numbers.
 
@@ -221,18 +283,40 @@ class Reporter(threading.Thread):
         URL of API server.
     filename : str
         Name of status file.
+    mode : {'full', 'delta'}, optional
+        Reporting mode (default is 'full').
+    debounce : float, optional
+        Seconds to wait after a change before reporting, so that bursts
+        of output are sent together (default is 0.5).
+    min_interval : float, optional
+        Minimum number of seconds between reports, however often the
+        status changes (default is 2).
+    max_interval : float, optional
+        Maximum number of seconds between reports when nothing has
+        changed (default is 30).
+    flusher : JournalFlusher, optional
+        If given, journal reports through this flusher.
     **kwds
         Arbitrary keyowrd arguments.
 
     """
-    def __init__(self, id, server, filename, **kwds):
+    def __init__(self, id, server, filename, mode='full', debounce=.5,
+                 min_interval=2., max_interval=30., flusher=None, **kwds):
         super(Reporter, self).__init__(**kwds)
-        self._stop = threading.Event()
+        self._stop_event = threading.Event()
         self._args = (id, server, filename)
+        self._flusher = flusher
+        self._mode = mode
+        self._debounce = debounce
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._watcher = None
 
     def stop(self):
         """Stop reporting on a task."""
-        self._stop.set()
+        self._stop_event.set()
+        if self._watcher is not None:
+            self._watcher.interrupt()
 
     def stopped(self):
         """Check whether reporting has stopped.
@@ -243,32 +327,62 @@ class Reporter(threading.Thread):
             True if reporting has stopped.
 
         """
-        return self._stop.is_set()
+        return self._stop_event.is_set()
 
     def run(self):
-        """Start reporting on a task."""
-        import time
+        """Start reporting on a task.
 
-        reporter = TaskStatus(*self._args)
-        while 1:
-            try:
-                status = reporter.get_status()
-            except TaskCompleted:
-                break
-            except Exception as error:
-                import traceback
-                reporter.report(
-                    'running',
-                    '(2) Error getting status ({err})\n{tb}'.format(
-                        err=error, tb=traceback.format_exc()))
-            else:
-                reporter.report('running', '{message}'.format(message=status))
-            time.sleep(2)
-
-            if self.stopped():
-                break
-
-        reporter.report('success', 'completed')
+        A report is sent when the status or progress file changes, but
+        no sooner than *min_interval* seconds after the previous one, or
+        after *max_interval* seconds without a change.
+        """
+        reporter = TaskStatus(*self._args, mode=self._mode,
+                              flusher=self._flusher)
+        self._watcher = watch_files([reporter.status_file,
+                                     reporter.progress_file])
+        try:
+            while 1:
+                last_report = time.time()
+                try:
+                    status = reporter.get_status()
+                except TaskCompleted:
+                    break
+                except Exception as error:
+                    import traceback
+                    self._report(
+                        reporter, 'running',
+                        '(2) Error getting status ({err})\n{tb}'.format(
+                            err=error, tb=traceback.format_exc()))
+                else:
+                    resp = self._report(reporter, 'running',
+                                        '{message}'.format(message=status))
+                    if is_delivered(resp):
+                        reporter.acknowledge()
+
+                # stop() interrupts the watcher only once it exists, so
+                # check for a stop that came before it was created.
+                if self.stopped():
+                    break
+                if self._watcher.wait(timeout=self._max_interval):
+                    self._stop_event.wait(max(
+                        self._debounce,
+                        last_report + self._min_interval - time.time()))
+                    self._watcher.wait(timeout=0)
+
+                if self.stopped():
+                    break
+        finally:
+            self._watcher.close()
+
+        self._report(reporter, 'success', 'completed')
+
+    def _report(self, reporter, status, message):
+        try:
+            return reporter.report(status, message)
+        except Exception as error:
+            logger.warning('{id}: unable to report status ({err})'.format(
+                id=reporter.id, err=error))
+            return None
 
 
 class WmtTaskReporter(object):
@@ -282,11 +396,22 @@ class WmtTaskReporter(object):
         URL of API server.
     exe_dir : str, optional
         Run directory (default is '~/.wmt').
+    engine : IoEngine, optional
+        If given, send reports through this engine.
+    journal : bool, optional
+        If True, write reports to a journal under *exe_dir* and deliver
+        them in the background, so that reporting never blocks and
+        reports survive an unreachable server (default is False).
+    flusher : JournalFlusher, optional
+        Journal reports through the journal of another reporter of the
+        same task, which keeps ownership of it.
 
     """
-    def __init__(self, id, server, exe_dir='~/.wmt'):
+    def __init__(self, id, server, exe_dir='~/.wmt', engine=None,
+                 journal=False, flusher=None):
         self._id = id
         self._server = server
+        self._engine = engine
         self._curl = os.environ.get('CURL', 'curl')
         self._exe_dir = os.path.expandvars(os.path.expanduser(exe_dir))
         try:
@@ -298,6 +423,28 @@ class WmtTaskReporter(object):
         logging.basicConfig(filename=log_file, filemode='w',
                             level=logging.DEBUG)
 
+        self._flusher = flusher
+        self._journal = None if flusher is None else flusher.journal
+        if journal and flusher is None:
+            from .journal import ReportJournal, JournalFlusher
+
+            self._journal = ReportJournal(
+                os.path.join(self._exe_dir, '%s.journal' % self.id))
+            if not self._journal.lock():
+                # Someone else is delivering this id's old journal, so
+                # start a new one rather than send its reports twice.
+                import uuid
+                self._journal = ReportJournal(os.path.join(
+                    self._exe_dir, '%s.%s.journal' % (self.id,
+                                                      uuid.uuid4().hex)))
+                if not self._journal.lock():
+                    logger.warning('unable to lock a journal for %s, '
+                                   'reports will not be journaled' % self.id)
+                    self._journal = None
+            if self._journal is not None:
+                self._flusher = JournalFlusher(self._journal)
+                self._flusher.start()
+
     @property
     def id(self):
         """Get id of task.
@@ -310,6 +457,18 @@ class WmtTaskReporter(object):
         """
         return self._id
 
+    @property
+    def flusher(self):
+        """Get the flusher that delivers journaled reports.
+
+        Returns
+        -------
+        JournalFlusher or None
+            The flusher, or None if reports aren't journaled.
+
+        """
+        return self._flusher
+
     @property
     def server(self):
         """Get server URL.
@@ -367,11 +526,21 @@ class WmtTaskReporter(object):
         Returns
         -------
         Reponse
-            Response from server.
+            Response from server, or `JOURNALED` if the report was
+            journaled.
 
         """
         import requests
 
+        if self._flusher is not None:
+            logger.info('%s: %s' % (status, message))
+            self._journal.append(self.server, self.id, status, message)
+            self._flusher.notify()
+            return JOURNALED
+
+        if self._engine is not None:
+            return self._engine.report(self.server, self.id, status, message)
+
         logger.info('%s: %s' % (status, message))
 
         url = os.path.join(self.server, 'run/update')
@@ -383,6 +552,25 @@ class WmtTaskReporter(object):
 
         return resp
 
+    def flush_reports(self, timeout=None):
+        """Wait for journaled reports to be delivered and stop the flusher.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait (default is to wait forever).
+
+        Returns
+        -------
+        bool
+            True if every report was delivered. Undelivered reports stay
+            in the journal to be replayed later.
+
+        """
+        if self._flusher is None:
+            return True
+        return self._flusher.close(timeout)
+
     def report_with_curl(self, status, message):
         """Report task status using `curl`.
 
@@ -410,6 +598,26 @@ class WmtTaskReporter(object):
         return subprocess.check_output(cmd)
 
 
+def is_delivered(resp):
+    """Check whether the server accepted a report.
+
+    A journaled report counts as delivered, since the journal sends it
+    until the server takes it.
+
+    Parameters
+    ----------
+    resp : Response
+        Response from server, or `JOURNALED`.
+
+    Returns
+    -------
+    bool
+        True if the report was received.
+
+    """
+    return resp is JOURNALED or getattr(resp, 'status_code', None) == 200
+
+
 from datetime import datetime
 
 
@@ -430,8 +638,8 @@ def load_status_from_lines(lines):
     status = {}
     for line in lines[::-1]:
         try:
-            status = yaml.load(line)
-        except yaml.YAMLError:
+            status = yamlio.load(line)
+        except yamlio.YAMLError:
             pass
         else:
             if isinstance(status, dict):
@@ -443,9 +651,70 @@ def load_status_from_lines(lines):
         return status
 
 
+def write_wmt_status(fname, **status):
+    """Append a progress record to a WMT status file.
+
+    Each record is a single line of JSON written with one ``write`` to
+    a file opened for appending, so a reader never sees a partial
+    record.
+
+    Parameters
+    ----------
+    fname : str
+        WMT status file.
+    **status
+        Progress fields (for example, ``time``, ``end_time``, ``units``).
+
+    """
+    record = (json.dumps(status, separators=(',', ':')) + '\n').encode('utf-8')
+
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
+
+
+def read_last_lines(fname, n=2, chunk_size=1024):
+    """Read the last lines of a file without reading the whole file.
+
+    Parameters
+    ----------
+    fname : str
+        File name.
+    n : int, optional
+        Number of lines to read (default is 2).
+    chunk_size : int, optional
+        Number of bytes to read from the end of the file at a time
+        (default is 1024).
+
+    Returns
+    -------
+    list of str
+        The last non-empty lines of the file.
+
+    """
+    with open(fname, 'rb') as fp:
+        size = os.fstat(fp.fileno()).st_size
+        start = size
+        data = b''
+        while start > 0 and data.count(b'\n') <= n:
+            start = max(start - chunk_size, 0)
+            fp.seek(start)
+            data = fp.read(size - start)
+
+    lines = [line for line in data.decode('utf-8', 'replace').splitlines()
+             if line.strip()]
+    return lines[-n:]
+
+
 def read_wmt_status(fname):
     """Read the WMT status from a file.
 
+    The last record of the file is read as JSON, as written by
+    `write_wmt_status`. If it isn't JSON, the last lines are parsed as
+    YAML documents, as written by older components.
+
     Parameters
     ----------
     fname : str
@@ -457,16 +726,21 @@ def read_wmt_status(fname):
         The task status, or an empty dict on error.
 
     """
-    status = {}
-
     try:
-        status_lines = tail(fname, n=2).split(os.linesep)
-    except RuntimeError:
-        status = {}
-    else:
-        status = load_status_from_lines(status_lines)
+        status_lines = read_last_lines(fname, n=2)
+    except OSError:
+        return {}
+
+    if status_lines and status_lines[-1].startswith('{'):
+        try:
+            status = json.loads(status_lines[-1])
+        except ValueError:
+            pass
+        else:
+            if isinstance(status, dict):
+                return status
 
-    return status
+    return load_status_from_lines(status_lines)
 
 
 class TaskStatus(WmtTaskReporter):
@@ -484,10 +758,23 @@ class TaskStatus(WmtTaskReporter):
         Process id (default is None).
     prefix : str, optional
         Path to base directory (default is current directory).
+    mode : {'full', 'delta'}, optional
+        Send the last lines of stdout with every update ('full') or only
+        the lines that are new since the last acknowledged update
+        ('delta'). The default is 'full'.
+    snapshot_every : int, optional
+        In delta mode, send a full snapshot after this many acknowledged
+        updates so that clients can resync (default is 30).
+    flusher : JournalFlusher, optional
+        Journal reports through this flusher rather than posting them.
 
     """
-    def __init__(self, id, server, filename, pid=None, prefix='.'):
-        super(TaskStatus, self).__init__(id, server)
+    def __init__(self, id, server, filename, pid=None, prefix='.',
+                 mode='full', snapshot_every=30, flusher=None):
+        super(TaskStatus, self).__init__(id, server, flusher=flusher)
+
+        if mode not in ('full', 'delta'):
+            raise ValueError('{mode}: unknown report mode'.format(mode=mode))
 
         self._status_file = filename
         self._prefix = os.path.abspath(prefix)
@@ -495,6 +782,12 @@ class TaskStatus(WmtTaskReporter):
         self._pid = pid
         self._start_time = datetime.now()
 
+        self._mode = mode
+        self._snapshot_every = max(snapshot_every, 1)
+        self._acked = dict(seq=0, offset=0, progress={},
+                           recent=collections.deque(), n_updates=0)
+        self._pending = None
+
     @property
     def status_file(self):
         """Get the status file.
@@ -507,6 +800,18 @@ class TaskStatus(WmtTaskReporter):
         """
         return self._status_file
 
+    @property
+    def progress_file(self):
+        """Get the progress file.
+
+        Returns
+        -------
+        str
+            Path to the file of progress records.
+
+        """
+        return os.path.join(self._prefix, '_time.txt')
+
     @property
     def elapsed(self):
         """Get the elapsed time in the simulation.
@@ -549,7 +854,7 @@ class TaskStatus(WmtTaskReporter):
         Returns
         -------
         str
-            The status as a YAML stream.
+            The status as a YAML stream, in flow style.
 
         """
         lines = tail_with_line_numbers(self.status_file, n=n)
@@ -563,23 +868,93 @@ class TaskStatus(WmtTaskReporter):
 
         status = dict(stdout=os.linesep.join(lines),
                       time_elapsed=self.elapsed)
-        status.update(read_wmt_status(os.path.join(self._prefix, '_time.txt')))
+        status.update(read_wmt_status(self.progress_file))
 
-        return yaml.dump(status)
+        return yamlio.dump_status(status)
         # return os.linesep.join(lines)
 
+    def status_delta(self, n=10, max_lines=500):
+        """Get the status changes since the last acknowledged update.
+
+        Every *snapshot_every* acknowledged updates (and for the first
+        update), a snapshot of the last *n* lines of stdout and all of
+        the progress fields is sent instead. The ``seq`` field is the
+        line number of the first line in ``stdout``.
+
+        Parameters
+        ----------
+        n : int, optional
+            Number of lines to include in a snapshot (default is 10).
+        max_lines : int, optional
+            Maximum number of new lines to include in a delta (default
+            is 500).
+
+        Returns
+        -------
+        str
+            The status as a YAML stream, in flow style.
+
+        """
+        acked = self._acked
+        try:
+            truncated = os.path.getsize(self.status_file) < acked['offset']
+        except OSError:
+            truncated = False
+        if truncated:
+            acked = dict(acked, seq=0, offset=0, recent=collections.deque(),
+                         n_updates=0)
+
+        lines, offset = read_new_lines(self.status_file, acked['offset'])
+        seq = acked['seq'] + len(lines)
+
+        recent = collections.deque(acked['recent'], maxlen=n)
+        recent.extend(lines)
+
+        progress = read_wmt_status(self.progress_file)
+
+        if acked['n_updates'] % self._snapshot_every == 0:
+            status = dict(type='snapshot', seq=seq - len(recent),
+                          stdout=os.linesep.join(recent))
+            status.update(progress)
+        else:
+            lines = lines[-max_lines:]
+            status = dict(type='delta', seq=seq - len(lines),
+                          stdout=os.linesep.join(lines))
+            for key, value in progress.items():
+                if acked['progress'].get(key) != value:
+                    status[key] = value
+        status['time_elapsed'] = self.elapsed
+
+        self._pending = dict(seq=seq, offset=offset, progress=progress,
+                             recent=recent,
+                             n_updates=acked['n_updates'] + 1)
+
+        return yamlio.dump_status(status)
+
+    def acknowledge(self):
+        """Mark the most recent status update as received by the server.
+
+        Until an update is acknowledged, the next delta will resend its
+        lines.
+        """
+        if self._pending is not None:
+            self._acked, self._pending = self._pending, None
+
     def get_status(self):
         """Get task status.
 
         Returns
         -------
         str
-            The status as a YAML stream.
+            The status as a YAML stream, in flow style.
 
         """
         # if not self.running():
         #     raise TaskCompleted()
-        return self.status_with_line_nos()
+        if self._mode == 'delta':
+            return self.status_delta()
+        else:
+            return self.status_with_line_nos()
 
     def report_status(self):
         """Report task status at regular intervals until task completes.
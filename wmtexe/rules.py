@@ -0,0 +1,188 @@
+"""Rules that select which simulation output files are kept."""
+
+import os
+from fnmatch import fnmatch
+
+
+OUTPUT_RULES_FILE = 'output.cfg'
+"""str : Name of the file of output rules in a staged simulation."""
+
+
+def _split_patterns(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split()
+    return [pattern.strip() for pattern in value if pattern.strip()]
+
+
+def match_path(pattern, name):
+    """Check whether a relative path matches a glob pattern.
+
+    A pattern without a slash is matched against every component of
+    the path, so ``*.err`` matches ``a/_b.err`` and ``scratch`` matches
+    everything under a ``scratch`` directory. A pattern with a slash is
+    matched against the path and each of its parent directories.
+
+    Parameters
+    ----------
+    pattern : str
+        Glob pattern.
+    name : str
+        Path relative to the simulation directory.
+
+    Returns
+    -------
+    bool
+        True if the path matches.
+
+    """
+    parts = name.replace(os.sep, '/').split('/')
+    pattern = pattern.rstrip('/')
+    if '/' in pattern:
+        return any(fnmatch('/'.join(parts[:n]), pattern.lstrip('/'))
+                   for n in range(1, len(parts) + 1))
+    else:
+        return any(fnmatch(part, pattern) for part in parts)
+
+
+class OutputRules(object):
+    """Include and exclude rules for simulation output.
+
+    A file is kept if it matches an include pattern (or there are no
+    include patterns) and matches no exclude pattern.
+
+    Parameters
+    ----------
+    include : str or list of str, optional
+        Glob patterns of files to keep.
+    exclude : str or list of str, optional
+        Glob patterns of files to leave out.
+
+    """
+    def __init__(self, include=None, exclude=None):
+        self._include = _split_patterns(include)
+        self._exclude = _split_patterns(exclude)
+
+    @property
+    def include(self):
+        """Patterns of files to keep."""
+        return list(self._include)
+
+    @property
+    def exclude(self):
+        """Patterns of files to leave out."""
+        return list(self._exclude)
+
+    def is_excluded(self, name):
+        """Check whether a path matches an exclude pattern.
+
+        Parameters
+        ----------
+        name : str
+            Path relative to the simulation directory.
+
+        Returns
+        -------
+        bool
+            True if the path is excluded.
+
+        """
+        return any(match_path(pattern, name) for pattern in self._exclude)
+
+    def matches(self, name):
+        """Check whether a file should be kept.
+
+        Parameters
+        ----------
+        name : str
+            Path relative to the simulation directory.
+
+        Returns
+        -------
+        bool
+            True if the file is kept.
+
+        """
+        if self.is_excluded(name):
+            return False
+        if self._include:
+            return any(match_path(pattern, name)
+                       for pattern in self._include)
+        return True
+
+    __call__ = matches
+
+    def merged(self, other):
+        """Combine with higher-priority rules.
+
+        Exclude patterns from both are used. The include patterns of
+        *other* replace ours if it has any.
+
+        Parameters
+        ----------
+        other : OutputRules
+            Rules that take precedence (for example, a run's own rules
+            over the site's).
+
+        Returns
+        -------
+        OutputRules
+            The combined rules.
+
+        """
+        return OutputRules(include=other.include or self.include,
+                           exclude=self.exclude + other.exclude)
+
+    @classmethod
+    def from_config(clazz, config, section='output'):
+        """Create rules from a site configuration.
+
+        Parameters
+        ----------
+        config : SiteConfiguration
+            The configuration.
+        section : str, optional
+            Section with ``include`` and ``exclude`` options (default
+            is 'output').
+
+        Returns
+        -------
+        OutputRules
+            The rules.
+
+        """
+        rules = dict(config.section(section))
+        return clazz(include=rules.get('include'),
+                     exclude=rules.get('exclude'))
+
+    @classmethod
+    def from_path(clazz, path, section='output'):
+        """Create rules from an ini-style file.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+        section : str, optional
+            Section with ``include`` and ``exclude`` options (default
+            is 'output').
+
+        Returns
+        -------
+        OutputRules
+            The rules, which are empty if the file doesn't exist.
+
+        """
+        from configparser import ConfigParser
+
+        config = ConfigParser()
+        config.read(path)
+        if not config.has_section(section):
+            return clazz()
+        return clazz(include=config.get(section, 'include', fallback=None),
+                     exclude=config.get(section, 'exclude', fallback=None))
+
+    def __repr__(self):
+        return 'OutputRules(include=%r, exclude=%r)' % (self._include,
+                                                        self._exclude)
@@ -53,7 +53,7 @@ class Slave(object):
         """
         return self._url
 
-    def start_task(self, id, env=None, dir='.'):
+    def start_task(self, id, env=None, dir='.', **kwds):
         """Start tasks for the given job id.
 
         Parameters
@@ -64,6 +64,8 @@ class Slave(object):
             WMT environment variables (default is None).
         dir : str, optional
             The working directory for the job (default is current directory). 
+        **kwds
+            Additional keyword arguments passed to the task.
 
         Returns
         -------
@@ -74,7 +76,7 @@ class Slave(object):
         from .task import RunComponentCoupled
 
         self._tasks[id] = RunComponentCoupled(id, self.url, exe_env=env,
-                                              exe_dir=dir)
+                                              exe_dir=dir, **kwds)
         return self._tasks[id].execute()
 
     def report_error(self, id, message):
@@ -113,9 +115,35 @@ class Slave(object):
         """
         return self.report(id, 'success', message)
 
+    def finish(self, id, timeout=None):
+        """Wait for a task's outstanding reports to be delivered.
+
+        Parameters
+        ----------
+        id : str
+            The unique UUID for the job.
+        timeout : float, optional
+            Seconds to wait (default is to wait forever).
+
+        Returns
+        -------
+        bool
+            True if every report was delivered.
+
+        """
+        try:
+            task = self._tasks[id]
+        except KeyError:
+            return True
+        else:
+            return task.flush_reports(timeout)
+
     def report(self, id, status, message):
         """Report task status using `requests`.
 
+        If the task was started by this slave, the report is sent with
+        the task's reporter (and so is journaled if the task is).
+
         Parameters
         ----------
         id : str
@@ -133,6 +161,9 @@ class Slave(object):
         """
         import requests
 
+        if id in self._tasks:
+            return self._tasks[id].report(status, message)
+
         url = os.path.join(self.url, 'run/update')
         resp = requests.post(url, data={
             'uuid': id,
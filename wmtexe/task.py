@@ -2,9 +2,10 @@
 
 import os
 import sys
+import shutil
+import tempfile
 import subprocess
 import tarfile
-import shutil
 import json
 import threading
 import logging
@@ -14,6 +15,12 @@ import socket
 from cmt.component.model import Model
 from cmt.framework.services import register_component_classes
 
+from .manifest import (build_manifest, write_manifest, load_manifest,
+                       diff_manifest, is_unchanged)
+from .rules import OutputRules, OUTPUT_RULES_FILE
+from .janitor import discard, purge_in_background, RunMarker
+from .extract import extract_tarball
+
 
 logger = logging.getLogger(__name__)
 """Logger : Instance of Logging class."""
@@ -113,6 +120,36 @@ def create_user_execution_dir(run_id, prefix='~/.wmt'):
     return path
 
 
+def create_scratch_dir(run_id, scratch_dir):
+    """Create a private directory for a run on scratch space.
+
+    Parameters
+    ----------
+    run_id : str
+        A unique UUID for a job.
+    scratch_dir : str
+        Path to node-local scratch space. Environment variables (such
+        as ``$TMPDIR``) and ``~`` are expanded.
+
+    Returns
+    -------
+    str or None
+        Path to the new directory, or None if *scratch_dir* is empty or
+        doesn't exist.
+
+    """
+    if not scratch_dir:
+        return None
+
+    scratch_dir = os.path.expandvars(os.path.expanduser(scratch_dir))
+    if not os.path.isdir(scratch_dir):
+        logger.warning('%s: scratch space not found, running in place' %
+                       scratch_dir)
+        return None
+
+    return tempfile.mkdtemp(prefix='wmt-%s-' % run_id, dir=scratch_dir)
+
+
 def components_to_run(path):
     """Define components to run.
 
@@ -278,6 +315,30 @@ class __open_reporter(object):
             reporter.report('error', 'THERE WAS AN ERROR!!!')
 
 
+def add_json_to_tarball(tar, name, obj):
+    """Add an object to an open tarball as a JSON file.
+
+    Parameters
+    ----------
+    tar : TarFile
+        Tarball opened for writing.
+    name : str
+        Name of the file in the tarball.
+    obj : object
+        JSON-serializable object.
+
+    """
+    import io
+    import time
+
+    contents = json.dumps(obj, indent=2, sort_keys=True).encode('utf-8')
+    info = tarfile.TarInfo(name)
+    info.size = len(contents)
+    info.mtime = time.time()
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(contents))
+
+
 def create_run_tarball(server, uuid):
     """Create a tarball of simulation inputs on a server.
 
@@ -608,15 +669,59 @@ class RunTask(WmtTaskReporter):
         Environment variables (default is None).
     exe_dir : str, optional
         Launch directory (default is '~/.wmt').
+    report_opts : dict, optional
+        Keyword arguments for the status `Reporter` (for example,
+        ``mode``, ``debounce``, ``min_interval`` and ``max_interval``).
+    engine : IoEngine, optional
+        If given, do status reporting, downloads and uploads on this
+        engine's event loop rather than in threads of our own.
+    journal : bool, optional
+        If True, journal reports on disk and deliver them in the
+        background (default is False).
+    upload_opts : dict, optional
+        If given, upload finished output files while the model runs,
+        using these keyword arguments for the `IncrementalUploader`
+        (default is to upload everything at teardown).
+    delta_upload : bool, optional
+        If True, leave input files that the simulation didn't change out
+        of the output tarball and list them in its manifest instead
+        (default is False).
+    output_rules : OutputRules, optional
+        Site rules for which output files to pack and upload. Rules in
+        an ``output.cfg`` file in the staged simulation are added to
+        these (default is to keep everything).
+    scratch_dir : str, optional
+        If given, stage the simulation on this node-local scratch space
+        (for example, ``$TMPDIR``) and run it there. Only the output
+        tarball is written back to *exe_dir*, and the scratch space is
+        removed when the task finishes (default is to run in *exe_dir*).
+    unpack_workers : int, optional
+        Number of threads to write small input files with when unpacking
+        the simulation (default is to write them one at a time).
 
     """
-    def __init__(self, run_id, server, exe_env=None, exe_dir='~/.wmt'):
-        super(RunTask, self).__init__(run_id, server, exe_dir=exe_dir)
+    def __init__(self, run_id, server, exe_env=None, exe_dir='~/.wmt',
+                 report_opts=None, engine=None, journal=False,
+                 upload_opts=None, delta_upload=False, output_rules=None,
+                 scratch_dir=None, unpack_workers=None):
+        super(RunTask, self).__init__(run_id, server, exe_dir=exe_dir,
+                                      engine=engine, journal=journal)
 
         self._wmt_dir = os.path.expandvars(os.path.expanduser(exe_dir))
+        self._scratch_dir = create_scratch_dir(run_id, scratch_dir)
+        self._stage_dir = self._scratch_dir or self._wmt_dir
         self._sim_dir = create_user_execution_dir(run_id,
-                                                  prefix=self._wmt_dir)
+                                                  prefix=self._stage_dir)
+        self._delivered = False
+        self._unpack_workers = unpack_workers
         self._env = exe_env
+        self._report_opts = report_opts or {}
+        self._upload_opts = upload_opts
+        self._uploader = None
+        self._delta_upload = delta_upload
+        self._inputs = {}
+        self._site_rules = output_rules or OutputRules()
+        self._rules = None
         self._result = {}
 
     @property
@@ -646,7 +751,7 @@ class RunTask(WmtTaskReporter):
     def setup(self):
         """Perform pre-simulation tasks."""
         self.report('downloading', 'downloading simulation data')
-        dest = self.download_tarball(dest_dir=self._wmt_dir)
+        dest = self.download_tarball(dest_dir=self._stage_dir)
         self.report('downloaded', 'downloaded simulation data')
 
         self.report('unpacking', 'unpacking simulation data')
@@ -672,21 +777,82 @@ class RunTask(WmtTaskReporter):
             self.report('uploading', str(error))
         else:
             self.report('uploaded', 'uploaded simulation output')
+            self._delivered = True
             self.cleanup()
 
         self.report_success('done')
 
     def execute(self):
-        """Set up, run, and tear down a simulation."""
-        self.setup()
-        self.run()
-        self.teardown()
+        """Set up, run, and tear down a simulation.
+
+        The run holds a `RunMarker` in the execution directory throughout,
+        so that the janitor of another job leaves it alone.
+        """
+        with RunMarker(self._wmt_dir, self.id):
+            try:
+                self.setup()
+                self.run()
+                self.teardown()
+            finally:
+                self.release_scratch()
+
+    def release_scratch(self):
+        """Remove the scratch space of a staged simulation.
+
+        If the output was not delivered, the simulation directory is
+        first moved back to the execution directory so that it isn't
+        lost.
+        """
+        if self._scratch_dir is None:
+            return
+
+        os.chdir(self._wmt_dir)
+        if not self._delivered and os.path.isdir(self._sim_dir):
+            dest = os.path.join(self._wmt_dir, self.id)
+            discard(dest, self._wmt_dir)
+            try:
+                shutil.move(self._sim_dir, dest)
+            except (IOError, OSError) as error:
+                logger.error('%s: unable to save simulation (%s)' %
+                             (self._sim_dir, error))
+            else:
+                self._sim_dir = dest
+        shutil.rmtree(self._scratch_dir, ignore_errors=True)
+        self._scratch_dir = None
+
+    @property
+    def output_rules(self):
+        """Rules for which output files to pack and upload.
+
+        Returns
+        -------
+        OutputRules
+            The site rules combined with the simulation's own.
+
+        """
+        if self._rules is None:
+            self._rules = self._site_rules.merged(OutputRules.from_path(
+                os.path.join(self.sim_dir, OUTPUT_RULES_FILE)))
+        return self._rules
+
+    @property
+    def inputs_manifest_path(self):
+        """Path to the manifest of the simulation's input files."""
+        return os.path.join(self._wmt_dir, self.id + '.inputs.json')
 
     def cleanup(self):
-        """Clean up files from a simulation."""
-        shutil.rmtree(self._sim_dir, ignore_errors=True)
+        """Clean up files from a simulation.
+
+        The files are moved to the trash and deleted by a background
+        process.
+        """
         tarball = os.path.join(self._wmt_dir, self.id + '.tar.gz')
-        os.remove(tarball)
+        paths = [tarball, self.inputs_manifest_path]
+        if self._scratch_dir is None:
+            paths.append(self._sim_dir)
+        for path in paths:
+            discard(path, self._wmt_dir)
+        purge_in_background(self._wmt_dir)
 
     def run_component(self, name, run_dir='.'):
         """Run a component.
@@ -717,6 +883,10 @@ class RunTask(WmtTaskReporter):
             Path to downloaded tarball.
 
         """
+        if self._engine is not None:
+            return self._engine.download(self._server, self.id,
+                                         dest_dir=dest_dir)
+
         info = create_run_tarball(self._server, self.id)
         tarball = download_run_tarball(info, dest_dir=dest_dir)
         delete_run_tarball(self._server, self.id)
@@ -731,31 +901,67 @@ class RunTask(WmtTaskReporter):
             Path to downloaded tarball.
 
         """
-        with tarfile.open(path) as tar:
-            def is_within_directory(directory, target):
-                
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-            
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-                
-                return prefix == abs_directory
-            
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-            
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-            
-                tar.extractall(path, members, numeric_owner=numeric_owner) 
-                
-            
-            safe_extract(tar, path=self._wmt_dir)
+        extract_tarball(path, dest=self._stage_dir,
+                        max_workers=self._unpack_workers)
+
+        if self._delta_upload:
+            self._inputs = build_manifest(self.sim_dir)
+            write_manifest(self.inputs_manifest_path, self._inputs)
+
+    def output_manifest(self):
+        """Describe the simulation output that isn't in the tarball.
+
+        Uploaded files are listed only if they still exist and haven't
+        changed since they were uploaded, as only those are left out of
+        the tarball.
+
+        Returns
+        -------
+        dict
+            The manifest, or an empty dict if everything is packed.
+
+        """
+        manifest = {}
+        if self._uploader is not None:
+            manifest['uploaded'] = dict(
+                (name, info) for name, info in
+                self._uploader.uploaded.items()
+                if self._uploader.is_uploaded(name))
+        if self._delta_upload:
+            unchanged, removed = diff_manifest(self.sim_dir, self._inputs)
+            manifest['inputs'] = unchanged
+            manifest['removed'] = removed
+        return manifest
+
+    def _pack_filter(self, tarinfo):
+        name = os.path.relpath(tarinfo.name, self.id)
+        if name == os.curdir:
+            return tarinfo
+        if tarinfo.isdir():
+            if self.output_rules.is_excluded(name):
+                return None
+        elif not self.output_rules.matches(name):
+            return None
+
+        if tarinfo.isfile():
+            if (self._uploader is not None and
+                    self._uploader.is_uploaded(name)):
+                return None
+            if (name in self._inputs and
+                    is_unchanged(self.sim_dir, name, self._inputs[name])):
+                return None
+        return tarinfo
 
     def pack_tarball(self):
         """Create tarball of simulation output.
 
+        Files excluded by the output rules are left out. Files that were
+        already uploaded while the model ran, and (with *delta_upload*)
+        unchanged input files, are left out and listed in a
+        ``_manifest.json`` file instead. The tarball is always written to
+        the execution directory, even for a simulation staged on scratch
+        space.
+
         Returns
         -------
         str
@@ -764,9 +970,17 @@ class RunTask(WmtTaskReporter):
         """
         os.chdir(self._wmt_dir)
 
+        if self._delta_upload and not self._inputs:
+            self._inputs = load_manifest(self.inputs_manifest_path)
+
         tarball = self.id + '.tar.gz'
         with tarfile.open(tarball, mode='w:gz') as tar:
-            tar.add(self.id)
+            tar.add(self.sim_dir, arcname=self.id, filter=self._pack_filter)
+
+            manifest = self.output_manifest()
+            if manifest:
+                add_json_to_tarball(
+                    tar, os.path.join(self.id, '_manifest.json'), manifest)
 
         return os.path.abspath(tarball)
 
@@ -779,7 +993,10 @@ class RunTask(WmtTaskReporter):
             Path to tarball to upload.
 
         """
-        resp = upload_run_tarball(self._server, path)
+        if self._engine is not None:
+            resp = self._engine.upload(self._server, self.id, path)
+        else:
+            resp = upload_run_tarball(self._server, path)
         try:
             self._result = json.loads(resp.text)
         except AttributeError:
@@ -807,11 +1024,10 @@ class RunComponentCoupled(RunTask):
     def run(self):
         os.chdir(self.sim_dir)
 
-        import yaml
         from datetime import datetime
+        from . import yamlio
 
-        with open(os.path.join(self.sim_dir, 'model.yaml'), 'r') as fp:
-            model = yaml.load(fp.read())
+        model = yamlio.load_file(os.path.join(self.sim_dir, 'model.yaml'))
 
         with open('info.yaml', 'w') as fp:
             info = {
@@ -823,18 +1039,31 @@ class RunComponentCoupled(RunTask):
                 'stdout': 'stdout',
                 'driver': model['driver'],
             }
-            yaml.dump(info, stream=fp, default_flow_style=False)
+            yamlio.dump(info, stream=fp, default_flow_style=False)
 
         # driver = os.path.join(self.sim_dir, model['driver'])
         status_file = os.path.abspath('stdout')
         with redirect_output(status_file, join=True):
-            with open_reporter(self.id, self.server, status_file):
+            with open_reporter(self.id, self.server, status_file,
+                               engine=self._engine, flusher=self.flusher,
+                               **self._report_opts):
                 # with open('model.yaml', 'r') as opened:
                 #     model = yaml.load(opened.read())
                 with open('components.yaml', 'r') as opened:
                     model = Model.load(opened.read())
 
                 self.report('running', 'running model')
-                model.go(filename='model.yaml')
+                if self._upload_opts is not None:
+                    from .upload import IncrementalUploader
+
+                    self._uploader = IncrementalUploader(
+                        self.id, self.server, self.sim_dir,
+                        include=self.output_rules, **self._upload_opts)
+                    self._uploader.start()
+                try:
+                    model.go(filename='model.yaml')
+                finally:
+                    if self._uploader is not None:
+                        self._uploader.stop()
 
         self.report('running', 'finished')
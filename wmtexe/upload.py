@@ -0,0 +1,236 @@
+"""Upload simulation output while a model is still running."""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+"""Logger : Instance of Logging class."""
+
+
+def open_files():
+    """Get the files this process has open.
+
+    Returns
+    -------
+    set of str
+        Absolute paths of open files (empty if they can't be found).
+
+    """
+    paths = set()
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return paths
+
+    for fd in fds:
+        try:
+            paths.add(os.readlink(os.path.join('/proc/self/fd', fd)))
+        except OSError:
+            pass
+    return paths
+
+
+def upload_file_in_chunks(server, uuid, path, name, chunk_size=8 << 20,
+                          session=None):
+    """Upload a file to the server in chunks.
+
+    Parameters
+    ----------
+    server : str
+        URL of API server.
+    uuid : str
+        The unique UUID for the job.
+    path : str
+        Path to the file.
+    name : str
+        Name of the file relative to the simulation directory.
+    chunk_size : int, optional
+        Bytes per chunk (default is 8 MiB).
+    session : requests.Session, optional
+        Session to send the chunks with.
+
+    Returns
+    -------
+    dict
+        The size and SHA-256 hash of the uploaded file.
+
+    """
+    from .task import UploadError
+
+    if session is None:
+        import requests
+        session = requests
+
+    url = os.path.join(server, 'run/upload/part')
+    size = os.path.getsize(path)
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as fp:
+        offset = 0
+        while 1:
+            chunk = fp.read(chunk_size)
+            sha.update(chunk)
+            resp = session.post(url, data={
+                'uuid': uuid,
+                'path': name,
+                'offset': offset,
+                'size': size,
+            }, files={'file': (os.path.basename(name), chunk)})
+            if resp.status_code != 200:
+                raise UploadError(resp.status_code, path)
+            offset += len(chunk)
+            if offset >= size:
+                break
+
+    return dict(size=size, sha256=sha.hexdigest())
+
+
+class IncrementalUploader(threading.Thread):
+    """Upload finished output files in the background.
+
+    A file is uploaded once it was written after the uploader started,
+    is not open in this process, and has not changed for *settle*
+    seconds. If it changes after being uploaded, it is uploaded again.
+
+    Parameters
+    ----------
+    id : str
+        A unique UUID for a job.
+    server : str
+        URL of API server.
+    run_dir : str
+        Directory to watch.
+    settle : float, optional
+        Seconds a file must go unmodified (default is 60).
+    interval : float, optional
+        Seconds between scans of *run_dir* (default is 10).
+    chunk_size : int, optional
+        Bytes per uploaded chunk (default is 8 MiB).
+    include : callable, optional
+        Called with a file's path relative to *run_dir*; the file is
+        skipped if it returns False.
+
+    """
+    def __init__(self, id, server, run_dir, settle=60., interval=10.,
+                 chunk_size=8 << 20, include=None):
+        super(IncrementalUploader, self).__init__(name='wmt-uploader')
+        self.daemon = True
+        self._id = id
+        self._server = server
+        self._run_dir = os.path.abspath(run_dir)
+        self._settle = settle
+        self._interval = interval
+        self._chunk_size = chunk_size
+        self._include = include or (lambda name: True)
+
+        self._start_time = time.time()
+        self._seen = {}
+        self._uploaded = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @property
+    def uploaded(self):
+        """Files that have been uploaded.
+
+        Returns
+        -------
+        dict
+            Size, modification time and SHA-256 hash of each uploaded
+            file, keyed by path relative to the run directory.
+
+        """
+        with self._lock:
+            return dict(self._uploaded)
+
+    def is_uploaded(self, name):
+        """Check if the current version of a file has been uploaded.
+
+        Parameters
+        ----------
+        name : str
+            Path relative to the run directory.
+
+        Returns
+        -------
+        bool
+            True if the file is unchanged since it was uploaded.
+
+        """
+        with self._lock:
+            info = self._uploaded.get(name)
+        if info is None:
+            return False
+        try:
+            stat = os.stat(os.path.join(self._run_dir, name))
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime) == (info['size'], info['mtime'])
+
+    def _ready_files(self):
+        now = time.time()
+        busy = open_files()
+        ready = []
+        for root, dirs, files in os.walk(self._run_dir):
+            for fname in files:
+                path = os.path.join(root, fname)
+                name = os.path.relpath(path, self._run_dir)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                key = (stat.st_size, stat.st_mtime)
+                last_seen, self._seen[name] = self._seen.get(name), key
+
+                if (stat.st_mtime < self._start_time or
+                        now - stat.st_mtime < self._settle or
+                        last_seen != key or path in busy or
+                        not self._include(name) or self.is_uploaded(name)):
+                    continue
+                ready.append((name, path, key))
+        return ready
+
+    def scan(self, session=None):
+        """Upload every file that is ready.
+
+        Parameters
+        ----------
+        session : requests.Session, optional
+            Session to upload with.
+
+        """
+        for name, path, (size, mtime) in self._ready_files():
+            if self._stop_event.is_set():
+                break
+            try:
+                info = upload_file_in_chunks(
+                    self._server, self._id, path, name,
+                    chunk_size=self._chunk_size, session=session)
+            except Exception as error:
+                logger.warning('%s: unable to upload (%s)' % (name, error))
+                continue
+            if (info['size'], os.path.getmtime(path)) == (size, mtime):
+                info['mtime'] = mtime
+                with self._lock:
+                    self._uploaded[name] = info
+                logger.info('%s: uploaded' % name)
+
+    def run(self):
+        """Scan and upload until stopped."""
+        import requests
+
+        session = requests.Session()
+        try:
+            while not self._stop_event.wait(self._interval):
+                self.scan(session=session)
+        finally:
+            session.close()
+
+    def stop(self):
+        """Stop uploading, waiting for any upload in progress to finish."""
+        self._stop_event.set()
+        self.join()
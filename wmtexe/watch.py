@@ -0,0 +1,290 @@
+"""Watch files for changes in a wmt-exe environment."""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Load the inotify functions from the C library.
+
+    Returns
+    -------
+    CDLL or None
+        The C library, or None if inotify is not available.
+
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    else:
+        return libc
+
+
+def _get_errno():
+    import ctypes
+    return ctypes.get_errno()
+
+
+class FileWatcher(object):
+    """Base class for watching a set of files for changes.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files to watch. They need not exist yet.
+
+    """
+    def __init__(self, paths):
+        self._paths = [os.path.abspath(path) for path in paths]
+
+    @property
+    def paths(self):
+        """Files being watched."""
+        return list(self._paths)
+
+    def wait(self, timeout=None):
+        """Wait for a watched file to change.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum number of seconds to wait (default is to wait
+            forever).
+
+        Returns
+        -------
+        bool
+            True if a file changed, False on timeout or interrupt.
+
+        """
+        raise NotImplementedError('wait')
+
+    def interrupt(self):
+        """Wake up a thread blocked in `wait`."""
+        raise NotImplementedError('interrupt')
+
+    def fileno(self):
+        """File descriptor that becomes readable on a change.
+
+        Returns
+        -------
+        int or None
+            The descriptor, or None if the watcher must be polled.
+
+        """
+        return None
+
+    def close(self):
+        """Release resources used by the watcher."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class InotifyWatcher(FileWatcher):
+    """Watch files using Linux inotify.
+
+    The parent directory of each file is watched so that files can be
+    created, or replaced by a rename, after the watch starts.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files to watch.
+
+    """
+    def __init__(self, paths):
+        super(InotifyWatcher, self).__init__(paths)
+
+        libc = _load_inotify()
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            err = _get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._dirs = {}
+        self._targets = set()
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        for path in self._paths:
+            dirname, basename = os.path.split(path)
+            if dirname not in self._dirs.values():
+                wd = libc.inotify_add_watch(self._fd,
+                                            dirname.encode('utf-8'), mask)
+                if wd < 0:
+                    err = _get_errno()
+                    os.close(self._fd)
+                    raise OSError(err, os.strerror(err), dirname)
+                self._dirs[wd] = dirname
+            self._targets.add((dirname, basename))
+
+        self._wake_r, self._wake_w = os.pipe()
+        # interrupt may be called from another thread while the watcher
+        # is being closed, so it must never write to a closed descriptor.
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _read_events(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return False
+            raise
+
+        changed = False
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode(
+                'utf-8', 'replace')
+            offset += length
+            if (self._dirs.get(wd), name) in self._targets:
+                changed = True
+        return changed
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while 1:
+            remaining = None if deadline is None else max(
+                deadline - time.time(), 0.)
+            ready, _, _ = select.select([self._fd, self._wake_r], [], [],
+                                        remaining)
+            if self._wake_r in ready:
+                os.read(self._wake_r, 4096)
+                return False
+            if not ready:
+                return False
+            if self._read_events():
+                return True
+
+    def fileno(self):
+        return self._fd
+
+    def interrupt(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                os.write(self._wake_w, b'x')
+            except OSError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for fd in (self._fd, self._wake_r, self._wake_w):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+            self._wake_w = None
+
+
+class PollingWatcher(FileWatcher):
+    """Watch files by checking their size and modification time.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files to watch.
+    poll_interval : float, optional
+        Seconds between checks (default is 1).
+
+    """
+    def __init__(self, paths, poll_interval=1.):
+        super(PollingWatcher, self).__init__(paths)
+        self._poll_interval = poll_interval
+        self._interrupt = threading.Event()
+        self._stats = self._stat_all()
+
+    def _stat_all(self):
+        stats = []
+        for path in self._paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stats.append(None)
+            else:
+                stats.append((stat.st_mtime, stat.st_size, stat.st_ino))
+        return stats
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while 1:
+            stats = self._stat_all()
+            if stats != self._stats:
+                self._stats = stats
+                return True
+
+            interval = self._poll_interval
+            if deadline is not None:
+                interval = min(interval, deadline - time.time())
+                if interval <= 0:
+                    return False
+            if self._interrupt.wait(interval):
+                self._interrupt.clear()
+                return False
+
+    def interrupt(self):
+        self._interrupt.set()
+
+
+def watch_files(paths, poll_interval=1.):
+    """Create a watcher for a set of files.
+
+    An `InotifyWatcher` is used where available, otherwise a
+    `PollingWatcher`.
+
+    Parameters
+    ----------
+    paths : list of str
+        Files to watch.
+    poll_interval : float, optional
+        Seconds between checks if polling (default is 1).
+
+    Returns
+    -------
+    FileWatcher
+        The watcher.
+
+    """
+    try:
+        return InotifyWatcher(paths)
+    except OSError:
+        return PollingWatcher(paths, poll_interval=poll_interval)
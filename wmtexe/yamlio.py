@@ -0,0 +1,122 @@
+"""Read and write YAML for a wmt-exe environment.
+
+YAML is loaded and dumped with the safe LibYAML loader and dumper when
+PyYAML was built with them, and with the pure-Python ones otherwise.
+Parsed files are cached by path and modification time, so a file read
+by several parts of a run is only parsed once.
+"""
+
+import os
+import copy
+import threading
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+YAMLError = yaml.YAMLError
+
+_parsed = {}
+_parsed_lock = threading.Lock()
+
+
+def load(stream):
+    """Load a YAML document.
+
+    Parameters
+    ----------
+    stream : str or file_like
+        YAML document.
+
+    Returns
+    -------
+    object
+        The parsed document.
+
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump(data, stream=None, **kwds):
+    """Dump an object as YAML.
+
+    Parameters
+    ----------
+    data : object
+        Object to dump.
+    stream : file_like, optional
+        File to write to. If not given, the YAML is returned.
+    **kwds
+        Keyword arguments passed on to `yaml.dump`.
+
+    Returns
+    -------
+    str or None
+        The YAML document, if no *stream* was given.
+
+    """
+    return yaml.dump(data, stream=stream, Dumper=SafeDumper, **kwds)
+
+
+def load_file(path):
+    """Load a YAML file, reusing the result of an earlier parse.
+
+    A file is parsed again only if its modification time or size has
+    changed. Each call returns a new copy of the document, so callers
+    are free to modify it.
+
+    Parameters
+    ----------
+    path : str
+        Path to a YAML file.
+
+    Returns
+    -------
+    object
+        The parsed document.
+
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _parsed_lock:
+        cached = _parsed.get(path)
+    if cached is None or cached[0] != stamp:
+        with open(path, 'r') as fp:
+            cached = (stamp, load(fp))
+        with _parsed_lock:
+            _parsed[path] = cached
+
+    return copy.deepcopy(cached[1])
+
+
+def clear_cache():
+    """Forget all previously parsed files."""
+    with _parsed_lock:
+        _parsed.clear()
+
+
+def dump_status(status):
+    """Serialize a task status for the server.
+
+    The status is written in YAML's flow style, which is much cheaper to
+    produce than block style. Unlike JSON, it keeps floats such as
+    ``1e-05`` and ``.nan`` as numbers for a YAML parser on the server.
+
+    Parameters
+    ----------
+    status : dict
+        Task status.
+
+    Returns
+    -------
+    str
+        The serialized status.
+
+    """
+    return dump(status, default_flow_style=True)